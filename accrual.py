@@ -0,0 +1,100 @@
+import time
+
+
+class _Observation:
+    __slots__ = ('running', 'rate', 'zone')
+
+    def __init__(self, running, rate, zone):
+        self.running = running
+        self.rate = rate
+        self.zone = zone
+
+
+class CostAccrualEngine:
+    """Charges each instance for the time it actually ran between two inventory snapshots
+
+    Observation windows are measured on the monotonic clock. Instance start and
+    stop timestamps reported by the Compute API are mapped onto that clock using
+    the wall/monotonic pair recorded with each snapshot, so instances that start
+    or stop mid-interval are only charged for the part of the window they ran.
+    ``rates_for`` returns the hourly rates of a snapshot's instances in one call,
+    so each distinct machine shape can be priced once however large the fleet.
+    """
+
+    def __init__(self, rates_for, since=None, clock=time):
+        self.rates_for = rates_for
+        self.clock = clock
+        # Nothing that ran before this wall time is charged
+        self.since = since if since is not None else clock.time()
+        self.last_observed = None
+        self.hourly_rate = 0.0
+        self.charges = {}
+        self.zone_charges = {}
+        self._previous = {}
+
+    def observe(self, snapshot):
+        """Return the cost accrued since the previous snapshot"""
+        offset = snapshot.wall_time - snapshot.taken_at
+        window_end = snapshot.taken_at
+        if self.last_observed is not None:
+            window_start = self.last_observed
+        else:
+            window_start = self.since - offset
+
+        def to_monotonic(wall_time):
+            return wall_time - offset if wall_time is not None else None
+
+        def overlap(start, end):
+            return max(0.0, min(end, window_end) - max(start, window_start))
+
+        charges = {}
+        zone_charges = {}
+        observations = {}
+        hourly_rate = 0.0
+        for record, rate in zip(snapshot.instances, self.rates_for(snapshot.instances)):
+            previous = self._previous.get(record.id)
+            was_running = previous is not None and previous.running
+            start = to_monotonic(record.last_start or record.created_at)
+            stop = to_monotonic(record.last_stop)
+
+            seconds = 0.0
+            if record.running:
+                seconds += overlap(start if start is not None else window_start, window_end)
+                # Stopped and started again since the last observation
+                if was_running and start is not None and stop is not None and window_start < stop <= start:
+                    seconds += overlap(window_start, stop)
+                hourly_rate += rate
+            elif start is not None and stop is not None and stop >= start:
+                seconds += overlap(start, stop)
+            elif was_running:
+                # No stop time reported yet, charge up to this observation
+                seconds += overlap(window_start, window_end)
+
+            if seconds > 0:
+                charges[record.name] = rate * seconds / 3600.0
+                zone_charges[record.zone] = zone_charges.get(record.zone, 0.0) + charges[record.name]
+            observations[record.id] = _Observation(record.running, rate, record.zone)
+
+        # Instances deleted since the last observation are charged up to now,
+        # since the Compute API no longer reports when they stopped
+        for instance_id, previous in self._previous.items():
+            if instance_id not in observations and previous.running:
+                seconds = overlap(window_start, window_end)
+                if seconds > 0:
+                    cost = previous.rate * seconds / 3600.0
+                    charges[f"deleted-{instance_id}"] = cost
+                    zone_charges[previous.zone] = zone_charges.get(previous.zone, 0.0) + cost
+
+        self._previous = observations
+        self.last_observed = window_end
+        self.hourly_rate = hourly_rate
+        self.charges = charges
+        self.zone_charges = zone_charges
+        return sum(charges.values())
+
+    def unobserved_cost(self):
+        """Cost accrued since the last snapshot if the fleet kept its last observed shape"""
+        if self.last_observed is None:
+            return 0.0
+        elapsed = max(0.0, self.clock.monotonic() - self.last_observed)
+        return self.hourly_rate * elapsed / 3600.0
@@ -0,0 +1,184 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import cost_manager
+from environments import EnvironmentConfig
+from fake_gcp import FakeClientFactory, FakeFleet, install_fake_terraform
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ID = 'bench-project'
+ENV_NAME = 'bench'
+ZONES = ['us-central1-a', 'us-central1-b', 'us-central1-c']
+MACHINE_TYPE = 'n2-standard-8'
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(values):
+    return {
+        'mean': statistics.fmean(values),
+        'p50': percentile(values, 0.5),
+        'p95': percentile(values, 0.95),
+        'max': max(values),
+    }
+
+
+def git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except Exception:
+        return None
+
+
+def bench_fleet(instances, ticks, latency, operation_latency, terraform_latency, teardown_action):
+    """Run one fleet size in a scratch directory and return its measurements"""
+    workdir = tempfile.mkdtemp(prefix=f'spender-bench-{instances}-')
+    previous_dir = os.getcwd()
+    previous_env = dict(os.environ)
+    try:
+        for path in glob.glob(os.path.join(REPO_DIR, '*.tf')) + [os.path.join(REPO_DIR, 'pricing_catalog.json')]:
+            shutil.copy(path, workdir)
+        install_fake_terraform(workdir)
+        os.chdir(workdir)
+        os.environ.update({
+            'PATH': f"{workdir}{os.pathsep}{os.environ.get('PATH', '')}",
+            'FAKE_TERRAFORM_LATENCY': str(terraform_latency),
+            'LEDGER_PATH': os.path.join(workdir, 'ledger.jsonl'),
+            'TEARDOWN_ACTION': teardown_action,
+            'TARGET_ENV': ENV_NAME,
+            'METRIC_FLUSH_SECONDS': '3600',
+        })
+        for name in ('ENVIRONMENTS_FILE', 'TARGET_ENVS', 'GCP_ZONES'):
+            os.environ.pop(name, None)
+
+        fleet = FakeFleet(PROJECT_ID)
+        per_zone, extra = divmod(instances, len(ZONES))
+        for index, zone in enumerate(ZONES):
+            fleet.add(ENV_NAME, zone, per_zone + (1 if index < extra else 0), MACHINE_TYPE,
+                      started_at=time.time() - 60)
+        clients = FakeClientFactory({PROJECT_ID: fleet}, latency, operation_latency)
+        config = EnvironmentConfig(ENV_NAME, PROJECT_ID, None, ZONES[0], instances, MACHINE_TYPE,
+                                   target_spend=1e9, zones=ZONES)
+
+        started = time.perf_counter()
+        manager = cost_manager.GCPCostManager(environments=[config], clients=clients)
+        construct_seconds = time.perf_counter() - started
+        construct_rpcs = clients.counter.total()
+
+        # Latency is measured without tracemalloc, which slows allocation down
+        tick_seconds = []
+        tick_rpcs = []
+        for _ in range(ticks):
+            before = clients.counter.total()
+            started = time.perf_counter()
+            manager.check_and_manage_resources()
+            tick_seconds.append(time.perf_counter() - started)
+            tick_rpcs.append(clients.counter.total() - before)
+
+        tracemalloc.start()
+        peak_bytes = []
+        retained_bytes = []
+        for _ in range(ticks):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            manager.check_and_manage_resources()
+            after, peak = tracemalloc.get_traced_memory()
+            peak_bytes.append(peak - current)
+            retained_bytes.append(after - current)
+        tracemalloc.stop()
+
+        env = manager.environments[0]
+        env.config.target_spend = 0.0
+        before = clients.counter.total()
+        started = time.perf_counter()
+        due = manager.evaluate_budget()
+        manager.retire_environments(due)
+        teardown_seconds = time.perf_counter() - started
+        teardown_rpcs = clients.counter.total() - before
+        for future in manager.reconciles:
+            future.result()
+        reconciled_seconds = time.perf_counter() - started
+
+        manager.metric_exporter.close()
+        manager.ledger.close()
+        manager.executor.shutdown()
+        return {
+            'instances': instances,
+            'construct_seconds': construct_seconds,
+            'construct_rpcs': construct_rpcs,
+            'tick_seconds': summarize(tick_seconds),
+            'rpcs_per_tick': statistics.fmean(tick_rpcs),
+            'alloc_peak_bytes_per_tick': summarize(peak_bytes),
+            'alloc_retained_bytes_per_tick': summarize(retained_bytes),
+            'teardown_seconds': teardown_seconds,
+            'teardown_rpcs': teardown_rpcs,
+            'teardown_remaining_instances': len(fleet.instances),
+            'reconciled_seconds': reconciled_seconds,
+            'rpcs_by_method': clients.counter.snapshot(),
+        }
+    finally:
+        os.chdir(previous_dir)
+        os.environ.clear()
+        os.environ.update(previous_env)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    """Benchmark the controller against in-process fake GCP clients and a fake terraform binary"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--sizes', default='10,100,1000', help='Comma-separated fleet sizes')
+    parser.add_argument('--ticks', type=int, default=20, help='Ticks measured per fleet size')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every fake RPC')
+    parser.add_argument('--operation-latency', type=float, default=None,
+                        help='Seconds until a delete or stop operation completes (defaults to --latency)')
+    parser.add_argument('--terraform-latency', type=float, default=0.5, help='Seconds each fake terraform call takes')
+    parser.add_argument('--teardown-action', default='delete', choices=('delete', 'stop', 'terraform'))
+    parser.add_argument('--output', help='Write the JSON results here instead of stdout')
+    args = parser.parse_args()
+
+    # Per-tick logging would dominate what is being measured
+    logging.disable(logging.WARNING)
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'timestamp': time.time(),
+        'parameters': {
+            'ticks': args.ticks,
+            'latency': args.latency,
+            'operation_latency': args.operation_latency,
+            'terraform_latency': args.terraform_latency,
+            'teardown_action': args.teardown_action,
+        },
+        'fleets': [],
+    }
+    for size in [int(size) for size in args.sizes.split(',') if size.strip()]:
+        results['fleets'].append(bench_fleet(size, args.ticks, args.latency, args.operation_latency,
+                                             args.terraform_latency, args.teardown_action))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,73 +1,308 @@
+import argparse
+import itertools
 import json
-import subprocess
-
-# Configuration variables (example values, replace with real data)
-PROJECT_ID = "e360-lab"
-REGION = "us-central1"
-TARGET_SPEND = 20000.00  # USD
-INSTANCE_HOURLY_COST = 200.00  # USD/hour for chosen instance type (e.g., a large GPU instance)
-HOURS = 24
-
-# This script attempts to:
-# 1. Check CPU quota in the given project/region.
-# 2. Calculate how many instances are needed to spend TARGET_SPEND in HOURS using INSTANCE_HOURLY_COST.
-# 3. Compare required instance count with available quota.
-
-def get_quota():
-    # Retrieve quota information as JSON
-    # 'compute project-info describe' often doesn't directly provide quota in JSON,
-    # so we use 'gcloud compute regions describe' to get regional quotas, or
-    # 'gcloud projects describe' for some global quotas.
-    # Below we assume a regional check:
-    cmd = ["gcloud", "compute", "regions", "describe", REGION, "--project", PROJECT_ID, "--format=json"]
-    output = subprocess.check_output(cmd)
-    data = json.loads(output)
-    return data
-
-def find_cpu_quota(data):
-    # Find the CPU quota from the region's quota data
-    # The JSON includes a 'quotas' field like:
-    # "quotas": [
-    #   {
-    #     "metric": "CPUS",
-    #     "limit": 500,
-    #     "usage": 0
-    #   },
-    #   ...
-    # ]
-    for quota in data.get("quotas", []):
-        if quota["metric"] == "CPUS":
-            return quota["limit"] - quota["usage"]
-    return 0
+import logging
+import math
+import os
+import time
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from pricing import PricingCatalog, DEFAULT_CATALOG_PATH, family_of
+
+DEFAULT_PLAN_PATH = 'fleet_plan.json'
+DEFAULT_CACHE_PATH = '.planner_cache.json'
+
+# Every worker gets a 100 GB boot disk and an ephemeral external IP (see main.tf)
+BOOT_DISK_GB = 100
+
+# Families with their own regional CPU quota; everything else counts against CPUS
+FAMILY_CPU_QUOTAS = {
+    'n2': 'N2_CPUS',
+    'n2d': 'N2D_CPUS',
+    'c2': 'C2_CPUS',
+    'c2d': 'C2D_CPUS',
+    'c3': 'C3_CPUS',
+    'm1': 'M1_CPUS',
+    't2d': 'T2D_CPUS',
+}
+
+
+class PlannerCatalog:
+    """Machine types and quotas for a project's regions, fetched once and cached on disk
+
+    One aggregated machine-types call covers every zone, plus one call per region
+    for regional quotas and one for project-wide quotas. The result is reused for
+    ``ttl`` seconds.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=86400.0):
+        self.path = path
+        self.ttl = ttl
+        self.project_id = None
+        self.fetched_at = None
+        self.machine_types = {}
+        self.quotas = {}
+
+    def load(self, project_id, regions, clients=None, refresh=False):
+        """Return self with data for ``regions``, from the cache if it is fresh enough"""
+        if not refresh and self._read_cache(project_id, regions):
+            logging.info(f"Using cached machine types and quotas from {self.path}")
+            return self
+        self._fetch(project_id, regions, clients)
+        self._write_cache()
+        return self
+
+    def _read_cache(self, project_id, regions):
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        if data.get('project_id') != project_id or time.time() - data.get('fetched_at', 0) > self.ttl:
+            return False
+        if not set(regions) <= set(data.get('quotas', {})):
+            return False
+        self.project_id = project_id
+        self.fetched_at = data['fetched_at']
+        self.machine_types = data['machine_types']
+        self.quotas = data['quotas']
+        return True
+
+    def _write_cache(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'project_id': self.project_id,
+                'fetched_at': self.fetched_at,
+                'machine_types': self.machine_types,
+                'quotas': self.quotas,
+            }, f)
+        os.replace(tmp_path, self.path)
+
+    def _fetch(self, project_id, regions, clients):
+        from google.cloud import compute_v1
+
+        if clients is None:
+            from transport import RefreshingCredentials, ClientFactory
+            clients = ClientFactory(RefreshingCredentials())
+
+        machine_types = {}
+        pages = clients.client(compute_v1.MachineTypesClient).aggregated_list(
+            request=compute_v1.AggregatedListMachineTypesRequest(project=project_id)
+        )
+        for scope, scoped_list in pages:
+            zone = scope.rsplit('/', 1)[-1]
+            if zone.rsplit('-', 1)[0] not in regions:
+                continue
+            for machine_type in scoped_list.machine_types:
+                if machine_type.is_shared_cpu or machine_type.deprecated.state:
+                    continue
+                entry = machine_types.setdefault(machine_type.name, {
+                    'vcpus': machine_type.guest_cpus,
+                    'memory_gb': machine_type.memory_mb / 1024.0,
+                    'zones': [],
+                })
+                entry['zones'].append(zone)
+
+        quotas = {}
+        regions_client = clients.client(compute_v1.RegionsClient)
+        for region in regions:
+            info = regions_client.get(project=project_id, region=region)
+            quotas[region] = {quota.metric: quota.limit - quota.usage for quota in info.quotas}
+        project = clients.client(compute_v1.ProjectsClient).get(project=project_id)
+        quotas['global'] = {quota.metric: quota.limit - quota.usage for quota in project.quotas}
+
+        for entry in machine_types.values():
+            entry['zones'].sort()
+        self.project_id = project_id
+        self.fetched_at = time.time()
+        self.machine_types = machine_types
+        self.quotas = quotas
+        logging.info(f"Fetched {len(machine_types)} machine types and quotas for {', '.join(regions)}")
+
+
+class _Candidate:
+    __slots__ = ('name', 'price', 'usage', 'zones')
+
+    def __init__(self, name, price, usage, zones):
+        self.name = name
+        self.price = price
+        self.usage = usage
+        self.zones = zones
+
+
+class FleetPlanner:
+    """Searches machine-type mixes for the fleet that reaches a target spend within a deadline
+
+    A plan is feasible when its hourly rate reaches the target within the deadline
+    without exceeding any regional or project quota (per-family CPUs, CPUS,
+    CPUS_ALL_REGIONS, INSTANCES, IN_USE_ADDRESSES, DISKS_TOTAL_GB). Feasible plans
+    are ranked by instance count, which is also the number of create and delete
+    operations, then by number of machine types, then by burn rate. Each mix is
+    filled greedily from its most expensive type; prices and quota usage are
+    precomputed per type, so scoring a mix is a few dict operations and no API
+    calls.
+    """
+
+    def __init__(self, catalog, pricing, max_pools=1):
+        self.catalog = catalog
+        self.pricing = pricing
+        self.max_pools = max_pools
+        self.evaluated = 0
+
+    def candidates(self, region):
+        """Priced machine types available in ``region``, most expensive first"""
+        quotas = self.catalog.quotas.get(region, {})
+        candidates = []
+        for name, entry in self.catalog.machine_types.items():
+            zones = [zone for zone in entry['zones'] if zone.rsplit('-', 1)[0] == region]
+            family = family_of(name)
+            if not zones or family not in self.pricing.families:
+                continue
+            cpu_price, memory_price = self.pricing.rates(family, region)
+            price = entry['vcpus'] * cpu_price + entry['memory_gb'] * memory_price
+            cpu_quota = FAMILY_CPU_QUOTAS.get(family)
+            if cpu_quota not in quotas:
+                cpu_quota = 'CPUS'
+            usage = {
+                cpu_quota: entry['vcpus'],
+                'CPUS_ALL_REGIONS': entry['vcpus'],
+                'INSTANCES': 1,
+                'IN_USE_ADDRESSES': 1,
+                'DISKS_TOTAL_GB': BOOT_DISK_GB,
+            }
+            candidates.append(_Candidate(name, price, usage, zones))
+        candidates.sort(key=lambda candidate: -candidate.price)
+        return candidates
+
+    def _fill(self, mix, rate_needed, available):
+        """Greedily size a mix, returning (counts, rate) or None if it can't reach the rate"""
+        remaining = dict(available)
+        counts = []
+        rate = 0.0
+        for candidate in mix:
+            wanted = math.ceil((rate_needed - rate) / candidate.price - 1e-9)
+            cap = wanted
+            for metric, amount in candidate.usage.items():
+                if metric in remaining:
+                    cap = min(cap, int(remaining[metric] // amount))
+            if cap <= 0:
+                return None
+            for metric, amount in candidate.usage.items():
+                if metric in remaining:
+                    remaining[metric] -= cap * amount
+            counts.append(cap)
+            rate += cap * candidate.price
+            if rate >= rate_needed - 1e-9:
+                # A mix whose later types aren't needed is a smaller mix, evaluated on its own
+                return (counts, rate) if len(counts) == len(mix) else None
+        return None
+
+    def plan(self, regions, target_spend, deadline_hours):
+        """Return the best feasible plan as a dict, or None"""
+        rate_needed = target_spend / deadline_hours
+        best = None
+        best_key = None
+        self.evaluated = 0
+        for region in regions:
+            available = dict(self.catalog.quotas.get('global', {}))
+            available.update(self.catalog.quotas.get(region, {}))
+            candidates = self.candidates(region)
+            for pools in range(1, self.max_pools + 1):
+                for mix in itertools.combinations(candidates, pools):
+                    self.evaluated += 1
+                    filled = self._fill(mix, rate_needed, available)
+                    if filled is None:
+                        continue
+                    counts, rate = filled
+                    key = (sum(counts), pools, -rate)
+                    if best_key is None or key < best_key:
+                        best_key = key
+                        best = (region, mix, counts, rate)
+
+        if best is None:
+            return None
+        region, mix, counts, rate = best
+        return {
+            'region': region,
+            'pools': [
+                {
+                    'machine_type': candidate.name,
+                    'instance_count': count,
+                    'zones': candidate.zones,
+                    'hourly_price': candidate.price,
+                }
+                for candidate, count in zip(mix, counts)
+            ],
+            'instance_count': sum(counts),
+            'hourly_rate': rate,
+            'hours_to_target': target_spend / rate,
+        }
+
+
+def write_plan(path, plan):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(plan, f, indent=2)
+        f.write('\n')
+    os.replace(tmp_path, path)
+
 
 def main():
-    data = get_quota()
-    available_cpus = find_cpu_quota(data)
+    """Plan the fleet that reaches TARGET_SPEND within a deadline under the project's quotas"""
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--project', default=os.getenv('GCP_PROJECT_ID'))
+    parser.add_argument('--env', default=os.getenv('TARGET_ENV', 'e360'),
+                        help='Environment the plan is applied to')
+    parser.add_argument('--region', action='append',
+                        help='Region to consider (repeatable; defaults to PLAN_REGIONS or GCP_REGION)')
+    parser.add_argument('--target-spend', type=float, default=float(os.getenv('TARGET_SPEND', '0') or 0))
+    parser.add_argument('--hours', type=float, default=float(os.getenv('PLAN_DEADLINE_HOURS', '24')),
+                        help='Deadline for reaching the target spend')
+    parser.add_argument('--max-pools', type=int, default=int(os.getenv('PLAN_MAX_POOLS', '1')),
+                        help='Most machine types a plan may mix')
+    parser.add_argument('--pricing-catalog', default=os.getenv('PRICING_CATALOG_PATH', DEFAULT_CATALOG_PATH))
+    parser.add_argument('--cache', default=os.getenv('PLAN_CACHE_PATH', DEFAULT_CACHE_PATH))
+    parser.add_argument('--refresh', action='store_true', help='Ignore cached machine types and quotas')
+    parser.add_argument('--output', default=os.getenv('FLEET_PLAN_FILE', DEFAULT_PLAN_PATH))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
 
-    # Calculate how many instances needed
-    # Spend needed per hour: TARGET_SPEND / HOURS
-    needed_per_hour = TARGET_SPEND / HOURS
+    regions = args.region or [region.strip() for region in
+                              os.getenv('PLAN_REGIONS', os.getenv('GCP_REGION', '')).split(',') if region.strip()]
+    if not args.project or not regions or args.target_spend <= 0:
+        parser.error("a project, at least one region and a positive target spend are required")
 
-    # Number of instances = needed_per_hour / INSTANCE_HOURLY_COST
-    instances_needed = needed_per_hour / INSTANCE_HOURLY_COST
+    catalog = PlannerCatalog(args.cache).load(args.project, regions, refresh=args.refresh)
+    planner = FleetPlanner(catalog, PricingCatalog(args.pricing_catalog), max_pools=args.max_pools)
+    started = time.perf_counter()
+    plan = planner.plan(regions, args.target_spend, args.hours)
+    search_seconds = time.perf_counter() - started
+    print(f"Evaluated {planner.evaluated} candidate mixes in {search_seconds * 1000:.0f}ms")
 
-    # Round up since we need whole instances
-    instances_needed = int(instances_needed) if instances_needed == int(instances_needed) else int(instances_needed) + 1
+    if plan is None:
+        print(f"No fleet reaches ${args.target_spend:.2f} within {args.hours}h under the current quotas. "
+              f"Consider a longer deadline, more regions or a quota increase.")
+        return 1
 
-    # Now check if we have enough CPUs for that many instances.
-    # Assuming each instance is a certain machine type with known CPU count, e.g., 96 vCPUs per instance.
-    # Replace this with the actual vCPU count for your chosen instance type.
-    INSTANCE_VCPU = 64
-    total_vcpus_needed = instances_needed * INSTANCE_VCPU
+    plan.update({
+        'env': args.env,
+        'project_id': args.project,
+        'target_spend': args.target_spend,
+        'deadline_hours': args.hours,
+        'candidates_evaluated': planner.evaluated,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+    })
+    write_plan(args.output, plan)
 
-    print(f"Available CPUs: {available_cpus}")
-    print(f"Instances needed: {instances_needed}")
-    print(f"Total vCPUs required: {total_vcpus_needed}")
+    for pool in plan['pools']:
+        print(f"  {pool['instance_count']} x {pool['machine_type']} at ${pool['hourly_price']:.4f}/hour "
+              f"in {', '.join(pool['zones'])}")
+    print(f"Hourly rate: ${plan['hourly_rate']:.2f}/hour, target reached in {plan['hours_to_target']:.1f}h")
+    print(f"Wrote plan to {args.output}")
+    return 0
 
-    if total_vcpus_needed <= available_cpus:
-        print("You have sufficient quota to run this many instances.")
-    else:
-        print("You do NOT have sufficient CPU quota to meet the spending target. Consider fewer, more expensive instances or request a quota increase.")
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from instrumentation import telemetry
+
+# A cutoff projected closer than this is re-armed this far out, so that rounding
+# can't keep the timer firing without time moving on
+CUTOFF_RESOLUTION = 0.01
+
+
+class AsyncController:
+    """Runs the control loop against the monotonic clock
+
+    Each tick is scheduled relative to the previous tick's deadline rather than
+    its end, so the period doesn't drift. Without a forecaster the period is
+    ``interval``; with one it adapts to how close the nearest budget is, never
+    exceeding ``interval``, and a timer is armed for the projected teardown time
+    so the budget is enforced between ticks. Each phase runs in a worker
+    thread with its own timeout; a phase that overruns is left to finish in the
+    background and is skipped on later ticks until it does, while budget
+    enforcement continues on the projected cost. A budget decision that
+    overruns still has what it found due retired once it finishes.
+    """
+
+    def __init__(self, manager, interval, inventory_timeout=None, export_timeout=5.0,
+                 budget_timeout=5.0, provision_timeout=10.0, utilization_timeout=10.0, forecaster=None,
+                 clock=time):
+        self.manager = manager
+        self.interval = interval
+        self.forecaster = forecaster
+        self.inventory_timeout = inventory_timeout or min(interval * 0.5, 30.0)
+        self.export_timeout = export_timeout
+        self.budget_timeout = budget_timeout
+        self.provision_timeout = provision_timeout
+        self.utilization_timeout = utilization_timeout
+        self.clock = clock
+        self.ticks = 0
+        self.current_interval = interval
+        self.cutoffs = 0
+        self.skipped_ticks = 0
+        self.timeouts = {}
+        self.lateness = deque(maxlen=256)
+        self._inflight = {}
+        self._retiring = set()
+        self._cutoff_deadline = None
+        telemetry.gauge('tick_lateness_seconds', lambda: self.lateness[-1] if self.lateness else None)
+        telemetry.gauge('tick_interval_seconds', lambda: self.current_interval)
+
+    async def _run(self, name, fn, *args, timeout, late=None):
+        """Run ``fn`` in a worker thread, giving up waiting on it after ``timeout`` seconds
+
+        If it finishes after that, its result is passed to ``late``.
+        """
+        pending = self._inflight.get(name)
+        if pending is not None and not pending.done():
+            logging.warning(f"Previous {name} task still running, skipping it this tick")
+            return None
+
+        future = asyncio.get_running_loop().run_in_executor(None, fn, *args)
+        self._inflight[name] = future
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.timeouts[name] = self.timeouts.get(name, 0) + 1
+            telemetry.count('phase_timeouts', phase=name)
+            logging.warning(f"{name} task exceeded {timeout:.1f}s, continuing without it")
+            if late is not None:
+                future.add_done_callback(
+                    lambda done: late(done.result()) if not done.cancelled() and done.exception() is None else None)
+            return None
+        except Exception as e:
+            logging.error(f"Error in {name} task: {str(e)}")
+            return None
+
+    async def tick(self):
+        """Run one control tick, returning True once every environment has reached its target"""
+        snapshots = await self._run('inventory', self.manager.observe_fleet,
+                                    timeout=self.inventory_timeout)
+
+        # The budget decision uses the projected cost, so it still runs on a stale snapshot
+        budget = asyncio.create_task(self._run('budget', self.manager.evaluate_budget,
+                                               timeout=self.budget_timeout, late=self._retire))
+        export = asyncio.create_task(self._run('export', self.manager.export_metrics, snapshots,
+                                               timeout=self.export_timeout))
+        # Starts bulk provisioning that couldn't start before and reports runs that finished
+        provisioning = asyncio.create_task(self._run('provisioning', self.manager.poll_provisioning, snapshots,
+                                                     timeout=self.provision_timeout))
+        # Samples fleet CPU where due and replaces idle or crash-looping workers
+        utilization = asyncio.create_task(self._run('utilization', self.manager.check_utilization, snapshots,
+                                                    timeout=self.utilization_timeout))
+        due, _, _, _ = await asyncio.gather(budget, export, provisioning, utilization)
+        self._retire(due)
+        return self.manager.finished
+
+    async def cutoff(self):
+        """Re-evaluate budgets at the projected teardown time without listing the fleet"""
+        self.cutoffs += 1
+        pending = self._inflight.get('budget')
+        if pending is not None and not pending.done():
+            # A decision that overran is still under way and retires what it finds; re-arming
+            # at once would spin without letting it finish
+            await asyncio.wait({pending}, timeout=self.budget_timeout)
+        due = await self._run('budget', self.manager.evaluate_budget, timeout=self.budget_timeout,
+                              late=self._retire)
+        self._retire(due)
+        # Re-arm for the next environment, or for this one if it fired a hair early
+        self._next_interval()
+        return self.manager.finished
+
+    def _retire(self, due):
+        if due:
+            # Teardown takes a while; the other environments stay enforced meanwhile
+            self._retiring.add(asyncio.get_running_loop().run_in_executor(
+                None, self.manager.retire_environments, due))
+        self._retiring = {future for future in self._retiring if not future.done()}
+
+    async def _sleep(self, delay):
+        """Sleep for ``delay`` seconds, returning True early if a teardown finishes meanwhile"""
+        if not self._retiring:
+            await asyncio.sleep(delay)
+            return False
+        done, _ = await asyncio.wait(self._retiring, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+        self._retiring -= done
+        return bool(done)
+
+    def _next_interval(self):
+        """Period until the next tick, arming the cutoff timer if a budget is projected to run out"""
+        if self.forecaster is None:
+            return self.interval
+        try:
+            seconds = self.manager.next_cutoff()
+        except Exception as e:
+            logging.error(f"Error forecasting budget cutoff: {str(e)}")
+            return self.interval
+        self._cutoff_deadline = self.clock.monotonic() + max(seconds, CUTOFF_RESOLUTION) \
+            if seconds is not None else None
+        # The operator's interval stays the longest the fleet goes unlisted
+        return min(self.forecaster.poll_interval(seconds, self.interval), self.interval)
+
+    async def run(self):
+        """Tick until every environment has reached its budget target"""
+        deadline = self.clock.monotonic()
+        interval = self.interval
+        while True:
+            # Sleep until the next tick, waking early for a cutoff that falls before it
+            while True:
+                cutoff = self._cutoff_deadline
+                wake = deadline if cutoff is None else min(deadline, cutoff)
+                delay = wake - self.clock.monotonic()
+                if delay > 0:
+                    if await self._sleep(delay):
+                        if self.manager.finished:
+                            return True
+                        continue
+                else:
+                    # Worker threads' results are only delivered while the loop gets to run
+                    await asyncio.sleep(0)
+                if cutoff is None or cutoff >= deadline:
+                    break
+                self._cutoff_deadline = None
+                if await self.cutoff():
+                    return True
+            self.lateness.append(self.clock.monotonic() - deadline)
+
+            self.ticks += 1
+            with telemetry.span('tick'):
+                finished = await self.tick()
+            if finished:
+                return True
+
+            # Skip ticks that were missed entirely rather than bursting to catch up
+            interval = self.current_interval = self._next_interval()
+            deadline += interval
+            behind = math.floor((self.clock.monotonic() - deadline) / interval)
+            if behind > 0:
+                self.skipped_ticks += behind
+                telemetry.count('skipped_ticks', behind)
+                logging.warning(f"Tick overran by {behind} interval(s), skipping ahead")
+                deadline += behind * interval
+
+            if self.ticks % 60 == 0:
+                logging.info(f"Tick lateness over last {len(self.lateness)} ticks: "
+                             f"max {max(self.lateness) * 1000:.0f}ms, "
+                             f"mean {sum(self.lateness) / len(self.lateness) * 1000:.0f}ms")
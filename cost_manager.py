@@ -1,152 +1,478 @@
 import os
 import time
 import logging
-import uuid
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from google.cloud import monitoring_v3
 from google.cloud import compute_v1
 from google.cloud import resourcemanager_v3
-from datetime import datetime, timedelta
 import subprocess
 from dotenv import load_dotenv
 import json
 import sys
 import requests
+import hashlib
+import glob
+import re
 from urllib.parse import quote
+from inventory import FleetInventory
+from accrual import CostAccrualEngine
+from metric_exporter import MetricExporter, gauge_series, cumulative_series
+from ledger import CostLedger
+from rollups import RollupTracker, SPEND_METRIC, FLEET_SIZE_METRIC, CUMULATIVE_SPEND_METRIC
+from pricing import PricingCatalog, DEFAULT_CATALOG_PATH
+from controller import AsyncController
+from forecaster import BurnRateForecaster, DEFAULT_TEARDOWN_SECONDS
+from teardown import FleetTeardown
+from provisioning import BulkProvisioner, PROVISION_MODES
+from utilization import UtilizationHistory, UtilizationSampler, FleetHealth, UTILIZATION_ACTIONS, CRASH_LOOP
+from transport import RefreshingCredentials, ClientFactory
+from instrumentation import telemetry, serve as serve_telemetry, ErrorCounter
+from environments import Environment, load_environments, DEFAULT_ENV
+from log_pipeline import setup_logging
+from lease import LeaderElector, open_lease
+
+
+
+def terraform_backend():
+    """Type of the backend the Terraform configuration declares, None for local state"""
+    for path in sorted(glob.glob('*.tf')):
+        with open(path, 'r') as f:
+            match = re.search(r'^\s*backend\s+"([^"]+)"', f.read(), re.MULTILINE)
+        if match:
+            return match.group(1)
+    return None
+
+
+def terraform_stamp_path(env):
+    """Where the fingerprint of an environment's last successful apply is kept"""
+    return os.path.join('.terraform', f'spender-apply-{env.name}.sha256')
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S'
-)
 
 class GCPCostManager:
-    def __init__(self, project_id, target_spend, region=None, zone=None):
+    def __init__(self, project_id=None, target_spend=None, region=None, zone=None, environments=None,
+                 clients=None, standby=False, clock=time):
         # Force reload of environment variables first
         load_dotenv(override=True)
-        
-        self.project_id = project_id
-        self.target_spend = float(target_spend)
-        self.region = region
-        self.zone = zone
-        self.run_id = str(uuid.uuid4())[:8]
-        self.accumulated_cost = 0.0
-        self.last_update_time = time.time()
-        self.compute_client = compute_v1.InstancesClient()
-        self.machine_types_client = compute_v1.MachineTypesClient()
-        self.monitoring_client = monitoring_v3.MetricServiceClient()
-        
-        # Get machine type and instance count from environment
-        self.machine_type = os.getenv('MACHINE_TYPE')
-        self.instance_count = int(os.getenv('INSTANCE_COUNT'))
-        
-        # Get the cost per hour for this machine type
-        self.cost_per_hour = self.get_instance_cost_per_hour()
-        
-        logging.info(f"Initializing GCP Cost Manager with:")
-        logging.info(f"  Project ID: {project_id}")
-        logging.info(f"  Target Spend: ${target_spend}")
-        logging.info(f"  Machine Type: {self.machine_type}")
-        logging.info(f"  Instance Count: {self.instance_count}")
-        logging.info(f"  Run ID: {self.run_id}")
-        
-        # Initialize Terraform
+        # Every timer and timestamp goes through this, so a simulation can substitute a virtual clock
+        self.clock = clock
+
+        if environments is None:
+            environments = load_environments(project_id, target_spend, region, zone)
+        primary = os.getenv('TARGET_ENV', DEFAULT_ENV)
+        if primary not in [config.name for config in environments]:
+            primary = environments[0].name
+        self.environments = [Environment(config, primary=config.name == primary) for config in environments]
+
+        # Environments are worked on concurrently by a bounded pool, sharing one set of clients
+        workers = int(os.getenv('ENV_WORKERS', str(min(8, len(self.environments)))))
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='env')
+        if clients is None:
+            # Tokens are refreshed in process ahead of expiry, and every client shares
+            # one HTTP connection pool and one gRPC channel per API
+            credentials = RefreshingCredentials(
+                refresh_margin=float(os.getenv('TOKEN_REFRESH_MARGIN_SECONDS', '300'))
+            ).start()
+            clients = ClientFactory(credentials, pool_size=int(os.getenv('HTTP_POOL_SIZE', '64')))
+        self.clients = clients
+        self.compute_client = clients.client(compute_v1.InstancesClient)
+        self.machine_types_client = clients.client(compute_v1.MachineTypesClient)
+        self.monitoring_client = clients.client(monitoring_v3.MetricServiceClient)
+        self.pricing = PricingCatalog(
+            os.getenv('PRICING_CATALOG_PATH', DEFAULT_CATALOG_PATH),
+            machine_types_client=self.machine_types_client,
+            clock=clock
+        )
+        self.metric_exporter = MetricExporter(
+            self.monitoring_client,
+            flush_interval=float(os.getenv('METRIC_FLUSH_SECONDS', '10'))
+        ).start()
+
+        # Pick up where a previous process left off for environments that didn't finish their run
+        self.ledger = CostLedger(
+            os.getenv('LEDGER_PATH', 'spender_ledger.jsonl'),
+            fsync_interval=float(os.getenv('LEDGER_FSYNC_SECONDS', '30')),
+            clock=clock
+        )
+
+        # Teardown is started ahead of the projected crossing by the measured teardown time
+        self.forecaster = BurnRateForecaster(
+            teardown_seconds=float(os.getenv('TEARDOWN_ESTIMATE_SECONDS', str(DEFAULT_TEARDOWN_SECONDS))),
+            min_interval=float(os.getenv('POLL_MIN_SECONDS', '5')),
+            max_interval=float(os.getenv('POLL_MAX_SECONDS', '300'))
+        )
+
+        # Spend is stopped through the Compute API and Terraform catches up afterwards,
+        # unless TEARDOWN_ACTION=terraform asks for the plain terraform destroy
+        self.teardown_action = os.getenv('TEARDOWN_ACTION', 'delete')
+        self.fleet_teardown = None
+        if self.teardown_action != 'terraform':
+            self.fleet_teardown = FleetTeardown(
+                self.compute_client,
+                self.teardown_action,
+                max_workers=int(os.getenv('TEARDOWN_WORKERS', '64')),
+                deadline=float(os.getenv('TEARDOWN_DEADLINE_SECONDS', '120')),
+                clock=clock
+            )
+        self.reconciles = []
+
+        # PROVISION_MODE=bulk creates workers through the Compute bulk-insert API in the
+        # background, and Terraform only manages the resources around them
+        self.provision_mode = os.getenv('PROVISION_MODE', 'terraform')
+        if self.provision_mode not in PROVISION_MODES:
+            raise ValueError(f"Unknown PROVISION_MODE {self.provision_mode}, "
+                             f"expected one of {', '.join(PROVISION_MODES)}")
+        self.provisioner = None
+        self.provisioning = {}
+        self.provisioned = set()
+        if self.provision_mode == 'bulk':
+            if self.teardown_action != 'delete':
+                raise ValueError("PROVISION_MODE=bulk needs TEARDOWN_ACTION=delete, "
+                                 "Terraform doesn't know about bulk-created workers")
+            fallbacks = [name.strip() for name in os.getenv('PROVISION_FALLBACK_MACHINE_TYPES', '').split(',')
+                         if name.strip()]
+            self.provisioner = BulkProvisioner(
+                self.compute_client,
+                batch_size=int(os.getenv('PROVISION_BATCH_SIZE', '100')),
+                initial_batch=int(os.getenv('PROVISION_INITIAL_BATCH', '10')),
+                max_workers=int(os.getenv('PROVISION_WORKERS', '8')),
+                fallback_machine_types=fallbacks,
+                operation_timeout=float(os.getenv('PROVISION_OPERATION_TIMEOUT_SECONDS', '600')),
+                clock=clock
+            )
+
+        # Workers that run without working are found from one CPU query per project and
+        # interval and logged. Replacing them is opt-in: a worker that is idle by design
+        # would otherwise be deleted and created again for the whole campaign
+        self.utilization_action = os.getenv('UTILIZATION_ACTION', 'log')
+        if self.utilization_action not in UTILIZATION_ACTIONS:
+            raise ValueError(f"Unknown UTILIZATION_ACTION {self.utilization_action}, "
+                             f"expected one of {', '.join(UTILIZATION_ACTIONS)}")
+        self.utilization = None
+        self.fleet_health = None
+        self.replacements = {}
+        if self.utilization_action != 'off':
+            idle_samples = int(os.getenv('IDLE_SAMPLES', '10'))
+            history = UtilizationHistory(depth=max(15, idle_samples))
+            self.utilization = UtilizationSampler(
+                self.monitoring_client,
+                history,
+                interval=float(os.getenv('UTILIZATION_INTERVAL_SECONDS', '60')),
+                clock=clock
+            )
+            self.fleet_health = FleetHealth(
+                history,
+                idle_threshold=float(os.getenv('IDLE_CPU_THRESHOLD', '0.05')),
+                idle_samples=idle_samples,
+                startup_grace=float(os.getenv('STARTUP_GRACE_SECONDS', '900')),
+                crash_restarts=int(os.getenv('CRASH_LOOP_RESTARTS', '3')),
+                crash_window=float(os.getenv('CRASH_LOOP_WINDOW_SECONDS', '1800'))
+            )
+            self.max_replacements = int(os.getenv('UTILIZATION_MAX_REPLACEMENTS', '10'))
+            self.worker_deletes = FleetTeardown(
+                self.compute_client,
+                'delete',
+                max_workers=16,
+                deadline=float(os.getenv('TEARDOWN_DEADLINE_SECONDS', '120')),
+                clock=clock
+            )
+            # Replacements take minutes, so they run beside the control loop rather than on the env pool
+            self.replacer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='replace')
+
+        # Gauges are read when /metrics is scraped, never on the tick path
+        telemetry.gauge('metric_queue_depth', lambda: len(self.metric_exporter._queue))
+        telemetry.gauge('metric_points_dropped', lambda: self.metric_exporter.dropped)
+        telemetry.gauge('metric_points_coalesced', lambda: self.metric_exporter.coalesced)
+        telemetry.gauge('env_pool_queue_depth', lambda: self.executor._work_queue.qsize())
+        for env in self.environments:
+            telemetry.gauge('accumulated_cost_dollars', lambda env=env: env.accumulated_cost, env=env.name)
+            telemetry.gauge('hourly_burn_rate_dollars', lambda env=env: env.accrual.hourly_rate, env=env.name)
+            telemetry.gauge('seconds_to_cutoff', lambda env=env: self.seconds_to_cutoff(env) if env.active else None,
+                            env=env.name)
+
+        # One aggregated listing per project covers every zone and environment in it
+        self.inventories = {}
+        for env in self.environments:
+            if env.project_id not in self.inventories:
+                self.inventories[env.project_id] = FleetInventory(self.compute_client, env.project_id, clock=clock)
+
+        for env in self.environments:
+            env.inventory = self.inventories[env.project_id]
+            env.cost_per_hour = self.get_instance_cost_per_hour(env)
+
+        # Terraform is ready to destroy what a standby takes over without having applied it
+        self.terraform_ready = False
+        # Set while the default workspace's shared resources outlive its environment's workers
+        self.shared_destroy_pending = False
+        self._terraform_lock = threading.Lock()
+
+        # A standby only warms up until it holds the controller lease
+        if not standby:
+            self.start()
+
+    def start(self, new_runs=True):
+        """Resume or start every environment's run and bring its fleet up
+
+        A replica taking over from another passes ``new_runs=False``: it carries
+        on with the runs the ledger has open, leaving their fleets and Terraform
+        state as they are, and environments whose run already ended stay finished.
+        A restart does the same for environments that finished while others are
+        still running; new runs only start once every run has closed, or for
+        every environment with NEW_CAMPAIGN=true.
+        """
+        resumed_runs = self.ledger.load()
+        self.forecaster.teardowns.update(self.ledger.teardowns)
+        campaign_open = any(not resumed_runs[env.name].closed for env in self.environments
+                            if env.name in resumed_runs)
+        if campaign_open and os.getenv('NEW_CAMPAIGN', 'false').lower() == 'true':
+            logging.info("NEW_CAMPAIGN is set, starting new runs for environments that already finished")
+            campaign_open = False
+
+        for env in self.environments:
+            resumed = resumed_runs.get(env.name)
+            if resumed is not None and resumed.closed and campaign_open:
+                # Its budget is spent; it waits for the rest of the campaign instead of spending it again
+                logging.info(f"[{env.name}] Run {resumed.run_id} already finished at "
+                             f"${resumed.accumulated_cost:.2f}, keeping it finished")
+                env.run_id = resumed.run_id
+                env.accumulated_cost = resumed.accumulated_cost
+                env.status = Environment.FINISHED
+                continue
+            if resumed is not None and not resumed.closed:
+                env.resumed = True
+                env.run_id = resumed.run_id
+                env.accumulated_cost = resumed.accumulated_cost
+                env.zone_costs = dict(resumed.zone_costs)
+                env.last_update_time = resumed.checkpoint_time
+                env.started_at = resumed.started_at or resumed.checkpoint_time
+            elif not new_runs:
+                logging.info(f"[{env.name}] No run in progress to take over")
+                env.status = Environment.FINISHED
+                continue
+            else:
+                env.resumed = False
+                env.last_update_time = self.clock.time()
+                env.started_at = env.last_update_time
+            # Downsampled series for dashboards that look back weeks
+            env.rollups = RollupTracker(env.last_update_time, env.accumulated_cost)
+
+            # Each instance is priced by its own machine type and zone, so mixed fleets add up correctly.
+            # Spend between the last checkpoint and now is still owed on resume.
+            env.accrual = CostAccrualEngine(
+                lambda instances, env=env: self.instance_rates(env, instances),
+                since=env.last_update_time,
+                clock=self.clock
+            )
+            self.log_cost_summary(env)
+
+            logging.info(f"Initializing GCP Cost Manager for environment {env.name} with:")
+            logging.info(f"  Project ID: {env.project_id}")
+            logging.info(f"  Zones: {', '.join(env.zones)}")
+            logging.info(f"  Target Spend: ${env.target_spend}")
+            logging.info(f"  Machine Type: {env.machine_type}")
+            logging.info(f"  Instance Count: {env.instance_count}")
+            logging.info(f"  Run ID: {env.run_id}")
+
+            if env.resumed:
+                logging.info(f"[{env.name}] Resuming run {env.run_id} from ledger checkpoint: "
+                             f"${env.accumulated_cost:.2f} accumulated")
+
+        # A primary that finished before the restart may have left its shared resources behind
+        self.shared_destroy_pending = self.primary.status == Environment.FINISHED and not self.finished
+
+        if not new_runs:
+            # Workers still missing are bulk-created from the first tick's listing, existing ones are kept
+            return
+
+        # Initialize Terraform; this is a no-op for environments whose applied configuration is unchanged
         self.init_terraform()
+        self.terraform_ready = True
+        for env in self.environments:
+            if not env.active:
+                continue
+            if self.provisioner is not None:
+                # Workers come up batch by batch while the controller is already accounting for them
+                self.provision_environment(env)
+            if not env.resumed:
+                # Only record the run once the fleet exists, but as starting when its accounting did,
+                # so a resumed run's cumulative spend keeps its start time
+                self.ledger.start_run(env.name, env.run_id, env.target_spend, env.started_at)
 
-    def init_terraform(self):
-        """Initialize and apply Terraform configuration"""
+    def warm(self):
+        """Keep a standby's fleet listing, prices, CPU history and Terraform current for taking over"""
+        for project_id, inventory in self.inventories.items():
+            try:
+                with telemetry.span('inventory_list', project=project_id):
+                    snapshots = inventory.refresh()
+            except Exception as e:
+                logging.error(f"Error listing instances in project {project_id}: {str(e)}")
+                continue
+            for env in self.environments:
+                snapshot = snapshots.get(env.name)
+                if env.project_id != project_id or snapshot is None:
+                    continue
+                for machine_type, zone in {(record.machine_type, record.zone) for record in snapshot.instances}:
+                    self.get_instance_cost_per_hour(env, machine_type, zone)
+            if self.utilization is not None and self.utilization.due(project_id):
+                self.sample_utilization(project_id)
+        if not self.terraform_ready:
+            self.prepare_terraform()
+
+    @property
+    def primary(self):
+        return next(env for env in self.environments if env.workspace == 'default')
+
+    @property
+    def finished(self):
+        return all(env.status == Environment.FINISHED for env in self.environments)
+
+    def _map(self, fn, envs):
+        """Run ``fn`` for each environment on the worker pool and return the results in order"""
+        return list(self.executor.map(fn, envs))
+
+    def render_tfvars(self):
+        """Render terraform.tfvars in HCL format from the current configuration"""
+        primary = self.primary
+        lines = ['environments = {\n']
+        for env in self.environments:
+            lines.append(self.render_environment_tfvars(env))
+        lines.extend([
+            '}\n\n',
+            f'target_env = "{primary.name}"\n',
+            f'instance_count = {self.terraform_instance_count(primary)}\n',
+            f'machine_type = "{primary.machine_type}"\n',
+            'create_service_account = false\n',
+            'create_artifact_registry = false\n',
+        ])
+        return ''.join(lines)
+
+    def render_environment_tfvars(self, env):
+        """Render an environment's entry of the environments map in terraform.tfvars"""
+        return ''.join([
+            f'  {env.name} = {{\n',
+            f'    project_id         = "{env.project_id}"\n',
+            f'    region            = "{env.region}"\n',
+            f'    zone              = "{env.zone}"\n',
+            f'    zones             = {json.dumps(env.zones)}\n',
+            f'    instance_count    = {self.terraform_instance_count(env)}\n',
+            f'    machine_type      = "{env.machine_type}"\n',
+            f'    target_spend      = {float(env.target_spend)}\n',
+            '  }\n',
+        ])
+
+    def terraform_instance_count(self, env):
+        """Workers Terraform creates for an environment, none when they are bulk-provisioned"""
+        return 0 if self.provisioner is not None else env.instance_count
+
+    def terraform_env(self, env):
+        """Process environment that points Terraform at an environment's workspace"""
+        return dict(os.environ, TF_WORKSPACE=env.workspace)
+
+    def terraform_fingerprint(self, env):
+        """Hash an environment's rendered tfvars entry together with every .tf file"""
+        # The rendered entry includes what depends on PROVISION_MODE, such as the instance count
+        digest = hashlib.sha256(self.render_environment_tfvars(env).encode())
+        digest.update(env.workspace.encode())
+        if env.workspace == 'default':
+            # The default workspace also binds the controller's roles in every environment's project
+            digest.update(json.dumps(sorted({other.project_id for other in self.environments})).encode())
+        for path in sorted(glob.glob('*.tf')):
+            digest.update(path.encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+        return digest.hexdigest()
+
+    def terraform_is_current(self, env, fingerprint):
+        """Whether the last successful apply used this configuration and the fleet still matches it"""
+        if not os.path.isdir('.terraform'):
+            return False
         try:
-            # Force reload of environment variables
-            load_dotenv(override=True)
-            
-            # Update instance properties from environment
-            self.machine_type = os.getenv('MACHINE_TYPE')
-            self.instance_count = int(os.getenv('INSTANCE_COUNT'))
-            
-            logging.info(f"Environment variables loaded:")
-            logging.info(f"  MACHINE_TYPE: {os.getenv('MACHINE_TYPE')}")
-            logging.info(f"  INSTANCE_COUNT: {os.getenv('INSTANCE_COUNT')}")
-            logging.info(f"  TARGET_SPEND: {os.getenv('TARGET_SPEND')}")
-            
-            logging.info(f"Using configuration from environment:")
-            logging.info(f"  Machine Type: {self.machine_type}")
-            logging.info(f"  Instance Count: {self.instance_count}")
-            
-            # Debug: Show current directory contents
-            ls_result = subprocess.run(
-                ['ls', '-la'],
-                check=True,
-                capture_output=True,
-                text=True
-            )
-            logging.info(f"Directory contents before terraform init:\n{ls_result.stdout}")
-
-            # Remove any existing tfvars files
-            for f in ['terraform.tfvars', 'terraform.tfvars.tpl', 'terraform.tfvars.bak']:
-                if os.path.exists(f):
-                    os.remove(f)
-                    logging.info(f"Removed {f}")
-
-            # Create terraform.tfvars with proper content using updated properties
-            tfvars_content = {
-                'environments': {
-                    'e360': {
-                        'project_id': self.project_id,
-                        'region': self.region,
-                        'zone': self.zone,
-                        'instance_count': self.instance_count,
-                        'machine_type': self.machine_type,
-                        'target_spend': float(self.target_spend)
-                    }
-                },
-                'target_env': 'e360',
-                'instance_count': self.instance_count,
-                'machine_type': self.machine_type
-            }
-
-            # Write the tfvars file in HCL format
-            with open('terraform.tfvars', 'w') as f:
-                f.write('environments = {\n')
-                f.write('  e360 = {\n')
-                f.write(f'    project_id         = "{tfvars_content["environments"]["e360"]["project_id"]}"\n')
-                f.write(f'    region            = "{tfvars_content["environments"]["e360"]["region"]}"\n')
-                f.write(f'    zone              = "{tfvars_content["environments"]["e360"]["zone"]}"\n')
-                f.write(f'    instance_count    = {tfvars_content["environments"]["e360"]["instance_count"]}\n')
-                f.write(f'    machine_type      = "{tfvars_content["environments"]["e360"]["machine_type"]}"\n')
-                f.write(f'    target_spend      = {tfvars_content["environments"]["e360"]["target_spend"]}\n')
-                f.write('  }\n')
-                f.write('}\n\n')
-                f.write(f'target_env = "{tfvars_content["target_env"]}"\n')
-                f.write(f'instance_count = {tfvars_content["instance_count"]}\n')
-                f.write(f'machine_type = "{tfvars_content["machine_type"]}"\n')
-                f.write('create_service_account = false\n')
-                f.write('create_artifact_registry = false\n')
-
-            logging.info("Created terraform.tfvars with content:")
+            with open(terraform_stamp_path(env), 'r') as f:
+                if f.read().strip() != fingerprint:
+                    return False
+        except FileNotFoundError:
+            return False
+
+        # Environments sharing a project share one listing
+        snapshot = env.inventory.snapshot(env.name) or self.refresh_inventory(env)
+        if snapshot is None:
+            return False
+        if self.provisioner is None and snapshot.instance_count != env.instance_count:
+            logging.info(f"[{env.name}] Configuration unchanged but found {snapshot.instance_count} "
+                         f"of {env.instance_count} expected instances")
+            return False
+        return True
+
+    def write_tfvars(self):
+        """Write terraform.tfvars if the rendered configuration differs from what is there"""
+        # Remove stale tfvars variants
+        for f in ['terraform.tfvars.tpl', 'terraform.tfvars.bak']:
+            if os.path.exists(f):
+                os.remove(f)
+                logging.info(f"Removed {f}")
+
+        tfvars = self.render_tfvars()
+        existing = None
+        if os.path.exists('terraform.tfvars'):
             with open('terraform.tfvars', 'r') as f:
-                logging.info(f.read())
+                existing = f.read()
+        if existing != tfvars:
+            with open('terraform.tfvars', 'w') as f:
+                f.write(tfvars)
+            logging.info("Created terraform.tfvars")
+            logging.debug(tfvars)
+
+    def prepare_terraform(self):
+        """Initialize Terraform and every workspace without applying, so a standby can destroy what it takes over"""
+        with self._terraform_lock:
+            if self.terraform_ready:
+                return
+            try:
+                self.write_tfvars()
+                with telemetry.span('terraform', command='init'):
+                    subprocess.run(['terraform', 'init'], capture_output=True, text=True, check=True)
+                for env in self.environments:
+                    self.ensure_workspace(env)
+                self.terraform_ready = True
+                logging.info("Terraform initialized for taking over")
+            except subprocess.CalledProcessError as e:
+                logging.error(f"Error running Terraform command: {e.stderr}")
+            except Exception as e:
+                logging.error(f"Error initializing Terraform: {str(e)}")
+
+    def init_terraform(self):
+        """Initialize and apply Terraform configuration for environments that need it"""
+        try:
+            self.write_tfvars()
+
+            # Environments that already finished their run stay destroyed
+            envs = [env for env in self.environments if env.active]
+            fingerprints = {env.name: self.terraform_fingerprint(env) for env in envs}
+            current = self._map(lambda env: self.terraform_is_current(env, fingerprints[env.name]), envs)
+            pending = [env for env, is_current in zip(envs, current) if not is_current]
+            for env in envs:
+                if env not in pending:
+                    logging.info(f"[{env.name}] Terraform configuration unchanged since last apply "
+                                 f"({fingerprints[env.name][:12]}), skipping init and apply")
+            if not pending:
+                return
 
             # Initialize Terraform
-            init_result = subprocess.run(
-                ['terraform', 'init'],
-                capture_output=True,
-                text=True,
-                check=True
-            )
+            with telemetry.span('terraform', command='init'):
+                subprocess.run(
+                    ['terraform', 'init'],
+                    capture_output=True,
+                    text=True,
+                    check=True
+                )
             logging.info("Terraform initialized successfully")
 
-            # Apply Terraform configuration
-            apply_result = subprocess.run(
-                ['terraform', 'apply', '-auto-approve'],
-                capture_output=True,
-                text=True,
-            )
-            
-            if apply_result.returncode != 0:
-                raise Exception(f"Terraform apply failed: {apply_result.stderr}")
-            
-            logging.info("Terraform applied successfully")
-            
+            # Workspaces are created one at a time, then applied in parallel
+            for env in pending:
+                self.ensure_workspace(env)
+            self._map(lambda env: self.apply_environment(env, fingerprints[env.name]), pending)
+
         except subprocess.CalledProcessError as e:
             logging.error(f"Error running Terraform command: {e.stderr}")
             raise
@@ -154,266 +480,585 @@ class GCPCostManager:
             logging.error(f"Error initializing Terraform: {str(e)}")
             raise
 
-    def get_instance_cost_per_hour(self):
-        """Get the actual cost per hour for the instance type using Cloud Compute API"""
-        try:
-            logging.info(f"Getting cost for machine type: {self.machine_type}")
+    def ensure_workspace(self, env):
+        """Create an environment's Terraform workspace if it doesn't exist yet"""
+        if env.workspace == 'default':
+            return
+        process_env = dict(os.environ)
+        process_env.pop('TF_WORKSPACE', None)
+        result = subprocess.run(
+            ['terraform', 'workspace', 'new', env.workspace],
+            capture_output=True,
+            text=True,
+            env=process_env
+        )
+        if result.returncode != 0 and 'already exists' not in result.stderr:
+            raise Exception(f"Creating Terraform workspace {env.workspace} failed: {result.stderr}")
 
-            # Get machine type details from Compute API
-            request = compute_v1.GetMachineTypeRequest(
-                project=self.project_id,
-                zone=self.zone,
-                machine_type=self.machine_type
+    def apply_environment(self, env, fingerprint):
+        """Apply Terraform configuration for one environment"""
+        with telemetry.span('terraform', command='apply'):
+            apply_result = subprocess.run(
+                ['terraform', 'apply', '-auto-approve', f'-var=target_env={env.name}',
+                 f"-lock-timeout={os.getenv('TERRAFORM_LOCK_TIMEOUT_SECONDS', '300')}s"],
+                capture_output=True,
+                text=True,
+                env=self.terraform_env(env)
             )
-            
-            machine_type_info = self.machine_types_client.get(request=request)
-            
-            # Calculate based on specs
-            vcpus = machine_type_info.guest_cpus
-            memory_gb = machine_type_info.memory_mb / 1024.0
-            
-            # Base N2 prices
-            cpu_price = 0.031611  # N2 price per vCPU
-            memory_price = 0.004237  # N2 price per GB
-            
-            hourly_cost = (vcpus * cpu_price + memory_gb * memory_price)
-            total_hourly_cost = hourly_cost * self.instance_count
-            per_15s_cost = total_hourly_cost * (15.0/3600.0)
-            
-            logging.info(f"Instance Cost Summary:")
-            logging.info(f"  Machine Type: {self.machine_type}")
-            logging.info(f"  Region: {self.region}")
-            logging.info(f"  vCPUs: {vcpus}")
-            logging.info(f"  Memory: {memory_gb:.1f} GB")
-            logging.info(f"  CPU Price: ${cpu_price}/hour/vCPU")
-            logging.info(f"  Memory Price: ${memory_price}/hour/GB")
-            logging.info(f"  Target Instances: {self.instance_count}")
-            logging.info(f"  Cost Per Instance: ${hourly_cost:.4f}/hour")
-            logging.info(f"  Total Hourly Cost: ${total_hourly_cost:.2f}/hour")
-            logging.info(f"  Total 15-Second Cost: ${per_15s_cost:.4f}/15s")
-            return hourly_cost
-            
+
+        if apply_result.returncode != 0:
+            raise Exception(f"Terraform apply failed for {env.name}: {apply_result.stderr}")
+
+        # Remember what was applied so an unchanged restart can skip Terraform
+        stamp_path = terraform_stamp_path(env)
+        with open(f"{stamp_path}.tmp", 'w') as f:
+            f.write(fingerprint)
+        os.replace(f"{stamp_path}.tmp", stamp_path)
+
+        logging.info(f"[{env.name}] Terraform applied successfully")
+
+    def provision_environment(self, env, snapshot=None):
+        """Start bulk-creating an environment's missing workers in the background"""
+        snapshot = snapshot or env.inventory.snapshot(env.name) or self.refresh_inventory(env)
+        if snapshot is None:
+            logging.error(f"[{env.name}] Can't list existing workers, provisioning on the next tick")
+            return None
+        run = self.provisioner.provision(env.project_id, env.name, env.config.worker_pools(),
+                                         [instance.name for instance in snapshot.instances])
+        self.provisioning[env.name] = run
+        return run
+
+    def poll_provisioning(self, snapshots=None):
+        """Start provisioning that couldn't start earlier and report runs that have finished"""
+        if self.provisioner is None:
+            return
+        snapshots = snapshots or {}
+        for env in self.environments:
+            if not env.active or env.name in self.provisioned:
+                continue
+            run = self.provisioning.get(env.name)
+            if run is None:
+                self.provision_environment(env, snapshots.get(env.name))
+                continue
+            if not run.done():
+                continue
+            self.provisioned.add(env.name)
+            if not run.futures:
+                continue
+            logging.info(f"[{env.name}] Provisioned {len(run.created())} of {run.requested} instances, "
+                         f"first batch running after {run.first_batch_seconds or 0.0:.1f}s, "
+                         f"last after {run.last_batch_seconds or 0.0:.1f}s")
+            for names, error in run.failed().items():
+                logging.error(f"[{env.name}] Error provisioning {names}: {error}")
+
+    def sample_utilization(self, project_id):
+        """Fetch the latest CPU utilization of a project's whole fleet in one call"""
+        try:
+            with telemetry.span('utilization_sample', project=project_id):
+                recorded = self.utilization.sample(project_id)
+            logging.debug(f"Recorded {recorded} CPU utilization samples in project {project_id}")
         except Exception as e:
-            logging.error(f"Error getting instance cost from Cloud Compute API: {str(e)}")
+            logging.error(f"Error sampling CPU utilization in project {project_id}: {str(e)}")
+
+    def check_utilization(self, snapshots=None):
+        """Sample fleet CPU where due and deal with workers that are idle or crash-looping"""
+        if self.utilization is None:
+            return
+        snapshots = snapshots or {}
+        observed = [env for env in self.environments if env.active and snapshots.get(env.name) is not None]
+        due = [project_id for project_id in sorted({env.project_id for env in observed})
+               if self.utilization.due(project_id)]
+        if due:
+            self._map(self.sample_utilization, due)
+
+        now = self.clock.time()
+        instance_ids = set()
+        for env in observed:
+            snapshot = snapshots[env.name]
+            instance_ids.update(record.id for record in snapshot.instances)
+            unhealthy = self.fleet_health.assess(snapshot.instances, now)
+            if unhealthy:
+                self.handle_unhealthy(env, unhealthy)
+        # History of workers that are gone is dropped, unless an environment couldn't be listed
+        if len(observed) == len([env for env in self.environments if env.active]):
+            self.fleet_health.retain(instance_ids)
+
+    def handle_unhealthy(self, env, unhealthy):
+        """Report unhealthy workers and start replacing them"""
+        crash_looping = [record.name for record, reason in unhealthy.items() if reason == CRASH_LOOP]
+        idle = [record.name for record, reason in unhealthy.items() if reason != CRASH_LOOP]
+        telemetry.count('unhealthy_workers', value=len(unhealthy), env=env.name)
+        logging.warning(f"[{env.name}] {len(idle)} idle and {len(crash_looping)} crash-looping workers: "
+                        f"{', '.join(sorted(crash_looping + idle)[:10])}"
+                        + (", ..." if len(unhealthy) > 10 else ""))
+        if self.utilization_action != 'replace':
+            return
+
+        in_flight = self.replacements.get(env.name)
+        if in_flight is not None and not in_flight.done():
+            return
+        cutoff = self.seconds_to_cutoff(env)
+        if cutoff is not None and cutoff < self.fleet_health.startup_grace:
+            logging.info(f"[{env.name}] Not replacing workers, the budget is reached in {cutoff:.0f}s, "
+                         f"before a replacement would be working")
+            return
+        # Crash-looping workers first, a bounded number per round
+        records = sorted(unhealthy, key=lambda record: unhealthy[record] != CRASH_LOOP)[:self.max_replacements]
+        self.replacements[env.name] = self.replacer.submit(self.replace_workers, env, records)
+
+    def replace_workers(self, env, records):
+        """Delete unhealthy workers and create them again under the same names"""
+        try:
+            with telemetry.span('replace_workers'):
+                result = self.worker_deletes.teardown(env.project_id, records)
+            logging.info(f"[{env.name}] Deleted {len(result.completed)} of {len(records)} unhealthy workers "
+                         f"for replacement")
+            for name, error in result.failed.items():
+                logging.error(f"[{env.name}] Error deleting {name} for replacement: {error}")
+            if not result.completed or not env.active:
+                return
+            telemetry.count('worker_replacements', value=len(result.completed), env=env.name)
+            if self.provisioner is not None:
+                self.provisioned.discard(env.name)
+                self.provision_environment(env, self.refresh_inventory(env))
+            else:
+                # Terraform recreates the missing workers at their original index
+                self.apply_environment(env, self.terraform_fingerprint(env))
+        except Exception as e:
+            logging.error(f"[{env.name}] Error replacing workers: {str(e)}")
+
+    def get_instance_cost_per_hour(self, env, machine_type=None, zone=None):
+        """Get the on-demand cost per hour for a machine type in a zone from the local pricing catalog"""
+        machine_type = machine_type or env.machine_type
+        zone = zone or env.zone
+        try:
+            return self.pricing.hourly_price(machine_type, self.region_of(env, zone), env.project_id, zone)
+        except Exception as e:
+            logging.error(f"Error pricing machine type {machine_type}: {str(e)}")
             logging.warning("Using default rate of $1.50/hour")
             return 1.50  # Default fallback rate
 
-    def _get_access_token(self):
-        """Get the current access token for API calls"""
+    def region_of(self, env, zone):
+        return env.region if zone == env.zone else zone.rsplit('-', 1)[0]
+
+    def instance_rates(self, env, instances):
+        """Hourly rates of a snapshot's instances, pricing each distinct machine type and zone once"""
+        shapes = [(instance.machine_type, self.region_of(env, instance.zone or env.zone), instance.zone or env.zone)
+                  for instance in instances]
         try:
-            cmd = ['gcloud', 'auth', 'print-access-token']
-            result = subprocess.run(cmd, capture_output=True, text=True, check=True)
-            return result.stdout.strip()
-        except subprocess.CalledProcessError as e:
-            logging.error(f"Failed to get access token: {e}")
-            raise
+            return self.pricing.price_many(shapes, env.project_id)
+        except Exception:
+            # A type that can't be priced falls back to the default rate on its own
+            return [self.get_instance_cost_per_hour(env, machine_type, zone) for machine_type, _, zone in shapes]
 
-    def get_instance_count(self):
-        """Get the current number of running instances"""
+    def log_cost_summary(self, env):
+        """Log what an environment's configured fleet costs"""
         try:
-            instance_filter = 'name eq video-processor-.*'
-            request = compute_v1.ListInstancesRequest(
-                project=self.project_id,
-                zone=self.zone,
-                filter=instance_filter
-            )
-            instances = list(self.compute_client.list(request=request))
-            running_count = sum(1 for instance in instances if instance.status == "RUNNING")
-            return running_count
+            spec = self.pricing.spec(env.machine_type, env.project_id, env.zone)
+            cpu_price, memory_price = self.pricing.rates(spec.family, env.region)
         except Exception as e:
-            logging.error(f"Error getting instance count: {str(e)}")
-            # Fallback to environment variable
-            return int(os.getenv('INSTANCE_COUNT', '8'))
-
-    def get_current_cost(self):
-        """Get the current cost for the project"""
-        now = datetime.utcnow()
-        # Look back 15 seconds
-        start_time = now - timedelta(seconds=15)
-        
-        project_name = f"projects/{self.project_id}"
-        interval = monitoring_v3.TimeInterval({
-            'start_time': {'seconds': int(start_time.timestamp())},
-            'end_time': {'seconds': int(now.timestamp())}
-        })
-        
+            logging.error(f"Error getting machine type spec for {env.machine_type}: {str(e)}")
+            return
+
+        total_hourly_cost = env.cost_per_hour * env.instance_count
+
+        logging.info(f"Instance Cost Summary for {env.name}:")
+        logging.info(f"  Machine Type: {env.machine_type}")
+        logging.info(f"  Region: {env.region}")
+        logging.info(f"  vCPUs: {spec.vcpus}")
+        logging.info(f"  Memory: {spec.memory_gb:.1f} GB")
+        logging.info(f"  CPU Price: ${cpu_price}/hour/vCPU")
+        logging.info(f"  Memory Price: ${memory_price}/hour/GB")
+        logging.info(f"  Pricing Snapshot: {self.pricing.updated}")
+        logging.info(f"  Target Instances: {env.instance_count}")
+        logging.info(f"  Cost Per Instance: ${env.cost_per_hour:.4f}/hour")
+        logging.info(f"  Total Hourly Cost: ${total_hourly_cost:.2f}/hour")
+
+    def refresh_project(self, project_id):
+        """List a project's workers in every zone with one aggregated call, returning snapshots by environment"""
         try:
-            # First, list actual running instances
-            instance_filter = 'name eq video-processor-.*'
-            request = compute_v1.ListInstancesRequest(
-                project=self.project_id,
-                zone=self.zone,
-                filter=instance_filter
-            )
-            instances = list(self.compute_client.list(request=request))
-            instance_count = len(instances)
-            logging.info(f"Found {instance_count} instances via Compute API")
-            
-            period_cost = 0.0
-            
-            for instance in instances:
-                if instance.status == "RUNNING":
-                    instance_name = instance.name
-                    instance_id = instance.id
-                    
-                    logging.info(f"Found running instance: {instance_name}")
-                    logging.info(f"Instance ID: {instance_id}")
-                    
-                    # Calculate cost for 15 seconds of runtime
-                    hours_fraction = 15.0 / 3600.0  # 15 seconds as fraction of hour
-                    instance_cost = self.cost_per_hour * hours_fraction
-                    period_cost += instance_cost
-                    logging.info(f"Added cost ${instance_cost:.2f} for instance {instance_name}")
-            
-            # Update accumulated cost
-            current_time = time.time()
-            if period_cost > 0:
-                self.accumulated_cost += period_cost
-                self.last_update_time = current_time
-                logging.info(f"Period cost: ${period_cost:.2f}, Total accumulated cost: ${self.accumulated_cost:.2f}")
-            
-            # Write the cost metric
-            self.write_cost_metric(self.accumulated_cost)
-            
-            return self.accumulated_cost
+            with telemetry.span('inventory_list', project=project_id):
+                snapshots = self.inventories[project_id].refresh()
+            for name, snapshot in snapshots.items():
+                zones = ', '.join(f"{zone}: {count}" for zone, count in sorted(snapshot.running_by_zone().items()))
+                logging.info(f"[{name}] Found {snapshot.instance_count} instances via Compute API "
+                             f"({snapshot.parsed} new or changed; running by zone: {zones or 'none'})")
+            return snapshots
         except Exception as e:
-            logging.error(f"Error getting current cost: {str(e)}")
-            return self.accumulated_cost  # Return last known cost instead of 0
+            logging.error(f"Error listing instances in project {project_id}: {str(e)}")
+            return None
+
+    def refresh_inventory(self, env):
+        """List an environment's worker fleet once for this tick"""
+        if self.refresh_project(env.project_id) is None:
+            return None
+        return env.inventory.snapshot(env.name)
+
+    def get_instance_count(self, env, snapshot=None):
+        """Get the current number of running instances"""
+        if snapshot is None:
+            snapshot = env.inventory.snapshot(env.name)
+        if snapshot is None:
+            # Fallback to the configured count
+            return env.instance_count
+        return snapshot.running_count
+
+    def get_current_cost(self, env, snapshot=None):
+        """Get the current cost for an environment"""
+        if snapshot is None:
+            snapshot = self.refresh_inventory(env)
+        if snapshot is None:
+            return env.accumulated_cost  # Return last known cost instead of 0
 
-    def write_cost_metric(self, cost):
-        """Write the current cost to Cloud Monitoring"""
         try:
-            series = monitoring_v3.TimeSeries()
-            series.metric.type = "custom.googleapis.com/spender/total_cost"
-            series.resource.type = "generic_node"
-            
-            # Set labels matching dashboard
-            series.metric.labels["run_id"] = self.run_id
-            series.metric.labels["environment"] = "e360"
-            series.metric.labels["component"] = "worker"
-            
-            series.resource.labels["project_id"] = self.project_id
-            series.resource.labels["location"] = self.zone
-            series.resource.labels["namespace"] = "spender"
-            series.resource.labels["node_id"] = self.run_id
-            
-            # For GAUGE metrics, start_time must equal end_time
-            now = time.time()
-            now_seconds = int(now)
-            now_nanos = int((now - now_seconds) * 10**9)
-            
-            # Create the point with equal start and end times
-            point = monitoring_v3.Point({
-                "interval": {
-                    "end_time": {"seconds": now_seconds, "nanos": now_nanos},
-                    "start_time": {"seconds": now_seconds, "nanos": now_nanos}
-                },
-                "value": {"double_value": cost}
-            })
-            series.points = [point]
-            
-            logging.info(f"Writing metric with labels: {series.metric.labels}")
-            self.monitoring_client.create_time_series(
-                request={
-                    "name": f"projects/{self.project_id}",
-                    "time_series": [series]
-                }
-            )
-            logging.info(f"Successfully wrote cost metric: ${cost:.2f}")
+            # Charge each instance for the time it actually ran since the last snapshot
+            with telemetry.span('cost_compute', env=env.name):
+                period_cost = env.accrual.observe(snapshot)
+
+            # Per-instance detail only at DEBUG; a tick logs one summary line however large the fleet
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                for instance_name, instance_cost in env.accrual.charges.items():
+                    logging.debug(f"[{env.name}] Added cost ${instance_cost:.4f} for instance {instance_name}")
+
+            # Update accumulated cost, in total and per zone
+            env.accumulated_cost += period_cost
+            logging.info(f"[{env.name}] {snapshot.running_count} instances running, period cost "
+                         f"${period_cost:.4f} across {len(env.accrual.charges)} instances, "
+                         f"total accumulated cost: ${env.accumulated_cost:.2f}")
+            for zone, zone_cost in env.accrual.zone_charges.items():
+                env.zone_costs[zone] = env.zone_costs.get(zone, 0.0) + zone_cost
+            env.last_update_time = snapshot.wall_time
+            self.ledger.checkpoint(env.name, env.run_id, env.accumulated_cost, snapshot.wall_time,
+                                   env.zone_costs)
+
+            return env.accumulated_cost
+        except Exception as e:
+            logging.error(f"[{env.name}] Error getting current cost: {str(e)}")
+            return env.accumulated_cost  # Return last known cost instead of 0
+
+    def observe_project(self, project_id, envs):
+        """List a project's fleet once and charge each of its environments for the time since the last listing"""
+        if self.refresh_project(project_id) is None:
+            return {env.name: None for env in envs}
+        snapshots = {}
+        for env in envs:
+            snapshots[env.name] = env.inventory.snapshot(env.name)
+            self.get_current_cost(env, snapshots[env.name])
+        return snapshots
+
+    def observe_fleet(self):
+        """Observe every active environment, one listing per project, returning snapshots by environment name"""
+        by_project = {}
+        for env in self.environments:
+            if env.active:
+                by_project.setdefault(env.project_id, []).append(env)
+        snapshots = {}
+        for project_snapshots in self._map(lambda project_id: self.observe_project(project_id, by_project[project_id]),
+                                           list(by_project)):
+            snapshots.update(project_snapshots)
+        return snapshots
+
+    def projected_cost(self, env):
+        """Accumulated cost plus what the last observed fleet has spent since"""
+        return env.accumulated_cost + env.accrual.unobserved_cost()
+
+    def seconds_to_cutoff(self, env):
+        """Seconds until an environment's teardown should start at its current burn rate"""
+        return self.forecaster.seconds_to_cutoff(
+            env.name, self.projected_cost(env), env.target_spend, env.accrual.hourly_rate)
+
+    def next_cutoff(self):
+        """Seconds until the first active environment's teardown should start, or None if none is spending"""
+        cutoffs = [self.seconds_to_cutoff(env) for env in self.environments if env.active]
+        cutoffs = [seconds for seconds in cutoffs if seconds is not None]
+        return min(cutoffs) if cutoffs else None
+
+    def export_metrics(self, snapshots=None):
+        """Queue this tick's cost and instance count metrics for every environment still running"""
+        snapshots = snapshots or {}
+        for env in self.environments:
+            if env.status == Environment.FINISHED:
+                continue
+            self.write_cost_metric(env, env.accumulated_cost)
+            self.write_zone_cost_metrics(env)
+            self.write_instance_count_metric(env, self.get_instance_count(env, snapshots.get(env.name)))
+            snapshot = snapshots.get(env.name)
+            if snapshot is not None:
+                self.write_rollup_metrics(env, env.rollups.observe(
+                    snapshot.wall_time, env.accumulated_cost, snapshot.running_count))
+
+    def evaluate_budget(self):
+        """Return the active environments whose spend has reached their target, marking them for teardown"""
+        with telemetry.span('budget_decision'):
+            return self._evaluate_budget()
+
+    def _evaluate_budget(self):
+        due = []
+        for env in self.environments:
+            if not env.active:
+                continue
+            current_cost = self.projected_cost(env)
+            cutoff = self.seconds_to_cutoff(env)
+            logging.debug(f"[{env.name}] Current cost: ${current_cost:.2f}")
+            if current_cost >= env.target_spend:
+                logging.warning(f"[{env.name}] Cost (${current_cost:.2f}) exceeds target (${env.target_spend:.2f})")
+            elif cutoff is not None and cutoff <= 0:
+                logging.warning(f"[{env.name}] Cost (${current_cost:.2f}) will reach target "
+                                f"(${env.target_spend:.2f}) within the "
+                                f"{self.forecaster.lead_time(env.name):.0f}s teardown lead time")
+            else:
+                logging.info(f"[{env.name}] Cost is within target. Current: ${current_cost:.2f}, "
+                             f"Target: ${env.target_spend:.2f}"
+                             + (f", teardown in {cutoff:.0f}s at current burn rate" if cutoff is not None else ""))
+                continue
+            env.status = Environment.RETIRING
+            env.retire_started = self.clock.monotonic()
+            due.append(env)
+        return due
+
+    def _metric_labels(self, env):
+        """Labels shared by every series an environment's run writes, matching the dashboard"""
+        metric_labels = {
+            "run_id": env.run_id,
+            "environment": env.name,
+            "component": "worker"
+        }
+        resource_labels = {
+            "project_id": env.project_id,
+            "location": env.zone,
+            "namespace": "spender",
+            "node_id": env.run_id
+        }
+        return metric_labels, resource_labels
+
+    def write_cost_metric(self, env, cost):
+        """Queue the current cost for export to Cloud Monitoring"""
+        try:
+            with telemetry.span('metric_write', metric='total_cost'):
+                metric_labels, resource_labels = self._metric_labels(env)
+                series = gauge_series(
+                    "custom.googleapis.com/spender/total_cost",
+                    float(cost),
+                    metric_labels,
+                    resource_labels
+                )
+                logging.debug(f"Queueing cost metric with labels: {metric_labels}")
+                self.metric_exporter.submit(env.project_id, series)
         except Exception as e:
             logging.error(f"Error writing cost metric: {str(e)}")
 
-    def write_instance_count_metric(self, count):
-        """Write the current instance count to Cloud Monitoring"""
+    def write_zone_cost_metrics(self, env):
+        """Queue the accumulated cost of each zone an environment has run in"""
         try:
-            series = monitoring_v3.TimeSeries()
-            series.metric.type = "custom.googleapis.com/spender/instance_count"
-            series.resource.type = "generic_node"
-            
-            # Set labels matching dashboard
-            series.metric.labels["run_id"] = self.run_id
-            series.metric.labels["environment"] = "e360"
-            series.metric.labels["component"] = "worker"
-            
-            series.resource.labels["project_id"] = self.project_id
-            series.resource.labels["location"] = self.zone
-            series.resource.labels["namespace"] = "spender"
-            series.resource.labels["node_id"] = self.run_id
-            
-            # For GAUGE metrics, start_time must equal end_time
-            now = time.time()
-            now_seconds = int(now)
-            now_nanos = int((now - now_seconds) * 10**9)
-            
-            point = monitoring_v3.Point({
-                "interval": {
-                    "end_time": {"seconds": now_seconds, "nanos": now_nanos},
-                    "start_time": {"seconds": now_seconds, "nanos": now_nanos}
-                },
-                "value": {"int64_value": count}
-            })
-            series.points = [point]
-            
-            logging.info(f"Writing instance count metric: {count}")
-            self.monitoring_client.create_time_series(
-                request={
-                    "name": f"projects/{self.project_id}",
-                    "time_series": [series]
-                }
-            )
-            logging.info(f"Successfully wrote instance count metric: {count}")
+            metric_labels, resource_labels = self._metric_labels(env)
+            for zone, cost in env.zone_costs.items():
+                with telemetry.span('metric_write', metric='zone_cost'):
+                    series = gauge_series(
+                        "custom.googleapis.com/spender/zone_cost",
+                        float(cost),
+                        dict(metric_labels, zone=zone),
+                        dict(resource_labels, location=zone)
+                    )
+                    self.metric_exporter.submit(env.project_id, series)
+        except Exception as e:
+            logging.error(f"Error writing zone cost metrics: {str(e)}")
+
+    def write_instance_count_metric(self, env, count):
+        """Queue the current instance count for export to Cloud Monitoring"""
+        try:
+            with telemetry.span('metric_write', metric='instance_count'):
+                metric_labels, resource_labels = self._metric_labels(env)
+                series = gauge_series(
+                    "custom.googleapis.com/spender/instance_count",
+                    int(count),
+                    metric_labels,
+                    resource_labels
+                )
+                logging.debug(f"[{env.name}] Queueing instance count metric: {count}")
+                self.metric_exporter.submit(env.project_id, series)
         except Exception as e:
             logging.error(f"Error writing instance count metric: {str(e)}")
 
+    def write_rollup_metrics(self, env, points):
+        """Queue closed per-minute and per-hour rollup windows, and the run's cumulative spend with them"""
+        try:
+            metric_labels, resource_labels = self._metric_labels(env)
+            for point in points:
+                with telemetry.span('metric_write', metric='rollup'):
+                    # Every delta counts towards the total, so none may be coalesced away
+                    self.metric_exporter.submit(env.project_id, gauge_series(
+                        SPEND_METRIC.format(period=point.period),
+                        float(point.spend),
+                        metric_labels,
+                        resource_labels,
+                        point.end_time
+                    ), coalesce=False)
+                    for stat, value in (('mean', point.mean_instances), ('max', point.max_instances)):
+                        self.metric_exporter.submit(env.project_id, gauge_series(
+                            FLEET_SIZE_METRIC.format(period=point.period),
+                            float(value),
+                            dict(metric_labels, stat=stat),
+                            resource_labels,
+                            point.end_time
+                        ), coalesce=False)
+            if points:
+                latest = max(points, key=lambda point: point.end_time)
+                self.metric_exporter.submit(env.project_id, cumulative_series(
+                    CUMULATIVE_SPEND_METRIC,
+                    float(latest.cost),
+                    metric_labels,
+                    resource_labels,
+                    env.started_at,
+                    latest.end_time
+                ))
+        except Exception as e:
+            logging.error(f"Error writing rollup metrics: {str(e)}")
+
     def check_and_manage_resources(self):
         """Check current costs and manage resources accordingly"""
         try:
-            current_cost = self.get_current_cost()
-            logging.info(f"Current cost: ${current_cost:.2f}")
-            
-            # Get and write instance count
-            instance_count = self.get_instance_count()
-            self.write_instance_count_metric(instance_count)
-            
-            if current_cost >= self.target_spend:
-                logging.warning(f"Cost (${current_cost:.2f}) exceeds target (${self.target_spend:.2f})")
+            # One inventory listing per environment is shared by the cost and count paths
+            snapshots = self.observe_fleet()
+            self.export_metrics(snapshots)
+            self.poll_provisioning(snapshots)
+            self.check_utilization(snapshots)
+
+            due = self.evaluate_budget()
+            if due:
+                self.retire_environments(due)
+            if self.finished:
                 self.cleanup_resources()
-            else:
-                logging.info(f"Cost is within target. Current: ${current_cost:.2f}, Target: ${self.target_spend:.2f}")
-        
+
         except Exception as e:
             logging.error(f"Error in check_and_manage_resources: {str(e)}")
             raise
 
-    def cleanup_resources(self):
-        """Clean up resources using Terraform destroy"""
-        try:
-            # Run terraform destroy
+    def destroy_environment(self, env):
+        """Destroy an environment's resources using Terraform destroy"""
+        if not self.terraform_ready:
+            self.prepare_terraform()
+        # Another replica may hold the state lock, for a standby's takeover or a leader that is going away
+        command = ['terraform', 'destroy', '-auto-approve', f'-var=target_env={env.name}',
+                   f"-lock-timeout={os.getenv('TERRAFORM_LOCK_TIMEOUT_SECONDS', '300')}s"]
+        # The default workspace also holds the controller's IAM bindings in every project,
+        # which the environments still running need; only its workers go until they finish
+        shared = env.workspace == 'default' and \
+            any(other.status != Environment.FINISHED for other in self.environments if other is not env)
+        if shared:
+            command.append('-target=google_compute_instance.worker')
+        with telemetry.span('terraform', command='destroy'):
             destroy_result = subprocess.run(
-                ['terraform', 'destroy', '-auto-approve'],
+                command,
                 capture_output=True,
-                text=True
+                text=True,
+                env=self.terraform_env(env)
             )
-            
-            if destroy_result.returncode != 0:
-                raise Exception(f"Terraform destroy failed: {destroy_result.stderr}")
-            
-            logging.info("Resources cleaned up successfully")
-            sys.exit(0)
-            
+
+        if destroy_result.returncode != 0:
+            raise Exception(f"Terraform destroy failed for {env.name}: {destroy_result.stderr}")
+
+        if os.path.exists(terraform_stamp_path(env)):
+            os.remove(terraform_stamp_path(env))
+        if shared:
+            self.shared_destroy_pending = True
+            logging.info(f"[{env.name}] Workers destroyed, shared resources are kept until every environment finishes")
+            return
+        if env.workspace == 'default':
+            self.shared_destroy_pending = False
+        logging.info(f"[{env.name}] Resources cleaned up successfully")
+
+    def stop_fleet(self, env):
+        """Stop or delete every worker of an environment at once, returning True once none is running"""
+        snapshot = self.refresh_inventory(env) or env.inventory.snapshot(env.name)
+        if snapshot is None:
+            return False
+        with telemetry.span('teardown', action=self.fleet_teardown.action):
+            result = self.fleet_teardown.teardown(env.project_id, snapshot.instances)
+        logging.info(f"[{env.name}] {result.action.capitalize()} of {result.requested} instances: "
+                     f"{len(result.completed)} done, {len(result.failed)} failed, "
+                     f"{len(result.pending)} pending after {result.seconds:.1f}s")
+        for name, error in result.failed.items():
+            logging.error(f"[{env.name}] Error tearing down {name}: {error}")
+        return result.complete
+
+    def reconcile_environment(self, env):
+        """Bring Terraform state in line with a fleet that was torn down directly"""
+        try:
+            replacement = self.replacements.get(env.name)
+            if replacement is not None:
+                # A replacement that was under way may still be creating workers
+                replacement.result()
+            run = self.provisioning.get(env.name)
+            if run is not None:
+                # Batches in flight at teardown may have created workers since
+                run.wait()
+                self.stop_fleet(env)
+            self.destroy_environment(env)
         except Exception as e:
-            logging.error(f"Error during cleanup: {str(e)}")
+            logging.error(f"[{env.name}] Error reconciling Terraform state: {str(e)}")
+
+    def retire_environment(self, env):
+        """Tear an environment down and close its run; it is retried on a later tick if that fails"""
+        env.status = Environment.RETIRING
+        if env.retire_started is None:
+            env.retire_started = self.clock.monotonic()
+        run = self.provisioning.get(env.name)
+        if run is not None:
+            run.cancel()
+        try:
+            if self.fleet_teardown is not None and self.stop_fleet(env):
+                # Spend has stopped; Terraform walking its graph no longer holds that up
+                self.reconciles.append(self.executor.submit(self.reconcile_environment, env))
+            elif self.provisioner is not None:
+                # Terraform destroy wouldn't touch bulk-created workers
+                raise Exception("Workers are still running after teardown")
+            else:
+                self.destroy_environment(env)
+            # The measured teardown time becomes the lead time for the next run
+            lead_time = self.forecaster.record_teardown(env.name, self.clock.monotonic() - env.retire_started)
+            self.ledger.record_teardown(env.name, lead_time)
+            # The run's last partial minute and hour
+            self.write_rollup_metrics(env, env.rollups.flush())
+            self.ledger.close_run(env.name, env.run_id)
+            env.status = Environment.FINISHED
+            return True
+        except Exception as e:
+            logging.error(f"[{env.name}] Error during cleanup: {str(e)}")
+            env.status = Environment.ACTIVE
+            env.retire_started = None
+            return False
+
+    def retire_environments(self, envs):
+        """Tear several environments down concurrently"""
+        return all(self._map(self.retire_environment, envs))
+
+    def cleanup_resources(self):
+        """Clean up every remaining environment and exit"""
+        remaining = [env for env in self.environments if env.status != Environment.FINISHED]
+        retired = not remaining or self.retire_environments(remaining)
+        # Get the final numbers, including the last rollups, out before exiting
+        self.metric_exporter.close()
+        if not retired:
             sys.exit(1)
+        # Let Terraform finish reconciling before the process goes away
+        for future in self.reconciles:
+            future.result()
+        if self.shared_destroy_pending:
+            try:
+                self.destroy_environment(self.primary)
+            except Exception as e:
+                logging.error(f"Error destroying shared resources: {str(e)}")
+        self.ledger.close()
+        sys.exit(0)
 
     def test_credentials(self):
         """Test if credentials are properly configured"""
         try:
-            # Try to list projects as a simple test
-            from google.cloud import resourcemanager_v3
-            client = resourcemanager_v3.ProjectsClient()
-            project_name = f"projects/{self.project_id}"
-            project = client.get_project(name=project_name)
-            print(f"Successfully authenticated. Project: {project.project_id}")
+            # Try to read every managed project as a simple test
+            client = self.clients.client(resourcemanager_v3.ProjectsClient)
+            for project_id in sorted({env.project_id for env in self.environments}):
+                project = client.get_project(name=f"projects/{project_id}")
+                print(f"Successfully authenticated. Project: {project.project_id}")
             return True
         except Exception as e:
             print(f"Authentication failed: {str(e)}")
@@ -422,16 +1067,57 @@ class GCPCostManager:
 def main():
     # Load environment variables
     load_dotenv()
-    
+
+    # Records are formatted and written off the control thread, rate-limited per call site
+    listener = setup_logging()
+
     # Get configuration from environment
     project_id = os.getenv('GCP_PROJECT_ID')
     target_spend = os.getenv('TARGET_SPEND')
     region = os.getenv('GCP_REGION')
     zone = os.getenv('GCP_ZONE')
-    check_interval = 15.0 / 60.0  # 15 seconds in minutes
-    
+    check_interval = float(os.getenv('CHECK_INTERVAL_MINUTES', '0.25'))
+
     logging.info(f"Check Interval: {check_interval * 60} seconds")
-    
+
+    # Controller metrics in Prometheus format, scrapeable while the manager starts up
+    telemetry.sample_every = int(os.getenv('TELEMETRY_SAMPLE_EVERY', '10'))
+    logging.getLogger().addHandler(ErrorCounter(telemetry))
+    if os.getenv('PORT'):
+        try:
+            serve_telemetry(telemetry, int(os.getenv('PORT')))
+        except OSError as e:
+            # A standby on the same host finds the leader's port taken; it runs on without its own endpoint
+            logging.error(f"Error serving controller metrics on port {os.getenv('PORT')}: {str(e)}")
+
+    # With LEASE_PATH set, replicas elect one leader and the others stand by to take over its run
+    elector = None
+    if os.getenv('LEASE_PATH'):
+        # A standby takes over the fleet's Terraform state too, so it can't be local to one replica
+        if terraform_backend() in (None, 'local'):
+            logging.error("LEASE_PATH needs a shared Terraform backend, such as gcs in backend.tf, "
+                          "so that every replica applies and destroys the same state")
+            sys.exit(1)
+        def lease_lost():
+            # Another replica may be enforcing already; exit without touching the fleet so only one does
+            logging.error("Exiting without cleanup, another replica holds the controller lease")
+            listener.stop()
+            os._exit(3)
+
+        lease = open_lease(
+            os.getenv('LEASE_BACKEND', 'file'),
+            os.getenv('LEASE_PATH'),
+            ttl=float(os.getenv('LEASE_TTL_SECONDS', '10'))
+        )
+        elector = LeaderElector(
+            lease,
+            renew_interval=float(os.getenv('LEASE_RENEW_SECONDS', '3')),
+            poll_interval=float(os.getenv('LEASE_POLL_SECONDS', '1')),
+            on_lost=lease_lost
+        )
+    # A standby carries on with the fleet, so exiting only destroys it when asked to
+    destroy_on_exit = os.getenv('DESTROY_ON_EXIT', 'false' if elector else 'true').lower() == 'true'
+
     cost_manager = None
     try:
         # Initialize cost manager
@@ -439,31 +1125,46 @@ def main():
             project_id=project_id,
             target_spend=target_spend,
             region=region,
-            zone=zone
+            zone=zone,
+            standby=elector is not None
         )
-        
+
         if not cost_manager.test_credentials():
             print("Failed to authenticate. Exiting.")
             sys.exit(1)
-        
-        # Main loop
-        while True:
-            cost_manager.check_and_manage_resources()
-            time.sleep(check_interval * 60)  # Convert minutes to seconds
-            
+
+        if elector is not None:
+            elector.wait_for_leadership(
+                warm=cost_manager.warm,
+                warm_interval=float(os.getenv('STANDBY_WARM_SECONDS', '30'))
+            )
+            cost_manager.start(new_runs=not elector.took_over)
+            if cost_manager.finished:
+                # The leader finished every run before this replica took over
+                cost_manager.cleanup_resources()
+
+        # Main loop, polling more often as budgets get close, until every environment has reached its target
+        controller = AsyncController(cost_manager, check_interval * 60, forecaster=cost_manager.forecaster)
+        if asyncio.run(controller.run()):
+            cost_manager.cleanup_resources()
+
     except KeyboardInterrupt:
         logging.info("Shutting down...")
-        if cost_manager and os.getenv('DESTROY_ON_EXIT', 'true').lower() == 'true':
+        if cost_manager and destroy_on_exit:
             cost_manager.cleanup_resources()
             sys.exit(0)
     except Exception as e:
         logging.error(f"Error in main loop: {str(e)}")
-        if cost_manager and os.getenv('DESTROY_ON_EXIT', 'true').lower() == 'true':
+        if cost_manager and destroy_on_exit:
             try:
                 cost_manager.cleanup_resources()
             except Exception as cleanup_error:
                 logging.error(f"Error during cleanup: {str(cleanup_error)}")
         sys.exit(1)
+    finally:
+        if elector is not None:
+            # A standby takes over right away instead of waiting for the lease to expire
+            elector.stop()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -3,9 +3,26 @@ set -e
 
 # Function to handle cleanup on exit
 cleanup() {
+    if [ -n "${LEASE_PATH}" ]; then
+        # Another replica takes over the run, the fleet is left to whichever holds the lease
+        echo "Leaving resources to the replica holding the controller lease..."
+        pkill -INT -f "python3 cost_manager.py" || true
+        echo "Cleanup complete, exiting container..."
+        exit 0
+    fi
     echo "Cleaning up resources..."
+    # Stop spend first through the Compute API, Terraform then only has to catch up
+    if [ "${TEARDOWN_ACTION:-delete}" != "terraform" ]; then
+        python3 teardown.py || true
+    fi
     echo "Running terraform destroy..."
-    terraform destroy -auto-approve || true
+    # Every environment is applied in its own workspace. The default workspace goes
+    # last: it holds the controller's IAM bindings the other destroys need
+    for ws in $(terraform workspace list 2>/dev/null | tr -d '* ' | grep -vx default) default; do
+        env_name=$ws
+        [ "$ws" == "default" ] && env_name=${TARGET_ENV:-e360}
+        TF_WORKSPACE=$ws terraform destroy -auto-approve -var="target_env=$env_name" || true
+    done
     pkill -f "python3 cost_manager.py"
     echo "Cleanup complete, exiting container..."
     exit 0
@@ -17,8 +34,10 @@ trap cleanup EXIT
 
 echo "==== Starting entrypoint script ===="
 
-echo "==== Current directory contents ===="
-ls -la
+if [ "${LOG_LEVEL:-INFO}" == "DEBUG" ]; then
+    echo "==== Current directory contents ===="
+    ls -la
+fi
 
 # Verify GCP credentials
 echo "==== Testing GCP Authentication ===="
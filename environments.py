@@ -0,0 +1,169 @@
+import json
+import logging
+import os
+import uuid
+
+# The environment Terraform's target_env defaults to; it keeps the default workspace
+DEFAULT_ENV = 'e360'
+
+ENVIRONMENT_FIELDS = ('project_id', 'region', 'zone', 'zones', 'instance_count', 'machine_type', 'target_spend')
+
+
+class EnvironmentConfig:
+    """One entry of Terraform's var.environments map"""
+
+    def __init__(self, name, project_id, region, zone, instance_count, machine_type,
+                 target_spend, billing_account_id=None, zones=None, pools=None):
+        self.name = name
+        self.project_id = project_id
+        self.zone = zone
+        self.region = region or (zone.rsplit('-', 1)[0] if zone else None)
+        # Workers are spread round-robin over these zones, defaulting to just ``zone``
+        self.zones = list(zones) if zones else [zone]
+        self.instance_count = int(instance_count)
+        self.machine_type = machine_type
+        self.target_spend = float(target_spend)
+        self.billing_account_id = billing_account_id
+        # Machine-type pools of a mixed fleet, which only bulk provisioning can create
+        self.pools = pools
+
+    def worker_pools(self):
+        """The fleet as a list of {machine_type, instance_count, zones} pools"""
+        if self.pools:
+            return self.pools
+        return [{'machine_type': self.machine_type, 'instance_count': self.instance_count, 'zones': self.zones}]
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in ENVIRONMENT_FIELDS}
+
+
+class Environment:
+    """Budget, accounting and fleet state the controller keeps for one environment"""
+
+    ACTIVE = 'active'
+    RETIRING = 'retiring'
+    FINISHED = 'finished'
+
+    def __init__(self, config, primary=False):
+        self.config = config
+        self.name = config.name
+        # The primary environment keeps Terraform's default workspace, which is
+        # where the single-environment deployment has always kept its state
+        self.workspace = 'default' if primary else config.name
+        self.run_id = str(uuid.uuid4())[:8]
+        self.resumed = False
+        self.accumulated_cost = 0.0
+        self.zone_costs = {}
+        self.last_update_time = None
+        self.started_at = None
+        self.rollups = None
+        self.cost_per_hour = None
+        self.inventory = None
+        self.accrual = None
+        self.status = Environment.ACTIVE
+        self.retire_started = None
+
+    @property
+    def active(self):
+        return self.status == Environment.ACTIVE
+
+    def __getattr__(self, name):
+        # Expose config fields (project_id, zone, target_spend...) directly
+        if name in ENVIRONMENT_FIELDS:
+            return getattr(self.config, name)
+        raise AttributeError(name)
+
+
+def load_environments(project_id=None, target_spend=None, region=None, zone=None):
+    """Load the environments to manage
+
+    ENVIRONMENTS_FILE points at a JSON object shaped like Terraform's
+    var.environments map; TARGET_ENVS optionally limits it to a comma-separated
+    subset. Without it, a single environment named TARGET_ENV is built from the
+    GCP_* / MACHINE_TYPE / INSTANCE_COUNT variables, spread over the
+    comma-separated GCP_ZONES if set. A fleet plan written by checkquota.py
+    (FLEET_PLAN_FILE) then overrides its environment's fleet shape.
+    """
+    configs = _load_configs(project_id, target_spend, region, zone)
+    plan_path = os.getenv('FLEET_PLAN_FILE')
+    if plan_path and os.path.exists(plan_path):
+        apply_fleet_plan(configs, plan_path, mixed=os.getenv('PROVISION_MODE', 'terraform') == 'bulk')
+    return configs
+
+
+def apply_fleet_plan(configs, path, mixed=False):
+    """Size and place the planned environment's fleet as checkquota.py decided
+
+    Plans mixing several machine types are only accepted with ``mixed``, since
+    Terraform's worker resource has a single machine type.
+    """
+    with open(path, 'r') as f:
+        plan = json.load(f)
+    config = next((config for config in configs if config.name == plan['env']), None)
+    if config is None:
+        raise ValueError(f"Fleet plan {path} is for unknown environment {plan['env']}")
+    if plan['project_id'] != config.project_id:
+        raise ValueError(f"Fleet plan {path} is for project {plan['project_id']}, "
+                         f"environment {config.name} uses {config.project_id}")
+    if len(plan['pools']) != 1 and not mixed:
+        raise ValueError(f"Fleet plan {path} mixes {len(plan['pools'])} machine types, "
+                         f"which needs PROVISION_MODE=bulk")
+
+    pools = [
+        {'machine_type': pool['machine_type'], 'instance_count': int(pool['instance_count']),
+         'zones': list(pool['zones'])}
+        for pool in plan['pools']
+    ]
+    config.region = plan['region']
+    config.zones = []
+    for pool in pools:
+        config.zones.extend(zone for zone in pool['zones'] if zone not in config.zones)
+    config.zone = config.zones[0]
+    config.machine_type = pools[0]['machine_type']
+    config.instance_count = sum(pool['instance_count'] for pool in pools)
+    config.pools = pools if len(pools) > 1 else None
+    for pool in pools:
+        logging.info(f"[{config.name}] Using fleet plan {path}: {pool['instance_count']} x {pool['machine_type']} "
+                     f"in {', '.join(pool['zones'])}")
+
+
+def _load_configs(project_id, target_spend, region, zone):
+    path = os.getenv('ENVIRONMENTS_FILE')
+    if not path:
+        zones = [name.strip() for name in os.getenv('GCP_ZONES', '').split(',') if name.strip()]
+        return [EnvironmentConfig(
+            name=os.getenv('TARGET_ENV', DEFAULT_ENV),
+            project_id=project_id,
+            region=region,
+            zone=zone or (zones[0] if zones else None),
+            instance_count=os.getenv('INSTANCE_COUNT'),
+            machine_type=os.getenv('MACHINE_TYPE'),
+            target_spend=target_spend,
+            zones=zones
+        )]
+
+    with open(path, 'r') as f:
+        entries = json.load(f)
+    selected = [name.strip() for name in os.getenv('TARGET_ENVS', '').split(',') if name.strip()]
+    unknown = set(selected) - set(entries)
+    if unknown:
+        raise ValueError(f"TARGET_ENVS names unknown environments: {', '.join(sorted(unknown))}")
+
+    configs = []
+    for name, entry in entries.items():
+        if selected and name not in selected:
+            continue
+        configs.append(EnvironmentConfig(
+            name=name,
+            project_id=entry['project_id'],
+            region=entry.get('region'),
+            zone=entry['zone'],
+            instance_count=entry['instance_count'],
+            machine_type=entry['machine_type'],
+            target_spend=entry['target_spend'],
+            billing_account_id=entry.get('billing_account_id'),
+            zones=entry.get('zones')
+        ))
+    if not configs:
+        raise ValueError(f"No environments to manage in {path}")
+    return configs
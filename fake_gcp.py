@@ -0,0 +1,323 @@
+import os
+import stat
+import threading
+import time
+from datetime import datetime, timezone
+from google.api_core import exceptions
+from google.cloud import compute_v1, monitoring_v3, resourcemanager_v3
+from inventory import FLEET_LABEL, FLEET_LABEL_VALUE, ENV_LABEL, LIST_PAGE_SIZE
+
+# Stand-in for the terraform binary: logs each call, sleeps FAKE_TERRAFORM_LATENCY seconds
+FAKE_TERRAFORM = """#!/bin/sh
+[ -n "$FAKE_TERRAFORM_LOG" ] && echo "terraform $@ workspace=$TF_WORKSPACE" >> "$FAKE_TERRAFORM_LOG"
+sleep "${FAKE_TERRAFORM_LATENCY:-0}"
+[ "$1" = init ] && mkdir -p .terraform
+exit 0
+"""
+
+
+def install_fake_terraform(directory):
+    """Write the fake terraform binary into ``directory`` and return its path"""
+    path = os.path.join(directory, 'terraform')
+    with open(path, 'w') as f:
+        f.write(FAKE_TERRAFORM)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    return path
+
+
+class RpcCounter:
+    """Counts calls by method across every fake client
+
+    A call fails with whatever exception ``faults(method)`` returns, if any,
+    which is how API errors are injected.
+    """
+
+    def __init__(self, faults=None):
+        self.counts = {}
+        self.faults = faults
+        self._lock = threading.Lock()
+
+    def record(self, method):
+        with self._lock:
+            self.counts[method] = self.counts.get(method, 0) + 1
+        error = self.faults(method) if self.faults is not None else None
+        if error is not None:
+            raise error
+
+    def total(self):
+        with self._lock:
+            return sum(self.counts.values())
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counts)
+
+
+class FakeFleet:
+    """Instances of one project, by zone, as the fake Compute API sees them
+
+    Timestamps are taken from ``clock``. When ``boot_delay`` is set, created
+    instances stay STAGING for ``boot_delay(name)`` seconds before they start,
+    which needs a clock with ``call_later`` such as the simulator's. When
+    ``transitions`` is a list, every status change is appended to it as
+    (time, instance, status), with DELETED for removals.
+    """
+
+    def __init__(self, project_id, clock=time):
+        self.project_id = project_id
+        self.clock = clock
+        self.instances = {}
+        # CPU utilization reported for each instance by name, defaulting to busy
+        self.cpu = {}
+        self.boot_delay = None
+        self.transitions = None
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _timestamp(self, when=None):
+        return datetime.fromtimestamp(self.clock.time() if when is None else when, timezone.utc).isoformat()
+
+    def _changed(self, instance, status, when=None):
+        if self.transitions is not None:
+            self.transitions.append((self.clock.time() if when is None else when, instance, status))
+
+    def add(self, env, zone, count, machine_type, started_at=None):
+        with self._lock:
+            names = [f"video-processor-{env}-{self._next_id + index:03d}" for index in range(count)]
+        self.create(env, zone, names, machine_type, started_at)
+
+    def create(self, env, zone, names, machine_type, started_at=None):
+        booting = self.boot_delay is not None and started_at is None
+        status = 'STAGING' if booting else 'RUNNING'
+        created = self._timestamp(started_at)
+        with self._lock:
+            for name in names:
+                instance = compute_v1.Instance(
+                    name=name,
+                    id=self._next_id,
+                    status=status,
+                    zone=f"projects/{self.project_id}/zones/{zone}",
+                    machine_type=f"projects/{self.project_id}/zones/{zone}/machineTypes/{machine_type}",
+                    labels={FLEET_LABEL: FLEET_LABEL_VALUE, ENV_LABEL: env},
+                    creation_timestamp=created
+                )
+                if not booting:
+                    instance.last_start_timestamp = created
+                self.instances[name] = instance
+                self._changed(instance, status, started_at)
+                self._next_id += 1
+        if booting:
+            for name in names:
+                self.clock.call_later(self.boot_delay(name), self.start, name)
+
+    def remove(self, name):
+        with self._lock:
+            instance = self.instances.pop(name, None)
+            if instance is not None:
+                self._changed(instance, 'DELETED')
+            return instance
+
+    def start(self, name):
+        with self._lock:
+            instance = self.instances.get(name)
+            if instance is None or instance.status == 'RUNNING':
+                return None
+            instance.status = 'RUNNING'
+            instance.last_start_timestamp = self._timestamp()
+            self._changed(instance, 'RUNNING')
+            return instance
+
+    def stop(self, name):
+        with self._lock:
+            instance = self.instances.get(name)
+            if instance is None:
+                return None
+            if instance.status != 'TERMINATED':
+                instance.status = 'TERMINATED'
+                instance.last_stop_timestamp = self._timestamp()
+                self._changed(instance, 'TERMINATED')
+            return instance
+
+    def by_zone(self):
+        with self._lock:
+            zones = {}
+            for instance in self.instances.values():
+                zones.setdefault(instance.zone.rsplit('/', 1)[-1], []).append(instance)
+            return zones
+
+
+class FakeOperation:
+    """A zonal operation that completes the configured latency after it was issued"""
+
+    def __init__(self, latency, apply, clock=time):
+        self.clock = clock
+        self.done_at = clock.monotonic() + latency
+        self.apply = apply
+
+    def result(self, timeout=None):
+        remaining = self.done_at - self.clock.monotonic()
+        if timeout is not None and remaining > timeout:
+            self.clock.sleep(timeout)
+            raise TimeoutError(f"Operation still running after {timeout:.1f}s")
+        self.clock.sleep(max(remaining, 0.0))
+        self.apply()
+
+
+class FakeInstancesClient:
+    def __init__(self, fleets, counter, latency=0.0, operation_latency=None, clock=time):
+        self.fleets = fleets
+        self.counter = counter
+        self.latency = latency
+        self.clock = clock
+        self.operation_latency = latency if operation_latency is None else operation_latency
+        # Bulk inserts into these zones, or of these machine types, fail as if out of capacity
+        self.exhausted_zones = set()
+        self.exhausted_machine_types = set()
+
+    def aggregated_list(self, request=None, metadata=None):
+        fleet = self.fleets[request.project]
+        items = [(f"zones/{zone}", instances) for zone, instances in sorted(fleet.by_zone().items())]
+        page_size = request.max_results or LIST_PAGE_SIZE
+        return self._pages(items, page_size)
+
+    def _pages(self, items, page_size):
+        # One RPC per page, as the real pager would issue
+        remaining = [(scope, instance) for scope, instances in items for instance in instances]
+        while True:
+            self.counter.record('compute.instances.aggregatedList')
+            self.clock.sleep(self.latency)
+            page, remaining = remaining[:page_size], remaining[page_size:]
+            by_scope = {}
+            for scope, instance in page:
+                by_scope.setdefault(scope, []).append(instance)
+            for scope, instances in by_scope.items():
+                yield scope, compute_v1.InstancesScopedList(instances=instances)
+            if not remaining:
+                return
+
+    def _operation(self, method, project, name, apply):
+        self.counter.record(method)
+        self.clock.sleep(self.latency)
+        if name not in self.fleets[project].instances:
+            raise exceptions.NotFound(f"Instance {name} not found")
+        return FakeOperation(self.operation_latency, apply, self.clock)
+
+    def delete(self, project=None, zone=None, instance=None):
+        return self._operation('compute.instances.delete', project, instance,
+                               lambda: self.fleets[project].remove(instance))
+
+    def stop(self, project=None, zone=None, instance=None):
+        return self._operation('compute.instances.stop', project, instance,
+                               lambda: self.fleets[project].stop(instance))
+
+    def bulk_insert(self, project=None, zone=None, bulk_insert_instance_resource_resource=None):
+        self.counter.record('compute.instances.bulkInsert')
+        self.clock.sleep(self.latency)
+        resource = bulk_insert_instance_resource_resource
+        names = list(resource.per_instance_properties)
+        properties = resource.instance_properties
+
+        def apply():
+            if zone in self.exhausted_zones or properties.machine_type in self.exhausted_machine_types:
+                raise exceptions.ServiceUnavailable(f"ZONE_RESOURCE_POOL_EXHAUSTED in {zone}")
+            self.fleets[project].create(properties.labels[ENV_LABEL], zone, names, properties.machine_type)
+
+        return FakeOperation(self.operation_latency, apply, self.clock)
+
+
+class FakeMachineTypesClient:
+    def __init__(self, counter, latency=0.0, clock=time):
+        self.counter = counter
+        self.latency = latency
+        self.clock = clock
+
+    def get(self, request=None, project=None, zone=None, machine_type=None):
+        if request is not None:
+            machine_type = request.machine_type
+        self.counter.record('compute.machineTypes.get')
+        self.clock.sleep(self.latency)
+        return compute_v1.MachineType(name=machine_type, guest_cpus=8, memory_mb=32768)
+
+
+class FakeMetricServiceClient:
+    def __init__(self, counter, latency=0.0, fleets=None, clock=time):
+        self.counter = counter
+        self.latency = latency
+        self.clock = clock
+        self.fleets = fleets or {}
+        self.series_written = 0
+
+    def list_time_series(self, request=None):
+        # Served as one page: one aligned point per minute of the interval for every running worker
+        self.counter.record('monitoring.timeSeries.list')
+        self.clock.sleep(self.latency)
+        fleet = self.fleets[request.name.rsplit('/', 1)[-1]]
+        start = int(request.interval.start_time.timestamp())
+        end = int(request.interval.end_time.timestamp())
+        period = int(request.aggregation.alignment_period.total_seconds())
+        for instance in list(fleet.instances.values()):
+            if instance.status != 'RUNNING':
+                continue
+            series = monitoring_v3.TimeSeries()
+            series.resource.type = 'gce_instance'
+            series.resource.labels['instance_id'] = str(instance.id)
+            series.metric.labels['instance_name'] = instance.name
+            value = fleet.cpu.get(instance.name, 0.6)
+            series.points = [
+                monitoring_v3.Point({
+                    'interval': {'end_time': {'seconds': aligned}},
+                    'value': {'double_value': value}
+                })
+                for aligned in range(end - end % period, start, -period)
+            ]
+            yield series
+
+    def create_time_series(self, request=None, name=None, time_series=None):
+        self.counter.record('monitoring.timeSeries.create')
+        self.clock.sleep(self.latency)
+        if isinstance(request, dict):
+            time_series = request.get('time_series', [])
+        elif request is not None:
+            time_series = request.time_series
+        self.series_written += len(time_series or [])
+
+
+class FakeProjectsClient:
+    def __init__(self, counter, latency=0.0, clock=time):
+        self.counter = counter
+        self.latency = latency
+        self.clock = clock
+
+    def get_project(self, name=None):
+        self.counter.record('resourcemanager.projects.get')
+        self.clock.sleep(self.latency)
+        return resourcemanager_v3.Project(name=name, project_id=name.rsplit('/', 1)[-1])
+
+
+class FakeCredentials:
+    def token(self):
+        return 'fake-token'
+
+    def close(self):
+        pass
+
+
+class FakeClientFactory:
+    """Drop-in for transport.ClientFactory that serves the fakes above"""
+
+    def __init__(self, fleets, latency=0.0, operation_latency=None, clock=time, faults=None):
+        self.counter = RpcCounter(faults)
+        self.credentials = FakeCredentials()
+        self.fleets = fleets
+        self._clients = {
+            compute_v1.InstancesClient: FakeInstancesClient(fleets, self.counter, latency, operation_latency, clock),
+            compute_v1.MachineTypesClient: FakeMachineTypesClient(self.counter, latency, clock),
+            monitoring_v3.MetricServiceClient: FakeMetricServiceClient(self.counter, latency, fleets, clock),
+            resourcemanager_v3.ProjectsClient: FakeProjectsClient(self.counter, latency, clock),
+        }
+
+    def client(self, client_class):
+        return self._clients[client_class]
+
+    def close(self):
+        pass
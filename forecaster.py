@@ -0,0 +1,64 @@
+import logging
+import math
+
+# Used until a teardown has been measured; terraform destroy of a small fleet takes a couple of minutes
+DEFAULT_TEARDOWN_SECONDS = 120.0
+
+
+class BurnRateForecaster:
+    """Projects when an environment's spend will cross its target at the current burn rate
+
+    Teardown is started ``lead_time`` seconds before the projected crossing, where
+    the lead time is a smoothed measurement of how long past teardowns took.
+    Polling is adaptive: the next poll is a fixed fraction of the time left
+    before teardown, so the fleet is listed rarely while the target is far away
+    and densely as it gets close. With a fraction of 1/4 the burn rate can double
+    between two polls and the next poll still lands before the crossing.
+    """
+
+    def __init__(self, teardown_seconds=DEFAULT_TEARDOWN_SECONDS, min_interval=5.0,
+                 max_interval=300.0, poll_fraction=0.25, smoothing=0.5):
+        self.default_teardown = teardown_seconds
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.poll_fraction = poll_fraction
+        self.smoothing = smoothing
+        self.teardowns = {}
+
+    def lead_time(self, env_name):
+        """Seconds before the crossing that teardown of an environment should start"""
+        return self.teardowns.get(env_name, self.default_teardown)
+
+    def record_teardown(self, env_name, seconds):
+        """Fold a measured trigger-to-stopped duration into the lead time and return the new estimate"""
+        previous = self.teardowns.get(env_name)
+        if previous is None:
+            estimate = seconds
+        else:
+            estimate = self.smoothing * seconds + (1 - self.smoothing) * previous
+        self.teardowns[env_name] = estimate
+        logging.info(f"[{env_name}] Spend stopped {seconds:.1f}s after the budget trigger, "
+                     f"teardown lead time is now {estimate:.1f}s")
+        return estimate
+
+    def seconds_to_target(self, cost, target, hourly_rate):
+        """Seconds until ``cost`` reaches ``target`` at ``hourly_rate``, or None if it isn't rising"""
+        if cost >= target:
+            return 0.0
+        if hourly_rate <= 0:
+            return None
+        return (target - cost) * 3600.0 / hourly_rate
+
+    def seconds_to_cutoff(self, env_name, cost, target, hourly_rate):
+        """Seconds until an environment's teardown should start, or None if spend isn't rising"""
+        remaining = self.seconds_to_target(cost, target, hourly_rate)
+        if remaining is None:
+            return None
+        return max(0.0, remaining - self.lead_time(env_name))
+
+    def poll_interval(self, seconds_to_cutoff, default):
+        """How long to wait before listing the fleet again"""
+        if seconds_to_cutoff is None or math.isinf(seconds_to_cutoff):
+            return default
+        interval = seconds_to_cutoff * self.poll_fraction
+        return min(self.max_interval, max(self.min_interval, interval))
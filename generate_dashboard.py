@@ -0,0 +1,138 @@
+import argparse
+import json
+import sys
+from rollups import SPEND_METRIC, FLEET_SIZE_METRIC, CUMULATIVE_SPEND_METRIC
+
+DASHBOARD_NAME = 'Spender Cost Monitor Dashboard'
+DEFAULT_OUTPUT = 'dashboard.json'
+
+
+def series_filter(metric_type, **labels):
+    """Monitoring filter for one metric on the generic_node resources the controller writes"""
+    clauses = [f'metric.type="{metric_type}"', 'resource.type="generic_node"']
+    clauses.extend(f'metric.labels.{name}="{value}"' for name, value in sorted(labels.items()))
+    return ' '.join(clauses)
+
+
+def query(metric_type, alignment_period, aligner, reducer='REDUCE_SUM', group_by=(), unit=None, **labels):
+    aggregation = {
+        'alignmentPeriod': alignment_period,
+        'perSeriesAligner': aligner,
+        'crossSeriesReducer': reducer,
+    }
+    if group_by:
+        aggregation['groupByFields'] = list(group_by)
+    time_series_query = {
+        'timeSeriesFilter': {
+            'filter': series_filter(metric_type, **labels),
+            'aggregation': aggregation,
+        }
+    }
+    if unit:
+        time_series_query['unitOverride'] = unit
+    return time_series_query
+
+
+def scorecard(title, time_series_query):
+    return {
+        'title': title,
+        'scorecard': {
+            'timeSeriesQuery': time_series_query,
+            'sparkChartView': {'sparkChartType': 'SPARK_LINE'},
+        },
+    }
+
+
+def xy_chart(title, time_series_query, plot_type='LINE', y_label=None):
+    chart = {
+        'dataSets': [{
+            'timeSeriesQuery': time_series_query,
+            'plotType': plot_type,
+            'minAlignmentPeriod': time_series_query['timeSeriesFilter']['aggregation']['alignmentPeriod'],
+        }],
+        'timeshiftDuration': '0s',
+    }
+    if y_label:
+        chart['yAxis'] = {'label': y_label, 'scale': 'LINEAR'}
+    return {'title': title, 'xyChart': chart}
+
+
+def build_dashboard():
+    """The Spender dashboard, reading only the rollup series
+
+    Long-range tiles read the hourly rollups, which have one point per hour and
+    run, instead of the raw total_cost gauge written every tick.
+    """
+    spend_1m = SPEND_METRIC.format(period='1m')
+    spend_1h = SPEND_METRIC.format(period='1h')
+    fleet_1m = FLEET_SIZE_METRIC.format(period='1m')
+    fleet_1h = FLEET_SIZE_METRIC.format(period='1h')
+    by_env = ['metric.labels.environment']
+
+    # (width, height, widget) rows, laid out left to right on a 12-column grid
+    rows = [
+        [
+            (6, 3, scorecard('Total Spend (Last 30 Days)',
+                             query(spend_1h, '2592000s', 'ALIGN_SUM', unit='USD'))),
+            (6, 3, scorecard('Total Spend (Last 7 Days)',
+                             query(spend_1h, '604800s', 'ALIGN_SUM', unit='USD'))),
+        ],
+        [
+            (6, 4, xy_chart('Spend per Hour by Environment',
+                            query(spend_1h, '3600s', 'ALIGN_SUM', group_by=by_env, unit='USD'),
+                            plot_type='STACKED_BAR', y_label='USD')),
+            # env_spend is CUMULATIVE, which ALIGN_MAX doesn't accept; its latest value is the run's total
+            (6, 4, xy_chart('Cumulative Spend by Run',
+                            query(CUMULATIVE_SPEND_METRIC, '3600s', 'ALIGN_NEXT_OLDER', reducer='REDUCE_MAX',
+                                  group_by=['metric.labels.environment', 'metric.labels.run_id'], unit='USD'),
+                            y_label='USD')),
+        ],
+        [
+            (6, 4, xy_chart('Spend per Minute by Environment',
+                            query(spend_1m, '60s', 'ALIGN_SUM', group_by=by_env, unit='USD'),
+                            y_label='USD')),
+            # A run counts as active in an hour it added spend in
+            (6, 4, xy_chart('Active Runs',
+                            query(CUMULATIVE_SPEND_METRIC, '3600s', 'ALIGN_DELTA', reducer='REDUCE_COUNT',
+                                  group_by=['metric.labels.run_id']),
+                            plot_type='STACKED_BAR')),
+        ],
+        [
+            (6, 4, xy_chart('Fleet Size (Per-Minute Mean)',
+                            query(fleet_1m, '60s', 'ALIGN_MEAN', group_by=by_env, stat='mean'),
+                            y_label='Instances')),
+            (6, 4, xy_chart('Fleet Size (Hourly Max)',
+                            query(fleet_1h, '3600s', 'ALIGN_MAX', group_by=by_env, stat='max'),
+                            plot_type='STACKED_BAR', y_label='Instances')),
+        ],
+    ]
+
+    tiles = []
+    y = 0
+    for row in rows:
+        x = 0
+        for width, height, widget in row:
+            tiles.append({'width': width, 'height': height, 'xPos': x, 'yPos': y, 'widget': widget})
+            x += width
+        y += max(height for _, height, _ in row)
+    return {'displayName': DASHBOARD_NAME, 'mosaicLayout': {'columns': 12, 'tiles': tiles}}
+
+
+def main():
+    """Rebuild dashboard.json against the controller's rollup metrics"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--output', default=DEFAULT_OUTPUT, help="Write here, or '-' for stdout")
+    args = parser.parse_args()
+
+    output = json.dumps(build_dashboard(), indent=2) + '\n'
+    if args.output == '-':
+        sys.stdout.write(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+        print(f"Wrote {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import logging
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = 'spender_'
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, math.inf)
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = []
+    for name, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{name}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Histogram:
+    __slots__ = ('buckets', 'sum', 'count')
+
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if value <= bound:
+                self.buckets[index] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class _Span:
+    __slots__ = ('registry', 'key', 'start')
+
+    def __init__(self, registry, key, sampled):
+        self.registry = registry
+        self.key = key
+        self.start = time.perf_counter() if sampled else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        duration = time.perf_counter() - self.start if self.start is not None else None
+        self.registry._finish(self.key, duration, exc_type is not None)
+        return False
+
+
+class Instrumentation:
+    """Spans, counters and gauges for the controller itself, rendered in Prometheus text format
+
+    Every span is counted, and errors raised inside one are counted too, but only
+    one in ``sample_every`` calls of each span is timed. Sampling is per span
+    name and starts with the first call, so rare spans such as terraform
+    commands are still timed. Gauges are callbacks evaluated at scrape time, so
+    queue depths cost nothing on the hot path.
+    """
+
+    def __init__(self, sample_every=10):
+        self.sample_every = max(1, int(sample_every))
+        self._calls = {}
+        self._errors = {}
+        self._durations = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def span(self, name, **labels):
+        """Context manager timing a phase; ``name`` becomes spender_<name>_seconds"""
+        key = _key(name, labels)
+        with self._lock:
+            calls = self._calls.get(key, 0)
+            self._calls[key] = calls + 1
+        return _Span(self, key, calls % self.sample_every == 0)
+
+    def _finish(self, key, duration, failed):
+        with self._lock:
+            if failed:
+                self._errors[key] = self._errors.get(key, 0) + 1
+            if duration is not None:
+                histogram = self._durations.get(key)
+                if histogram is None:
+                    histogram = self._durations[key] = _Histogram()
+                histogram.observe(duration)
+
+    def count(self, name, value=1, **labels):
+        """Add to the counter spender_<name>_total"""
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def gauge(self, name, fn, **labels):
+        """Register ``fn`` to report spender_<name> whenever metrics are scraped"""
+        with self._lock:
+            self._gauges[_key(name, labels)] = fn
+
+    def set_gauge(self, name, value, **labels):
+        self.gauge(name, lambda: value, **labels)
+
+    def render(self):
+        """Everything recorded so far in Prometheus text exposition format"""
+        with self._lock:
+            calls = dict(self._calls)
+            errors = dict(self._errors)
+            durations = {key: (list(h.buckets), h.sum, h.count) for key, h in self._durations.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        lines = []
+
+        def family(metric, kind, help_text, samples):
+            if not samples:
+                return
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} {kind}')
+            lines.extend(samples)
+
+        span_names = sorted({name for name, _ in calls})
+        for name in span_names:
+            metric = f'{PREFIX}{name}'
+            family(f'{metric}_calls_total', 'counter', f'Calls of the {name} span', [
+                f'{metric}_calls_total{_format_labels(labels)} {count}'
+                for (span, labels), count in sorted(calls.items()) if span == name
+            ])
+            family(f'{metric}_errors_total', 'counter', f'Calls of the {name} span that raised', [
+                f'{metric}_errors_total{_format_labels(labels)} {count}'
+                for (span, labels), count in sorted(errors.items()) if span == name
+            ])
+            samples = []
+            for (span, labels), (buckets, total, count) in sorted(durations.items()):
+                if span != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(DURATION_BUCKETS, buckets):
+                    cumulative += bucket
+                    samples.append(f'{metric}_seconds_bucket'
+                                   f'{_format_labels(labels, [("le", _format_value(bound))])} {cumulative}')
+                samples.append(f'{metric}_seconds_sum{_format_labels(labels)} {_format_value(total)}')
+                samples.append(f'{metric}_seconds_count{_format_labels(labels)} {count}')
+            family(f'{metric}_seconds', 'histogram', f'Sampled duration of the {name} span', samples)
+
+        for name in sorted({name for name, _ in counters}):
+            metric = f'{PREFIX}{name}_total'
+            family(metric, 'counter', name.replace('_', ' ').capitalize(), [
+                f'{metric}{_format_labels(labels)} {_format_value(value)}'
+                for (counter, labels), value in sorted(counters.items()) if counter == name
+            ])
+
+        for name in sorted({name for name, _ in gauges}):
+            metric = f'{PREFIX}{name}'
+            samples = []
+            for (gauge, labels), fn in sorted(gauges.items(), key=lambda item: item[0]):
+                if gauge != name:
+                    continue
+                try:
+                    value = fn()
+                except Exception as e:
+                    logging.debug(f"Error reading gauge {name}: {str(e)}")
+                    continue
+                if value is not None:
+                    samples.append(f'{metric}{_format_labels(labels)} {_format_value(value)}')
+            family(metric, 'gauge', name.replace('_', ' ').capitalize(), samples)
+
+        return '\n'.join(lines) + '\n'
+
+
+class ErrorCounter(logging.Handler):
+    """Counts log records at WARNING and above by level"""
+
+    def __init__(self, instrumentation):
+        super().__init__(level=logging.WARNING)
+        self.instrumentation = instrumentation
+
+    def emit(self, record):
+        self.instrumentation.count('log_messages', level=record.levelname.lower())
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    instrumentation = None
+
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = self.instrumentation.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would otherwise flood stderr
+        pass
+
+
+def serve(instrumentation, port, host=''):
+    """Serve /metrics on ``port`` from a daemon thread and return the server"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'instrumentation': instrumentation})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    logging.info(f"Serving controller metrics on port {port} at /metrics")
+    return server
+
+
+# Shared by every module of the controller
+telemetry = Instrumentation()
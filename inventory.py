@@ -0,0 +1,177 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from google.cloud import compute_v1
+from instrumentation import telemetry
+
+# Workers carry these labels (see main.tf); the selector matches every worker in a project
+FLEET_LABEL = 'spender-fleet'
+FLEET_LABEL_VALUE = 'video-processor'
+ENV_LABEL = 'spender-env'
+DEFAULT_SELECTOR = f'labels.{FLEET_LABEL} = {FLEET_LABEL_VALUE}'
+INSTANCE_NAME_PREFIX = 'video-processor-'
+
+# Only the fields the controller reads are requested from the Compute API
+INSTANCE_FIELDS = (
+    'name',
+    'id',
+    'status',
+    'machineType',
+    'labels',
+    'creationTimestamp',
+    'lastStartTimestamp',
+    'lastStopTimestamp',
+)
+LIST_FIELD_MASK = f"nextPageToken,items/*/instances({','.join(INSTANCE_FIELDS)})"
+LIST_PAGE_SIZE = 500
+
+
+def parse_timestamp(value):
+    """Convert a Compute API RFC 3339 timestamp into epoch seconds"""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        logging.warning(f"Unparseable instance timestamp: {value}")
+        return None
+
+
+def env_from_name(name):
+    """Environment of an unlabelled worker named video-processor-<env>-NNN"""
+    if not name.startswith(INSTANCE_NAME_PREFIX):
+        return None
+    return name[len(INSTANCE_NAME_PREFIX):].rsplit('-', 1)[0]
+
+
+class InstanceRecord:
+    """The subset of an instance the controller cares about"""
+
+    __slots__ = (
+        'name', 'id', 'status', 'machine_type', 'zone', 'env',
+        'created_at', 'last_start', 'last_stop', 'fingerprint',
+    )
+
+    def __init__(self, instance, zone, fingerprint):
+        self.name = instance.name
+        self.id = instance.id
+        self.status = instance.status
+        self.machine_type = instance.machine_type.rsplit('/', 1)[-1]
+        self.zone = zone
+        self.env = instance.labels.get(ENV_LABEL) or env_from_name(instance.name)
+        self.created_at = parse_timestamp(instance.creation_timestamp)
+        self.last_start = parse_timestamp(instance.last_start_timestamp)
+        self.last_stop = parse_timestamp(instance.last_stop_timestamp)
+        self.fingerprint = fingerprint
+
+    @property
+    def running(self):
+        return self.status == "RUNNING"
+
+
+class InventorySnapshot:
+    """Point-in-time view of one environment's workers shared by a control tick"""
+
+    def __init__(self, records, taken_at, wall_time, parsed):
+        self.instances = records
+        self.taken_at = taken_at
+        self.wall_time = wall_time
+        self.parsed = parsed
+        self.running = [record for record in records if record.running]
+
+    @property
+    def instance_count(self):
+        return len(self.instances)
+
+    @property
+    def running_count(self):
+        return len(self.running)
+
+    def running_by_zone(self):
+        counts = {}
+        for record in self.running:
+            counts[record.zone] = counts.get(record.zone, 0) + 1
+        return counts
+
+
+class FleetInventory:
+    """Lists every worker of a project, in every zone, with one aggregated call per refresh
+
+    Workers are selected by label and partitioned into per-environment snapshots
+    by their spender-env label. Records whose cost-relevant fields are unchanged
+    since the previous refresh are reused instead of re-parsed.
+    """
+
+    def __init__(self, compute_client, project_id, selector=DEFAULT_SELECTOR, clock=time):
+        self.compute_client = compute_client
+        self.project_id = project_id
+        self.selector = selector
+        self.clock = clock
+        self.taken_at = None
+        self.wall_time = None
+        self.requests = 0
+        self._records = {}
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """List the project's workers and return fresh snapshots by environment name"""
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        request = compute_v1.AggregatedListInstancesRequest(
+            project=self.project_id,
+            filter=self.selector,
+            max_results=LIST_PAGE_SIZE
+        )
+        self.requests += 1
+        telemetry.count('rpc', method='compute.instances.aggregatedList')
+        pages = self.compute_client.aggregated_list(
+            request=request,
+            metadata=(('x-goog-fieldmask', LIST_FIELD_MASK),)
+        )
+
+        records = {}
+        parsed = {}
+        for scope, scoped_list in pages:
+            zone = scope.rsplit('/', 1)[-1]
+            for instance in scoped_list.instances:
+                # Anything that can change the cost of an instance is part of its fingerprint
+                fingerprint = (
+                    instance.status,
+                    instance.machine_type,
+                    instance.last_start_timestamp,
+                    instance.last_stop_timestamp,
+                )
+                record = self._records.get(instance.id)
+                if record is None or record.fingerprint != fingerprint:
+                    record = InstanceRecord(instance, zone, fingerprint)
+                    parsed[record.env] = parsed.get(record.env, 0) + 1
+                records[instance.id] = record
+
+        by_env = {}
+        for record in records.values():
+            by_env.setdefault(record.env, []).append(record)
+
+        self._records = records
+        self.taken_at = self.clock.monotonic()
+        self.wall_time = self.clock.time()
+        self._snapshots = {
+            env: InventorySnapshot(env_records, self.taken_at, self.wall_time, parsed.get(env, 0))
+            for env, env_records in by_env.items()
+        }
+        return self._snapshots
+
+    def snapshot(self, env):
+        """Latest snapshot of one environment, or None before the first refresh"""
+        with self._lock:
+            if self.taken_at is None:
+                return None
+            snapshot = self._snapshots.get(env)
+            if snapshot is None:
+                # An environment without workers still gets a timed, empty snapshot
+                snapshot = InventorySnapshot([], self.taken_at, self.wall_time, 0)
+                self._snapshots[env] = snapshot
+            return snapshot
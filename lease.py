@@ -0,0 +1,243 @@
+import fcntl
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from instrumentation import telemetry
+
+
+def holder_identity():
+    """Names this replica in the lease: host, process and a random suffix"""
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+
+
+class Lease:
+    """Time-limited exclusive claim to run the controller, shared by every replica
+
+    ``try_acquire`` takes the lease if it is free, expired or already ours and
+    extends it by ``ttl`` seconds; renewing is acquiring again. Backends only
+    implement ``_transact``, which applies a change to the stored state
+    atomically. ``generation`` goes up whenever the holder changes.
+    """
+
+    def __init__(self, holder, ttl=10.0, clock=time):
+        self.holder = holder
+        self.ttl = ttl
+        self.clock = clock
+        # As of the last attempt
+        self.current_holder = None
+        self.expires = None
+        self.generation = None
+        self.previous_holder = None
+        self.previous_expires = None
+
+    def _transact(self, change):
+        """Replace the stored state with ``change(state)`` unless it returns None, returning the stored state"""
+        raise NotImplementedError
+
+    def try_acquire(self):
+        now = self.clock.time()
+        previous = {}
+
+        def take(state):
+            holder = state.get('holder')
+            if holder not in (None, self.holder) and state.get('expires', 0.0) > now:
+                return None
+            previous.update(state)
+            return {
+                'holder': self.holder,
+                'expires': now + self.ttl,
+                'generation': state.get('generation', 0) + (holder != self.holder),
+            }
+
+        state = self._transact(take)
+        self.current_holder = state.get('holder')
+        self.expires = state.get('expires')
+        self.generation = state.get('generation')
+        if previous.get('holder') not in (None, self.holder):
+            self.previous_holder = previous['holder']
+            self.previous_expires = previous.get('expires')
+        return self.current_holder == self.holder
+
+    def release(self):
+        """Give the lease up at once, so a standby doesn't wait for it to expire"""
+        def drop(state):
+            if state.get('holder') != self.holder:
+                return None
+            return {'holder': None, 'expires': 0.0, 'generation': state.get('generation', 0)}
+
+        self._transact(drop)
+
+
+class FileLease(Lease):
+    """Lease kept as JSON in a file and changed under an exclusive flock
+
+    Suits replicas on one host, or sharing a filesystem whose POSIX locks work
+    across hosts. Expiry is compared on the wall clock, so the replicas' clocks
+    need to agree to well within ``ttl``.
+    """
+
+    def __init__(self, path, holder, ttl=10.0, clock=time):
+        super().__init__(holder, ttl, clock)
+        self.path = path
+
+    def _transact(self, change):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, 'r+') as f:
+            # Released when the file is closed
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                state = json.loads(f.read() or '{}')
+            except ValueError:
+                logging.warning(f"Ignoring unreadable lease file {self.path}")
+                state = {}
+            updated = change(state)
+            if updated is None:
+                return state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(updated))
+            f.flush()
+            os.fsync(f.fileno())
+            return updated
+
+
+class MemoryLease(Lease):
+    """Lease shared through a dict by replicas in one process, for tests and simulations"""
+
+    def __init__(self, store, holder, ttl=10.0, clock=time):
+        super().__init__(holder, ttl, clock)
+        self.store = store
+        self._lock = store.setdefault('_lock', threading.Lock())
+
+    def _transact(self, change):
+        with self._lock:
+            state = self.store.get('state', {})
+            updated = change(dict(state))
+            if updated is None:
+                return state
+            self.store['state'] = updated
+            return updated
+
+
+# LEASE_BACKEND values, each taking the LEASE_PATH location
+LEASE_BACKENDS = {'file': FileLease}
+
+
+def open_lease(backend, location, holder=None, ttl=10.0):
+    if backend not in LEASE_BACKENDS:
+        raise ValueError(f"Unknown LEASE_BACKEND {backend}, expected one of {', '.join(LEASE_BACKENDS)}")
+    return LEASE_BACKENDS[backend](location, holder or holder_identity(), ttl=ttl)
+
+
+class LeaderElector:
+    """Waits for a replica's turn to hold the lease, then keeps it
+
+    A standby tries the lease every ``poll_interval`` seconds, so it takes over
+    within about that long of the leader's lease expiring, and runs ``warm``
+    every ``warm_interval`` seconds meanwhile to keep its caches current. Once
+    leader, a background thread renews every ``renew_interval`` seconds. If a
+    renewal finds the lease taken, or renewals keep failing until it is about
+    to expire, ``on_lost`` is called: another replica may be enforcing by then,
+    so the caller has to stop acting on the fleet at once.
+    """
+
+    def __init__(self, lease, renew_interval=3.0, poll_interval=1.0, on_lost=None, clock=time):
+        self.lease = lease
+        self.renew_interval = renew_interval
+        self.poll_interval = poll_interval
+        self.on_lost = on_lost
+        self.clock = clock
+        self.leader = False
+        # Whether the lease was held by another replica when this one got it
+        self.took_over = False
+        self._stop = threading.Event()
+        self._thread = None
+        telemetry.gauge('lease_leader', lambda: int(self.leader))
+
+    def _try_acquire(self):
+        try:
+            return self.lease.try_acquire()
+        except Exception as e:
+            logging.error(f"Error acquiring controller lease: {str(e)}")
+            return False
+
+    def wait_for_leadership(self, warm=None, warm_interval=30.0):
+        """Block until this replica holds the lease, warming up in the background meanwhile"""
+        waited = self.clock.monotonic()
+        warmer = None
+        warming = None
+        warmed_at = None
+        attempts = 0
+        try:
+            while not self._try_acquire():
+                if attempts == 0:
+                    logging.info(f"Standing by, controller lease held by {self.lease.current_holder}")
+                attempts += 1
+                now = self.clock.monotonic()
+                if warm is not None and (warming is None or warming.done()) and \
+                        (warmed_at is None or now - warmed_at >= warm_interval):
+                    if warmer is None:
+                        warmer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='warm')
+                    warming = warmer.submit(warm)
+                    warmed_at = now
+                self.clock.sleep(self.poll_interval)
+        finally:
+            if warmer is not None:
+                # A warm-up under way is left to finish, taking over doesn't wait for it
+                warmer.shutdown(wait=False)
+
+        self.leader = True
+        self.took_over = attempts > 0
+        if self.took_over:
+            telemetry.count('lease_takeovers')
+            if self.lease.previous_holder is not None:
+                expired_for = max(self.lease.clock.time() - self.lease.previous_expires, 0.0)
+                released = f"from {self.lease.previous_holder}, {expired_for:.1f}s after it expired"
+            else:
+                released = "after it was released"
+            logging.info(f"Took over the controller lease (generation {self.lease.generation}) {released}, "
+                         f"having stood by for {self.clock.monotonic() - waited:.1f}s")
+        else:
+            logging.info(f"Acquired the controller lease (generation {self.lease.generation})")
+        self._thread = threading.Thread(target=self._keep, name='lease', daemon=True)
+        self._thread.start()
+
+    def _keep(self):
+        # Renewals have to succeed before the lease could be taken from under us
+        deadline = self.clock.monotonic() + self.lease.ttl
+        while not self._stop.wait(self.renew_interval):
+            attempt = self.clock.monotonic()
+            try:
+                if self.lease.try_acquire():
+                    deadline = attempt + self.lease.ttl
+                    continue
+                reason = f"taken over by {self.lease.current_holder}"
+            except Exception as e:
+                if self.clock.monotonic() + self.renew_interval < deadline:
+                    logging.error(f"Error renewing controller lease: {str(e)}")
+                    continue
+                reason = f"renewals failing until it expired: {str(e)}"
+            self.leader = False
+            telemetry.count('lease_lost')
+            logging.error(f"Lost the controller lease, {reason}")
+            if self.on_lost is not None:
+                self.on_lost()
+            return
+
+    def stop(self):
+        """Stop renewing and release the lease if this replica still holds it"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.leader:
+            self.leader = False
+            try:
+                self.lease.release()
+                logging.info("Released the controller lease")
+            except Exception as e:
+                logging.error(f"Error releasing controller lease: {str(e)}")
@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import threading
+import time
+
+# Records written before the ledger tracked environments belong to this one
+LEGACY_ENV = 'e360'
+
+
+class LedgerState:
+    """State of the most recent run of one environment recorded in the ledger"""
+
+    def __init__(self, env, run_id, target_spend=None, started_at=None):
+        self.env = env
+        self.run_id = run_id
+        self.target_spend = target_spend
+        self.started_at = started_at
+        self.accumulated_cost = 0.0
+        self.zone_costs = {}
+        self.checkpoint_time = started_at
+        self.closed = False
+
+    def to_records(self):
+        """Minimal records that reproduce this state"""
+        records = [{
+            'type': 'run',
+            'env': self.env,
+            'run_id': self.run_id,
+            'target_spend': self.target_spend,
+            'time': self.started_at,
+        }]
+        if self.checkpoint_time is not None:
+            records.append({
+                'type': 'checkpoint',
+                'env': self.env,
+                'run_id': self.run_id,
+                'cost': self.accumulated_cost,
+                'zones': self.zone_costs,
+                'time': self.checkpoint_time,
+            })
+        if self.closed:
+            records.append({'type': 'closed', 'env': self.env, 'run_id': self.run_id})
+        return records
+
+
+class CostLedger:
+    """Append-only JSON-lines file of run starts and cost checkpoints for every environment
+
+    Records are written to the OS on every append, so a crash of the process
+    loses nothing. fsync is batched to once per ``fsync_interval`` seconds, which
+    bounds what a host crash can lose without putting a disk flush on every tick.
+    The file is rewritten down to the latest state after ``compact_after`` appends.
+    Measured teardown lead times are kept per environment across runs.
+    """
+
+    def __init__(self, path, fsync_interval=30.0, compact_after=1000, clock=time):
+        self.path = path
+        self.fsync_interval = fsync_interval
+        self.compact_after = compact_after
+        self.clock = clock
+        self.states = {}
+        self.teardowns = {}
+        self._file = None
+        self._appended = 0
+        self._last_sync = clock.monotonic()
+        self._lock = threading.RLock()
+
+    def load(self):
+        """Replay the ledger and return the latest run state of each environment"""
+        states = {}
+        appended = 0
+        self.teardowns = {}
+        try:
+            with open(self.path, 'rb+') as f:
+                valid_end = 0
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # A crash mid-append leaves a torn last line, drop it
+                        # so the next append starts on a fresh line
+                        logging.warning(f"Truncating partial ledger record in {self.path}")
+                        f.truncate(valid_end)
+                        break
+                    valid_end += len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        logging.warning(f"Skipping unreadable ledger record in {self.path}")
+                        continue
+                    appended += 1
+                    self._apply(states, record)
+        except FileNotFoundError:
+            pass
+        self.states = states
+        self._appended = appended
+        return states
+
+    def _apply(self, states, record):
+        kind = record.get('type')
+        env = record.get('env', LEGACY_ENV)
+        if kind == 'teardown':
+            self.teardowns[env] = record['seconds']
+            return
+        if kind == 'run':
+            states[env] = LedgerState(env, record['run_id'], record.get('target_spend'), record.get('time'))
+            return
+        state = states.get(env)
+        if state is None or record.get('run_id') != state.run_id:
+            return
+        if kind == 'checkpoint':
+            state.accumulated_cost = record['cost']
+            state.zone_costs = record.get('zones', {})
+            state.checkpoint_time = record['time']
+        elif kind == 'closed':
+            state.closed = True
+
+    def _append(self, record):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(json.dumps(record, separators=(',', ':')) + '\n')
+            self._file.flush()
+            self._apply(self.states, record)
+            self._appended += 1
+
+            if self._appended >= self.compact_after:
+                self.compact()
+            elif self.clock.monotonic() - self._last_sync >= self.fsync_interval:
+                self.sync()
+
+    def start_run(self, env, run_id, target_spend, started_at=None):
+        """Record the start of a new run, at ``started_at`` (wall clock) or now"""
+        self._append({
+            'type': 'run',
+            'env': env,
+            'run_id': run_id,
+            'target_spend': target_spend,
+            'time': started_at if started_at is not None else self.clock.time(),
+        })
+        self.sync()
+
+    def checkpoint(self, env, run_id, accumulated_cost, checkpoint_time, zone_costs=None):
+        """Record the accumulated cost, in total and by zone, as of ``checkpoint_time`` (wall clock)"""
+        self._append({
+            'type': 'checkpoint',
+            'env': env,
+            'run_id': run_id,
+            'cost': accumulated_cost,
+            'zones': dict(zone_costs or {}),
+            'time': checkpoint_time,
+        })
+
+    def close_run(self, env, run_id):
+        """Mark a run as finished so the next start begins a new one"""
+        self._append({'type': 'closed', 'env': env, 'run_id': run_id})
+        self.sync()
+
+    def record_teardown(self, env, seconds):
+        """Record an environment's teardown lead time estimate"""
+        self._append({'type': 'teardown', 'env': env, 'seconds': seconds})
+
+    def sync(self):
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+            self._last_sync = self.clock.monotonic()
+
+    def compact(self):
+        """Rewrite the ledger with only the records needed to restore the latest state"""
+        with self._lock:
+            self._compact()
+
+    def _compact(self):
+        records = []
+        for state in self.states.values():
+            records.extend(state.to_records())
+        for env, seconds in self.teardowns.items():
+            records.append({'type': 'teardown', 'env': env, 'seconds': seconds})
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(tmp_path, self.path)
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        self._appended = len(records)
+        self._last_sync = self.clock.monotonic()
+        logging.info(f"Compacted cost ledger {self.path} to {len(records)} records")
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self.sync()
+                self._file.close()
+                self._file = None
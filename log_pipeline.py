@@ -0,0 +1,158 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from instrumentation import telemetry
+
+TEXT_FORMAT = '%(asctime)s [%(levelname)s] %(message)s'
+TEXT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Attributes every LogRecord has; anything else was passed through ``extra=`` and is logged as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the fields Cloud Logging reads from structured logs"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'severity': record.levelname,
+            'message': record.getMessage(),
+            'logger': record.name,
+            'thread': record.threadName,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Drops repeated messages and caps how often each logging call site can emit
+
+    An identical message at the same level is dropped for ``dedup_seconds``.
+    Below WARNING, each call site (file and line) may emit ``burst`` records per
+    ``interval`` seconds. The first record a call site emits after some were
+    dropped says how many, so nothing disappears silently.
+    """
+
+    def __init__(self, burst=60, interval=60.0, dedup_seconds=60.0, clock=time):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.dedup_seconds = dedup_seconds
+        self.clock = clock
+        self.dropped = 0
+        self._recent = {}
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        now = self.clock.monotonic()
+        site = (record.pathname, record.lineno)
+        message = (record.levelno, record.getMessage())
+        with self._lock:
+            window = self._windows.get(site)
+            if window is None or now - window[0] >= self.interval:
+                window = self._windows[site] = [now, 0, window[2] if window else 0]
+
+            last_seen = self._recent.get(message)
+            if last_seen is not None and now - last_seen < self.dedup_seconds:
+                return self._drop(window)
+            if record.levelno < logging.WARNING and window[1] >= self.burst:
+                return self._drop(window)
+
+            if len(self._recent) > 10000:
+                self._recent = {key: seen for key, seen in self._recent.items() if now - seen < self.dedup_seconds}
+            self._recent[message] = now
+            window[1] += 1
+            suppressed, window[2] = window[2], 0
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+    def _drop(self, window):
+        window[2] += 1
+        self.dropped += 1
+        return False
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the writer falls behind"""
+
+    def prepare(self, record):
+        # Only the cheap part happens on the logging thread; the traceback is kept
+        # apart from the message so the JSON formatter can put it in its own field
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            telemetry.count('log_messages_dropped', reason='queue_full')
+
+
+def setup_logging(level=None, log_format=None, queue_size=10000):
+    """Send the root logger's records through a rate limit and a queue to a writer thread
+
+    The calling thread only filters and enqueues records; formatting and writing
+    to stderr happen on the listener's thread. LOG_FORMAT picks ``json`` (the
+    default) or the classic ``text`` format. Returns the started listener.
+    """
+    level = level or os.getenv('LOG_LEVEL', 'INFO').upper()
+    log_format = log_format or os.getenv('LOG_FORMAT', 'json')
+
+    stream = logging.StreamHandler(sys.stderr)
+    if log_format == 'json':
+        stream.setFormatter(JsonFormatter())
+    else:
+        stream.setFormatter(logging.Formatter(TEXT_FORMAT, TEXT_DATE_FORMAT))
+
+    rate_limit = RateLimitFilter(
+        burst=int(os.getenv('LOG_BURST', '60')),
+        interval=float(os.getenv('LOG_BURST_SECONDS', '60')),
+        dedup_seconds=float(os.getenv('LOG_DEDUP_SECONDS', '60'))
+    )
+    handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    handler.addFilter(rate_limit)
+    telemetry.gauge('log_messages_dropped_by_rate_limit', lambda: rate_limit.dropped)
+    telemetry.gauge('log_queue_depth', handler.queue.qsize)
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    listener.start()
+    # Flush whatever is still queued when the process exits
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener):
+    try:
+        listener.stop()
+    except AttributeError:
+        # Already stopped
+        pass
@@ -1,4 +1,7 @@
 terraform {
+  # removed blocks need 1.7
+  required_version = ">= 1.7"
+
   required_providers {
     google = {
       source  = "hashicorp/google"
@@ -15,7 +18,19 @@ provider "google" {
 
 locals {
   env = var.environments[var.target_env]
+  # Workers are spread round-robin over the environment's zones
+  zones = local.env.zones != null ? local.env.zones : [local.env.zone]
   service_account_id = "video-processor-controller"
+  controller_roles = [
+    "roles/compute.admin",
+    "roles/monitoring.metricWriter",
+    "roles/iam.serviceAccountUser",
+    "roles/resourcemanager.projectIamAdmin",
+    "roles/billing.projectManager",
+    "roles/logging.logWriter",
+    "roles/artifactregistry.reader",
+    "roles/run.invoker"
+  ]
 }
 
 # Create service account if it doesn't exist
@@ -34,30 +49,42 @@ resource "google_service_account" "cost_manager" {
   }
 }
 
-# IAM bindings for the service account
-resource "google_project_iam_member" "cost_manager_roles" {
-  for_each = toset([
-    "roles/compute.admin",
-    "roles/monitoring.metricWriter",
-    "roles/iam.serviceAccountUser",
-    "roles/resourcemanager.projectIamAdmin",
-    "roles/billing.projectManager",
-    "roles/logging.logWriter",
-    "roles/artifactregistry.reader",
-    "roles/run.invoker"
-  ])
-
-  project = local.env.project_id
-  role    = each.key
+# IAM bindings for the controller's service account in every environment's project.
+# They only live in the default workspace: destroying another environment's
+# workspace must not revoke what the controller needs to enforce the others.
+resource "google_project_iam_member" "controller_roles" {
+  for_each = terraform.workspace == "default" ? {
+    for pair in setproduct(distinct([for env in var.environments : env.project_id]), local.controller_roles) :
+    "${pair[0]}/${pair[1]}" => { project = pair[0], role = pair[1] }
+  } : {}
+
+  project = each.value.project
+  role    = each.value.role
   member  = "serviceAccount:video-processor-controller@e360-lab.iam.gserviceaccount.com"
 }
 
+# Bindings used to be created in every workspace; forget them without revoking,
+# the default workspace recreates them above
+removed {
+  from = google_project_iam_member.cost_manager_roles
+
+  lifecycle {
+    destroy = false
+  }
+}
+
 # Worker Instances
 resource "google_compute_instance" "worker" {
-  count        = var.instance_count
-  name         = "video-processor-e360-${format("%03d", count.index + 1)}"
-  machine_type = var.machine_type
-  zone         = local.env.zone
+  count        = local.env.instance_count
+  name         = "video-processor-${var.target_env}-${format("%03d", count.index + 1)}"
+  machine_type = local.env.machine_type
+  zone         = local.zones[count.index % length(local.zones)]
+
+  # The controller selects its fleet by these labels across all zones
+  labels = {
+    spender-fleet = "video-processor"
+    spender-env   = var.target_env
+  }
 
   boot_disk {
     initialize_params {
@@ -106,7 +133,9 @@ resource "google_artifact_registry_repository" "cost_manager" {
 }
 
 # Cloud Run Job
+# One controller manages every environment, so it only lives in the default workspace
 resource "google_cloud_run_v2_job" "cost_manager" {
+  count    = terraform.workspace == "default" ? 1 : 0
   name     = "cost-manager-${var.target_env}"
   location = local.env.region
 
@@ -159,8 +188,19 @@ resource "google_cloud_run_v2_job" "cost_manager" {
   }
 }
 
+moved {
+  from = google_cloud_run_v2_job.cost_manager
+  to   = google_cloud_run_v2_job.cost_manager[0]
+}
+
 # Create a key for local development
 resource "google_service_account_key" "cost_manager" {
+  count              = terraform.workspace == "default" ? 1 : 0
   service_account_id = "projects/e360-lab/serviceAccounts/video-processor-controller@e360-lab.iam.gserviceaccount.com"
   private_key_type   = "TYPE_GOOGLE_CREDENTIALS_FILE"
 }
+
+moved {
+  from = google_service_account_key.cost_manager
+  to   = google_service_account_key.cost_manager[0]
+}
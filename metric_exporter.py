@@ -0,0 +1,200 @@
+import logging
+import random
+import threading
+import time
+from collections import deque
+from google.api import metric_pb2
+from google.api_core import exceptions as api_exceptions
+from google.cloud import monitoring_v3
+from instrumentation import telemetry
+
+# Cloud Monitoring accepts at most 200 time series per CreateTimeSeries request
+MAX_SERIES_PER_REQUEST = 200
+
+RETRYABLE_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.TooManyRequests,
+    api_exceptions.Aborted,
+)
+
+
+def _timestamp(when):
+    seconds = int(when)
+    return {"seconds": seconds, "nanos": int((when - seconds) * 10**9)}
+
+
+def gauge_series(metric_type, value, metric_labels, resource_labels, end_time=None):
+    """Build a single-point GAUGE time series on a generic_node resource"""
+    # For GAUGE metrics, start_time must equal end_time
+    now = end_time if end_time is not None else time.time()
+    return _single_point_series(metric_type, value, metric_labels, resource_labels, now, now)
+
+
+def cumulative_series(metric_type, value, metric_labels, resource_labels, start_time, end_time=None):
+    """Build a single-point CUMULATIVE time series counting from ``start_time``"""
+    end_time = end_time if end_time is not None else time.time()
+    series = _single_point_series(metric_type, value, metric_labels, resource_labels, start_time, end_time)
+    series.metric_kind = metric_pb2.MetricDescriptor.MetricKind.CUMULATIVE
+    return series
+
+
+def _single_point_series(metric_type, value, metric_labels, resource_labels, start_time, end_time):
+    series = monitoring_v3.TimeSeries()
+    series.metric.type = metric_type
+    series.resource.type = "generic_node"
+    for key, label in metric_labels.items():
+        series.metric.labels[key] = label
+    for key, label in resource_labels.items():
+        series.resource.labels[key] = label
+
+    if isinstance(value, float):
+        typed_value = {"double_value": value}
+    else:
+        typed_value = {"int64_value": value}
+
+    point = monitoring_v3.Point({
+        "interval": {
+            "end_time": _timestamp(end_time),
+            "start_time": _timestamp(start_time)
+        },
+        "value": typed_value
+    })
+    series.points = [point]
+    return series
+
+
+def series_key(project_id, series):
+    """Identify the series a point belongs to"""
+    return (
+        project_id,
+        series.metric.type,
+        tuple(sorted(series.metric.labels.items())),
+        series.resource.type,
+        tuple(sorted(series.resource.labels.items())),
+    )
+
+
+class MetricExporter:
+    """Queues metric points and writes them to Cloud Monitoring from a background thread
+
+    Every flush packs all pending series for a project into as few
+    CreateTimeSeries requests as possible. Only the latest point of each
+    series is kept per flush, which is also what the API requires, unless it
+    was submitted with ``coalesce=False``: such points (rollup deltas, where
+    each one counts) are all written, one point per series per request.
+    """
+
+    def __init__(self, client, flush_interval=10.0, max_queue=2000, max_retries=5):
+        self.client = client
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_retries = max_retries
+        self.dropped = 0
+        self.coalesced = 0
+        self.requests_sent = 0
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="metric-exporter", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, project_id, series, coalesce=True):
+        """Queue a series for the next flush without blocking on Monitoring"""
+        key = series_key(project_id, series)
+        with self._condition:
+            if len(self._queue) >= self.max_queue:
+                self._coalesce()
+            if len(self._queue) >= self.max_queue:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append((key, series, coalesce))
+
+    def _coalesce(self):
+        """Keep only the latest queued point of each series that may be coalesced"""
+        latest = {}
+        kept = []
+        for key, series, coalesce in self._queue:
+            if coalesce:
+                latest.pop(key, None)
+                latest[key] = series
+            else:
+                kept.append((key, series, coalesce))
+        self.coalesced += len(self._queue) - len(latest) - len(kept)
+        self._queue = deque(kept + [(key, series, True) for key, series in latest.items()])
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._closed:
+                    self._condition.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def flush(self):
+        """Write everything queued so far"""
+        with self._condition:
+            self._coalesce()
+            pending = list(self._queue)
+            self._queue.clear()
+        if not pending:
+            return
+
+        # A request may carry one point per series, so repeated series go out in later rounds, in order
+        rounds = []
+        seen = {}
+        for key, series, _ in pending:
+            index = seen.get(key, 0)
+            seen[key] = index + 1
+            if index == len(rounds):
+                rounds.append({})
+            rounds[index].setdefault(key[0], []).append(series)
+
+        for by_project in rounds:
+            for project_id, series_list in by_project.items():
+                for start in range(0, len(series_list), MAX_SERIES_PER_REQUEST):
+                    self._send(project_id, series_list[start:start + MAX_SERIES_PER_REQUEST])
+
+    def _send(self, project_id, series_list):
+        delay = 1.0
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.requests_sent += 1
+                telemetry.count('rpc', method='monitoring.timeSeries.create')
+                with telemetry.span('metric_export'):
+                    self.client.create_time_series(
+                        request={
+                            "name": f"projects/{project_id}",
+                            "time_series": series_list
+                        }
+                    )
+                logging.info(f"Wrote {len(series_list)} time series to projects/{project_id}")
+                return
+            except RETRYABLE_ERRORS as e:
+                if attempt == self.max_retries:
+                    logging.error(f"Giving up on {len(series_list)} time series after {attempt + 1} attempts: {str(e)}")
+                    return
+                telemetry.count('rpc_retries', method='monitoring.timeSeries.create')
+                logging.warning(f"Retrying metric write in {delay:.1f}s: {str(e)}")
+                time.sleep(delay + random.uniform(0, delay / 2))
+                delay = min(delay * 2, 30.0)
+            except Exception as e:
+                logging.error(f"Error writing {len(series_list)} time series: {str(e)}")
+                return
+
+    def close(self, timeout=10.0):
+        """Flush outstanding points and stop the background thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        else:
+            self.flush()
@@ -0,0 +1,280 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+DEFAULT_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'pricing_catalog.json')
+
+# Family used when a machine type's family is missing from the catalog
+FALLBACK_FAMILY = 'n2'
+
+# GB of memory per vCPU for predefined machine classes
+MEMORY_PER_VCPU = {'standard': 4.0, 'highmem': 8.0, 'highcpu': 1.0}
+FAMILY_MEMORY_PER_VCPU = {
+    ('n1', 'standard'): 3.75,
+    ('n1', 'highmem'): 6.5,
+    ('n1', 'highcpu'): 0.9,
+    ('c2d', 'highcpu'): 2.0,
+    ('c3', 'highcpu'): 2.0,
+}
+
+PREDEFINED_PATTERN = re.compile(r'^([a-z][a-z0-9]*)-(standard|highmem|highcpu)-(\d+)$')
+CUSTOM_PATTERN = re.compile(r'^(?:([a-z][a-z0-9]*)-)?custom-(\d+)-(\d+)(?:-ext)?$')
+
+# Compute Engine service in the Cloud Billing Catalog API, and how its
+# on-demand SKU descriptions map onto machine families
+COMPUTE_BILLING_SERVICE = 'services/6F81-5844-456A'
+SKU_FAMILY_PREFIXES = (
+    ('N1 Predefined Instance', 'n1'),
+    ('N2D AMD Instance', 'n2d'),
+    ('N2 Instance', 'n2'),
+    ('E2 Instance', 'e2'),
+    ('Compute optimized', 'c2'),
+    ('C2D AMD Instance', 'c2d'),
+    ('C3 Instance', 'c3'),
+    ('T2D AMD Instance', 't2d'),
+    ('Memory-optimized Instance', 'm1'),
+)
+
+
+class MachineSpec:
+    """vCPU and memory shape of a machine type"""
+
+    __slots__ = ('name', 'family', 'vcpus', 'memory_gb')
+
+    def __init__(self, name, family, vcpus, memory_gb):
+        self.name = name
+        self.family = family
+        self.vcpus = vcpus
+        self.memory_gb = memory_gb
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire after ``ttl`` seconds"""
+
+    def __init__(self, maxsize=256, ttl=86400.0, clock=time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < self.clock.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (self.clock.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+def family_of(machine_type):
+    """Machine family of a machine type name, e.g. n2 for n2-standard-32"""
+    if machine_type.startswith('custom-'):
+        return 'n1'
+    return machine_type.split('-', 1)[0]
+
+
+def parse_machine_type(machine_type):
+    """Derive the spec of a predefined or custom machine type from its name, or None"""
+    match = PREDEFINED_PATTERN.match(machine_type)
+    if match:
+        family, machine_class, vcpus = match.group(1), match.group(2), int(match.group(3))
+        per_vcpu = FAMILY_MEMORY_PER_VCPU.get((family, machine_class), MEMORY_PER_VCPU[machine_class])
+        return MachineSpec(machine_type, family, vcpus, vcpus * per_vcpu)
+    match = CUSTOM_PATTERN.match(machine_type)
+    if match:
+        family = match.group(1) or 'n1'
+        return MachineSpec(machine_type, family, int(match.group(2)), int(match.group(3)) / 1024.0)
+    return None
+
+
+class PricingCatalog:
+    """Prices machine types from an on-disk rate snapshot
+
+    Specs are derived from machine type names where possible; anything else
+    (shared-core or special shapes not listed in the snapshot) is looked up once
+    through the Compute API and kept in the shared spec cache.
+    """
+
+    def __init__(self, path=DEFAULT_CATALOG_PATH, machine_types_client=None,
+                 cache_size=256, cache_ttl=86400.0, clock=time):
+        self.path = path
+        self.machine_types_client = machine_types_client
+        with open(path, 'r') as f:
+            data = json.load(f)
+        self.updated = data.get('updated')
+        self.families = data.get('families', {})
+        self.machine_types = data.get('machine_types', {})
+        self.specs = TTLCache(cache_size, cache_ttl, clock)
+        self.prices = TTLCache(cache_size, cache_ttl, clock)
+
+    def spec(self, machine_type, project_id=None, zone=None):
+        """Return the MachineSpec of a machine type"""
+        spec = self.specs.get(machine_type)
+        if spec is not None:
+            return spec
+
+        listed = self.machine_types.get(machine_type)
+        if listed is not None:
+            spec = MachineSpec(machine_type, family_of(machine_type), listed['vcpus'], listed['memory_gb'])
+        else:
+            spec = parse_machine_type(machine_type)
+        if spec is None:
+            spec = self._fetch_spec(machine_type, project_id, zone)
+        self.specs.put(machine_type, spec)
+        return spec
+
+    def _fetch_spec(self, machine_type, project_id, zone):
+        from google.cloud import compute_v1
+
+        if self.machine_types_client is None or not project_id or not zone:
+            raise ValueError(f"Machine type {machine_type} is not in the pricing catalog")
+        logging.info(f"Looking up unlisted machine type {machine_type} via Compute API")
+        info = self.machine_types_client.get(request=compute_v1.GetMachineTypeRequest(
+            project=project_id,
+            zone=zone,
+            machine_type=machine_type
+        ))
+        return MachineSpec(machine_type, family_of(machine_type), info.guest_cpus, info.memory_mb / 1024.0)
+
+    def rates(self, family, region):
+        """Return (price per vCPU hour, price per GB hour) for a family in a region"""
+        entry = self.families.get(family)
+        if entry is None:
+            logging.warning(f"No rates for machine family {family}, using {FALLBACK_FAMILY} rates")
+            entry = self.families[FALLBACK_FAMILY]
+        rates = entry.get('regions', {}).get(region) or entry['default']
+        return rates['vcpu'], rates['memory_gb']
+
+    def hourly_price(self, machine_type, region, project_id=None, zone=None):
+        """On-demand price per hour of one instance of ``machine_type`` in ``region``"""
+        key = (machine_type, region)
+        price = self.prices.get(key)
+        if price is None:
+            spec = self.spec(machine_type, project_id, zone)
+            cpu_price, memory_price = self.rates(spec.family, region)
+            price = spec.vcpus * cpu_price + spec.memory_gb * memory_price
+            self.prices.put(key, price)
+        return price
+
+    def price_many(self, shapes, project_id=None):
+        """Price a list of (machine type, region, zone), looking each distinct one up only once"""
+        unique = {shape: None for shape in shapes}
+        for machine_type, region, zone in unique:
+            unique[(machine_type, region, zone)] = self.hourly_price(machine_type, region, project_id, zone)
+        return [unique[shape] for shape in shapes]
+
+
+def family_for_sku(description):
+    for prefix, family in SKU_FAMILY_PREFIXES:
+        if description.startswith(prefix):
+            return family
+    return None
+
+
+def unit_price(sku):
+    """Hourly on-demand unit price of a billing SKU"""
+    expression = sku['pricingInfo'][0]['pricingExpression']
+    rate = expression['tieredRates'][-1]['unitPrice']
+    return int(rate.get('units', 0)) + rate.get('nanos', 0) / 1e9
+
+
+def refresh_catalog(path, regions=None, default_region='us-central1'):
+    """Rebuild the rate snapshot from the Cloud Billing Catalog API"""
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+
+    credentials, _ = google.auth.default(scopes=['https://www.googleapis.com/auth/cloud-platform'])
+    session = AuthorizedSession(credentials)
+
+    families = {}
+    page_token = ''
+    while True:
+        response = session.get(
+            f'https://cloudbilling.googleapis.com/v1/{COMPUTE_BILLING_SERVICE}/skus',
+            params={'pageSize': 5000, 'pageToken': page_token}
+        )
+        response.raise_for_status()
+        body = response.json()
+        for sku in body.get('skus', []):
+            description = sku.get('description', '')
+            if sku.get('category', {}).get('usageType') != 'OnDemand':
+                continue
+            if ' running in ' not in description or 'Custom' in description or 'Sole Tenancy' in description:
+                continue
+            if ' Core ' in description:
+                kind = 'vcpu'
+            elif ' Ram ' in description:
+                kind = 'memory_gb'
+            else:
+                continue
+            family = family_for_sku(description)
+            if family is None:
+                continue
+            price = unit_price(sku)
+            for region in sku.get('serviceRegions', []):
+                if regions and region not in regions:
+                    continue
+                region_rates = families.setdefault(family, {'regions': {}})['regions'].setdefault(region, {})
+                region_rates[kind] = price
+        page_token = body.get('nextPageToken')
+        if not page_token:
+            break
+
+    for family, entry in families.items():
+        entry['regions'] = {
+            region: rates for region, rates in sorted(entry['regions'].items())
+            if 'vcpu' in rates and 'memory_gb' in rates
+        }
+        default = entry['regions'].get(default_region) or next(iter(entry['regions'].values()), None)
+        if default is not None:
+            entry['default'] = default
+
+    # Keep hand-maintained entries the billing catalog doesn't describe
+    existing = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            existing = json.load(f)
+    catalog = {
+        'updated': datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ'),
+        'families': {family: entry for family, entry in sorted(families.items()) if 'default' in entry},
+        'machine_types': existing.get('machine_types', {}),
+    }
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(catalog, f, indent=2)
+        f.write('\n')
+    os.replace(f"{path}.tmp", path)
+    logging.info(f"Wrote rates for {len(catalog['families'])} machine families to {path}")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    parser = argparse.ArgumentParser(description="Refresh the machine type pricing snapshot")
+    parser.add_argument('--output', default=DEFAULT_CATALOG_PATH)
+    parser.add_argument('--region', action='append', dest='regions',
+                        help="Only keep rates for this region (repeatable)")
+    args = parser.parse_args()
+    refresh_catalog(args.output, args.regions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from google.cloud import compute_v1
+from instrumentation import telemetry
+from inventory import FLEET_LABEL, FLEET_LABEL_VALUE, ENV_LABEL, INSTANCE_NAME_PREFIX
+
+PROVISION_MODES = ('terraform', 'bulk')
+
+# Same worker shape as google_compute_instance.worker in main.tf
+WORKER_IMAGE = 'projects/debian-cloud/global/images/family/debian-11'
+WORKER_DISK_GB = 100
+WORKER_SERVICE_ACCOUNT = 'video-processor-controller@e360-lab.iam.gserviceaccount.com'
+WORKER_STARTUP_SCRIPT = """#!/bin/bash
+apt-get update
+apt-get install -y python3-pip
+pip3 install google-cloud-compute google-cloud-monitoring
+"""
+
+
+def worker_name(env_name, index):
+    """Name of an environment's index-th worker, matching Terraform's naming"""
+    return f"{INSTANCE_NAME_PREFIX}{env_name}-{index:03d}"
+
+
+def worker_properties(env_name, machine_type, service_account=WORKER_SERVICE_ACCOUNT):
+    """Instance properties of one worker"""
+    return compute_v1.InstanceProperties(
+        machine_type=machine_type,
+        labels={FLEET_LABEL: FLEET_LABEL_VALUE, ENV_LABEL: env_name},
+        disks=[compute_v1.AttachedDisk(
+            boot=True,
+            auto_delete=True,
+            initialize_params=compute_v1.AttachedDiskInitializeParams(
+                source_image=WORKER_IMAGE,
+                disk_size_gb=WORKER_DISK_GB
+            )
+        )],
+        network_interfaces=[compute_v1.NetworkInterface(
+            network='global/networks/default',
+            access_configs=[compute_v1.AccessConfig(name='External NAT', type_='ONE_TO_ONE_NAT')]
+        )],
+        service_accounts=[compute_v1.ServiceAccount(
+            email=service_account,
+            scopes=['https://www.googleapis.com/auth/cloud-platform']
+        )],
+        metadata=compute_v1.Metadata(items=[compute_v1.Items(key='startup-script', value=WORKER_STARTUP_SCRIPT)])
+    )
+
+
+class ProvisionBatch:
+    """Workers created by one bulk-insert call, all or nothing"""
+
+    def __init__(self, names, machine_type, zones):
+        self.names = names
+        self.machine_type = machine_type
+        # Zones to try in order; the first is where the batch is placed if it can be
+        self.zones = zones
+        self.placed_zone = None
+        self.placed_machine_type = None
+
+
+class ProvisionRun:
+    """Batches of one environment's provisioning, in flight on the provisioner's pool"""
+
+    def __init__(self, env_name, futures, started):
+        self.env_name = env_name
+        self.futures = futures
+        self.started = started
+        self.cancelled = threading.Event()
+        # Seconds from start until the first and the latest batch was running
+        self.first_batch_seconds = None
+        self.last_batch_seconds = None
+
+    @property
+    def requested(self):
+        return sum(len(batch.names) for batch in self.futures.values())
+
+    def done(self):
+        return all(future.done() for future in self.futures)
+
+    def cancel(self):
+        """Start no further batches or retries; calls already in flight still complete"""
+        self.cancelled.set()
+        for future in self.futures:
+            future.cancel()
+
+    def wait(self, timeout=None):
+        wait(self.futures, timeout=timeout)
+        return self.done()
+
+    def created(self):
+        return [name for future, batch in self.futures.items()
+                if future.done() and not future.cancelled() and future.exception() is None
+                for name in batch.names]
+
+    def failed(self):
+        """Batches that could not be placed anywhere, by error"""
+        return {f"{batch.names[0]}..{batch.names[-1]}": str(future.exception())
+                for future, batch in self.futures.items()
+                if future.done() and not future.cancelled() and future.exception() is not None}
+
+
+class BulkProvisioner:
+    """Creates workers through the Compute bulk-insert API instead of Terraform
+
+    The fleet is split into batches that start small and double up to
+    ``batch_size``, so the first workers are running (and spending) within one
+    small operation while the rest follow. Batches are issued concurrently and
+    their operations waited on in parallel. A batch that fails, typically on
+    zone capacity or quota, is retried in the environment's other zones and
+    then with each fallback machine type.
+    """
+
+    def __init__(self, compute_client, batch_size=100, initial_batch=10, max_workers=8,
+                 fallback_machine_types=(), operation_timeout=600.0, service_account=WORKER_SERVICE_ACCOUNT,
+                 clock=time):
+        self.compute_client = compute_client
+        self.batch_size = max(1, batch_size)
+        self.initial_batch = max(1, min(initial_batch, self.batch_size))
+        self.fallback_machine_types = list(fallback_machine_types)
+        self.operation_timeout = operation_timeout
+        self.service_account = service_account
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='provision')
+
+    def plan_batches(self, env_name, pools, existing_names=()):
+        """Split the workers missing from ``existing_names`` into ramped batches, zones round-robin"""
+        existing = set(existing_names)
+        batches = []
+        index = 0
+        size = self.initial_batch
+        for pool in pools:
+            names = []
+            for _ in range(pool['instance_count']):
+                index += 1
+                name = worker_name(env_name, index)
+                if name not in existing:
+                    names.append(name)
+            zones = pool['zones']
+            while names:
+                start = len(batches) % len(zones)
+                batches.append(ProvisionBatch(names[:size], pool['machine_type'], zones[start:] + zones[:start]))
+                names = names[size:]
+                size = min(size * 2, self.batch_size)
+        return batches
+
+    def provision(self, project_id, env_name, pools, existing_names=()):
+        """Start creating an environment's missing workers and return the run without waiting"""
+        started = self.clock.monotonic()
+        run = ProvisionRun(env_name, {}, started)
+        for batch in self.plan_batches(env_name, pools, existing_names):
+            run.futures[self.executor.submit(self._insert_batch, project_id, env_name, batch, run)] = batch
+        if run.futures:
+            logging.info(f"[{env_name}] Provisioning {run.requested} instances in {len(run.futures)} batches")
+        return run
+
+    def _placements(self, batch):
+        for machine_type in [batch.machine_type] + [m for m in self.fallback_machine_types if m != batch.machine_type]:
+            for zone in batch.zones:
+                yield zone, machine_type
+
+    def _insert_batch(self, project_id, env_name, batch, run):
+        error = None
+        for zone, machine_type in self._placements(batch):
+            if run.cancelled.is_set():
+                raise RuntimeError("provisioning cancelled")
+            try:
+                with telemetry.span('provision_batch'):
+                    self._bulk_insert(project_id, env_name, zone, machine_type, batch.names)
+            except Exception as e:
+                error = e
+                logging.warning(f"[{env_name}] Creating {len(batch.names)} x {machine_type} in {zone} failed, "
+                                f"trying the next placement: {str(e)}")
+                continue
+            batch.placed_zone = zone
+            batch.placed_machine_type = machine_type
+            elapsed = self.clock.monotonic() - run.started
+            if run.first_batch_seconds is None:
+                run.first_batch_seconds = elapsed
+            run.last_batch_seconds = max(run.last_batch_seconds or 0.0, elapsed)
+            logging.info(f"[{env_name}] Created {len(batch.names)} x {machine_type} in {zone} after {elapsed:.1f}s")
+            return batch
+        raise error
+
+    def _bulk_insert(self, project_id, env_name, zone, machine_type, names):
+        telemetry.count('rpc', method='compute.instances.bulkInsert')
+        resource = compute_v1.BulkInsertInstanceResource(
+            count=len(names),
+            # All or nothing, so a failed batch can be retried elsewhere as a whole
+            min_count=len(names),
+            instance_properties=worker_properties(env_name, machine_type, self.service_account),
+            per_instance_properties={
+                name: compute_v1.BulkInsertInstanceResourcePerInstanceProperties(name=name) for name in names
+            }
+        )
+        operation = self.compute_client.bulk_insert(
+            project=project_id,
+            zone=zone,
+            bulk_insert_instance_resource_resource=resource
+        )
+        operation.result(timeout=self.operation_timeout)
+
@@ -0,0 +1,98 @@
+import math
+
+METRIC_PREFIX = 'custom.googleapis.com/spender'
+
+# Rollup resolutions, each written as its own metric type
+ROLLUP_PERIODS = (('1m', 60), ('1h', 3600))
+
+# Spend since the previous point of the same series; summing points over any window gives the spend in it
+SPEND_METRIC = METRIC_PREFIX + '/spend_{period}'
+# Time-weighted mean and maximum running instances over the period, told apart by the ``stat`` label
+FLEET_SIZE_METRIC = METRIC_PREFIX + '/fleet_size_{period}'
+# Cumulative spend of an environment's run since it started
+CUMULATIVE_SPEND_METRIC = METRIC_PREFIX + '/env_spend'
+
+
+class RollupPoint:
+    """One closed rollup window"""
+
+    __slots__ = ('period', 'start_time', 'end_time', 'cost', 'spend', 'mean_instances', 'max_instances')
+
+    def __init__(self, period, start_time, end_time, cost, spend, mean_instances, max_instances):
+        self.period = period
+        self.start_time = start_time
+        self.end_time = end_time
+        # Accumulated cost at end_time, and the part of it spent in this window
+        self.cost = cost
+        self.spend = spend
+        self.mean_instances = mean_instances
+        self.max_instances = max_instances
+
+
+class _Window:
+    __slots__ = ('start', 'cost', 'instance_seconds', 'max_instances')
+
+    def __init__(self, start, cost, instance_seconds=0.0, max_instances=0):
+        self.start = start
+        self.cost = cost
+        self.instance_seconds = instance_seconds
+        self.max_instances = max_instances
+
+
+class RollupTracker:
+    """Downsamples one environment's cost and fleet size into per-minute and per-hour points
+
+    Fed with every observation, it closes a window whenever one of the periods'
+    wall-clock boundaries is crossed and returns one point for it. Cost is
+    interpolated linearly to the boundary, since spend accrues continuously
+    between observations, and the fleet is assumed to keep its last observed
+    size until the next observation. A tick spanning several boundaries closes
+    a single window covering all of them, so the spend of every window still
+    adds up to the total.
+    """
+
+    def __init__(self, start_time, cost=0.0, instances=0, periods=ROLLUP_PERIODS):
+        self.periods = periods
+        self.last_time = start_time
+        self.last_cost = cost
+        self.last_instances = instances
+        self.windows = {name: _Window(start_time, cost) for name, _ in periods}
+
+    def observe(self, now, cost, instances):
+        """Record an observation and return the windows it closes"""
+        if now <= self.last_time:
+            return []
+        points = []
+        elapsed = now - self.last_time
+        for name, seconds in self.periods:
+            window = self.windows[name]
+            boundary = math.floor(now / seconds) * seconds
+            if boundary > window.start:
+                before = boundary - self.last_time
+                cost_at_boundary = self.last_cost + (cost - self.last_cost) * before / elapsed
+                window.instance_seconds += self.last_instances * before
+                window.max_instances = max(window.max_instances, self.last_instances)
+                points.append(self._close(name, window, boundary, cost_at_boundary))
+                self.windows[name] = _Window(boundary, cost_at_boundary, self.last_instances * (now - boundary),
+                                             max(self.last_instances, instances))
+            else:
+                window.instance_seconds += self.last_instances * elapsed
+                window.max_instances = max(window.max_instances, self.last_instances, instances)
+        self.last_time = now
+        self.last_cost = cost
+        self.last_instances = instances
+        return points
+
+    def flush(self):
+        """Close every window at the last observation, for a run that is ending"""
+        points = []
+        for name, _ in self.periods:
+            window = self.windows[name]
+            if self.last_time > window.start:
+                points.append(self._close(name, window, self.last_time, self.last_cost))
+                self.windows[name] = _Window(self.last_time, self.last_cost, 0.0, self.last_instances)
+        return points
+
+    def _close(self, name, window, end_time, cost):
+        return RollupPoint(name, window.start, end_time, cost, cost - window.cost,
+                           window.instance_seconds / (end_time - window.start), window.max_instances)
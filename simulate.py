@@ -0,0 +1,489 @@
+import argparse
+import asyncio
+import heapq
+import itertools
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from google.api_core import exceptions
+import cost_manager
+from controller import AsyncController
+from environments import EnvironmentConfig
+from fake_gcp import FakeClientFactory, FakeFleet
+from inventory import ENV_LABEL
+from provisioning import worker_name
+
+PROJECT_ID = 'sim-project'
+ENV_NAME = 'sim'
+ZONES = ['us-central1-a', 'us-central1-b', 'us-central1-c']
+MACHINE_TYPE = 'n2-standard-8'
+# Campaigns start at a fixed wall time so that runs are reproducible
+EPOCH = 1767225600.0
+
+# Calls that injected API errors can hit. Metric writes are left out because
+# the exporter's retry backoff sleeps in real time.
+FAULT_METHODS = (
+    'compute.instances.aggregatedList',
+    'compute.instances.delete',
+    'compute.instances.stop',
+    'compute.instances.bulkInsert',
+    'monitoring.timeSeries.list',
+)
+
+
+class VirtualClock:
+    """Stands in for the time module; time only passes when the simulation advances it
+
+    Threads sleeping on the clock block until ``advance`` reaches their wake-up
+    time, and sleeping on the thread that created the clock advances it
+    directly. ``call_later`` callbacks run on the advancing thread. After waking
+    sleepers the clock waits ``settle`` real seconds so that their threads act
+    before time moves on.
+    """
+
+    def __init__(self, start_time=EPOCH, settle=0.002):
+        self.epoch = start_time
+        self.settle = settle
+        self._now = 0.0
+        self._sleepers = []
+        self._timers = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._driver = threading.get_ident()
+
+    def time(self):
+        return self.epoch + self._now
+
+    def monotonic(self):
+        return self._now
+
+    def sleep(self, seconds):
+        if seconds <= 0:
+            return
+        if threading.get_ident() == self._driver:
+            self.advance(seconds)
+            return
+        with self._condition:
+            deadline = self._now + seconds
+            self._sleepers.append(deadline)
+            try:
+                while self._now < deadline:
+                    self._condition.wait()
+            finally:
+                self._sleepers.remove(deadline)
+
+    def call_later(self, delay, fn, *args):
+        with self._condition:
+            heapq.heappush(self._timers, (self._now + max(delay, 0.0), next(self._sequence), fn, args))
+
+    def advance(self, seconds, single_step=False):
+        """Move time forward, stopping at every sleeper's wake-up and timer on the way
+
+        With ``single_step`` it returns after the first stop that woke a thread or ran a timer.
+        """
+        target = self._now + max(seconds, 0.0)
+        while True:
+            with self._condition:
+                stops = [deadline for deadline in self._sleepers if deadline > self._now]
+                if self._timers:
+                    stops.append(self._timers[0][0])
+                self._now = max(self._now, min(stops + [target]))
+                due = []
+                while self._timers and self._timers[0][0] <= self._now:
+                    due.append(heapq.heappop(self._timers))
+                woken = any(deadline <= self._now for deadline in self._sleepers)
+                self._condition.notify_all()
+            for _, _, fn, args in due:
+                fn(*args)
+            if woken:
+                time.sleep(self.settle)
+            if self._now >= target or (single_step and (woken or due)):
+                return
+
+
+class FaultInjector:
+    """Fails calls at random at ``error_rate``, and every call to a method during an outage"""
+
+    def __init__(self, clock, error_rate=0.0, seed=0, methods=FAULT_METHODS):
+        self.clock = clock
+        self.error_rate = error_rate
+        self.methods = set(methods)
+        self.outages = {}
+        self.injected = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def outage(self, method, seconds):
+        self.outages[method] = max(self.outages.get(method, 0.0), self.clock.monotonic() + seconds)
+
+    def __call__(self, method):
+        if method not in self.methods:
+            return None
+        with self._lock:
+            failing = self.outages.get(method, 0.0) > self.clock.monotonic() or \
+                self._random.random() < self.error_rate
+            if failing:
+                self.injected += 1
+        if failing:
+            return exceptions.ServiceUnavailable(f"Injected error in {method}")
+        return None
+
+
+def synthetic_trace(names, hours, seed=0, boot_seconds=45.0, slow_boot_fraction=0.05, slow_boot_seconds=600.0,
+                    preemptions_per_hour=0.0, restart_seconds=None, outages_per_day=0.0, outage_seconds=300.0):
+    """Boot times, spot preemptions and API outages for a campaign over workers ``names``
+
+    Each worker boots in about ``boot_seconds``, or ``slow_boot_seconds`` for a
+    ``slow_boot_fraction`` of them. Preemptions arrive at random at
+    ``preemptions_per_hour`` per worker, and a preempted worker starts again
+    after ``restart_seconds`` unless that is None.
+    """
+    rng = random.Random(seed)
+    horizon = hours * 3600.0
+    events = []
+    for name in names:
+        slow = rng.random() < slow_boot_fraction
+        seconds = (slow_boot_seconds if slow else boot_seconds) * rng.uniform(0.8, 1.3)
+        events.append({'event': 'boot', 'instance': name, 'seconds': round(seconds, 1)})
+        if preemptions_per_hour <= 0:
+            continue
+        t = rng.expovariate(preemptions_per_hour / 3600.0)
+        while t < horizon:
+            events.append({'t': round(t, 1), 'event': 'preempt', 'instance': name})
+            if restart_seconds is None:
+                break
+            t += restart_seconds
+            events.append({'t': round(t, 1), 'event': 'restart', 'instance': name})
+            t += rng.expovariate(preemptions_per_hour / 3600.0)
+    if outages_per_day > 0:
+        t = rng.expovariate(outages_per_day / 86400.0)
+        while t < horizon:
+            events.append({'t': round(t, 1), 'event': 'api_outage', 'method': rng.choice(FAULT_METHODS),
+                           'seconds': outage_seconds})
+            t += rng.expovariate(outages_per_day / 86400.0)
+    return sorted(events, key=lambda event: event.get('t', 0.0))
+
+
+def load_trace(path):
+    """Read a trace written by ``write_trace``, one JSON event per line"""
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_trace(path, events):
+    with open(path, 'w') as f:
+        for event in events:
+            f.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+
+class TraceReplay:
+    """Applies timed trace events to the fake fleet and API as the clock reaches them"""
+
+    def __init__(self, clock, fleet, faults, events):
+        self.fleet = fleet
+        self.faults = faults
+        self.preemptions = 0
+        for event in events:
+            if 't' in event:
+                clock.call_later(event['t'], self.apply, event)
+
+    def apply(self, event):
+        kind = event['event']
+        if kind == 'preempt':
+            instance = self.fleet.instances.get(event['instance'])
+            if instance is not None and instance.status == 'RUNNING':
+                self.fleet.stop(event['instance'])
+                self.preemptions += 1
+        elif kind == 'restart':
+            self.fleet.start(event['instance'])
+        elif kind == 'api_outage':
+            self.faults.outage(event['method'], event['seconds'])
+        elif kind == 'cpu':
+            self.fleet.cpu[event['instance']] = event['value']
+        else:
+            logging.warning(f"Skipping unknown trace event {kind}")
+
+
+class SimulatedCostManager(cost_manager.GCPCostManager):
+    """The controller with Terraform's effect on the fake fleet simulated instead of run
+
+    Apply creates an environment's missing workers after ``apply_seconds`` and
+    destroy deletes its workers after ``destroy_seconds``, both on the virtual
+    clock. Everything else is the real controller.
+    """
+
+    def __init__(self, fleet, apply_seconds=60.0, destroy_seconds=90.0, **kwargs):
+        self.fleet = fleet
+        self.apply_seconds = apply_seconds
+        self.destroy_seconds = destroy_seconds
+        super().__init__(**kwargs)
+
+    def init_terraform(self):
+        for env in self.environments:
+            if env.active:
+                self.apply_environment(env, None)
+
+    def prepare_terraform(self):
+        self.terraform_ready = True
+
+    def apply_environment(self, env, fingerprint):
+        count = self.terraform_instance_count(env)
+        zones = env.zones
+        missing = [(worker_name(env.name, index), zones[(index - 1) % len(zones)]) for index in range(1, count + 1)
+                   if worker_name(env.name, index) not in self.fleet.instances]
+        if not missing:
+            return
+
+        def create():
+            for name, zone in missing:
+                self.fleet.create(env.name, zone, [name], env.machine_type)
+
+        self.clock.call_later(self.apply_seconds, create)
+
+    def destroy_environment(self, env):
+        # terraform destroy returns once the workers are gone
+        self.clock.sleep(self.destroy_seconds)
+        for instance in list(self.fleet.instances.values()):
+            if instance.labels.get(ENV_LABEL) == env.name:
+                self.fleet.remove(instance.name)
+        logging.info(f"[{env.name}] Resources cleaned up successfully")
+
+
+class SimulatedController(AsyncController):
+    """The control loop with its sleeps spent on the virtual clock
+
+    The campaign ends once every budget is reached or at ``horizon`` seconds.
+    Metrics are flushed every ``flush_interval`` virtual seconds, as the
+    exporter's thread would.
+    """
+
+    def __init__(self, manager, interval, horizon, flush_interval=10.0, **kwargs):
+        super().__init__(manager, interval, forecaster=manager.forecaster, clock=manager.clock, **kwargs)
+        self.horizon = horizon
+        self.flush_interval = flush_interval
+        self._flushed_at = 0.0
+
+    async def tick(self):
+        if self.clock.monotonic() >= self.horizon:
+            return True
+        return await super().tick()
+
+    async def _sleep(self, delay):
+        target = self.clock.monotonic() + delay
+        while self.clock.monotonic() < target:
+            if self._retiring:
+                # Teardown threads get to reach their next wait before time moves on
+                await asyncio.sleep(self.clock.settle)
+                done = {future for future in self._retiring if future.done()}
+                if done:
+                    self._retiring -= done
+                    return True
+            self.clock.advance(target - self.clock.monotonic(), single_step=bool(self._retiring))
+            if self.clock.monotonic() - self._flushed_at >= self.flush_interval:
+                self._flushed_at = self.clock.monotonic()
+                self.manager.metric_exporter.flush()
+        return False
+
+
+def true_spend(manager, fleet, now):
+    """What every environment was billed according to the fleet's status changes
+
+    Returns {env name: (spend, seconds from the budget trigger until nothing was running)}.
+    """
+    running = {}
+    spend = {}
+    counts = {}
+    stopped = {}
+    envs = {env.name: env for env in manager.environments}
+    triggers = {name: manager.clock.epoch + env.retire_started
+                for name, env in envs.items() if env.retire_started is not None}
+
+    def bill(instance, until):
+        env = envs[instance.labels[ENV_LABEL]]
+        rate = manager.get_instance_cost_per_hour(env, instance.machine_type.rsplit('/', 1)[-1],
+                                                  instance.zone.rsplit('/', 1)[-1])
+        spend[env.name] = spend.get(env.name, 0.0) + rate * (until - running.pop(instance.id)) / 3600.0
+
+    for when, instance, status in sorted(fleet.transitions, key=lambda change: change[0]):
+        name = instance.labels[ENV_LABEL]
+        if status == 'RUNNING' and instance.id not in running:
+            running[instance.id] = when
+            counts[name] = counts.get(name, 0) + 1
+        elif status != 'RUNNING' and instance.id in running:
+            bill(instance, when)
+            counts[name] -= 1
+            if counts[name] == 0 and name in triggers and when >= triggers[name] and name not in stopped:
+                stopped[name] = when - triggers[name]
+    for instance in [instance for instance in fleet.instances.values() if instance.id in running]:
+        bill(instance, now)
+    return {name: (spend.get(name, 0.0), stopped.get(name)) for name in envs}
+
+
+def run_campaign(name, settings, trace, instances, target_spend, hours, machine_type=MACHINE_TYPE, zones=ZONES,
+                 interval=60.0, error_rate=0.0, seed=0, operation_latency=30.0, apply_seconds=60.0,
+                 destroy_seconds=90.0, default_boot=45.0):
+    """Run one policy against a trace on the virtual clock and return its report"""
+    workdir = tempfile.mkdtemp(prefix='spender-sim-')
+    previous_dir = os.getcwd()
+    previous_env = dict(os.environ)
+    started = time.perf_counter()
+    try:
+        # A scratch directory keeps the ledger apart and any .env file out of the way
+        os.chdir(workdir)
+        for variable in ('ENVIRONMENTS_FILE', 'TARGET_ENVS', 'GCP_ZONES', 'FLEET_PLAN_FILE', 'LEASE_PATH'):
+            os.environ.pop(variable, None)
+        os.environ.update({'TARGET_ENV': ENV_NAME, 'UTILIZATION_ACTION': 'off'})
+        os.environ.update(settings)
+        flush_interval = float(os.environ.get('METRIC_FLUSH_SECONDS', '10'))
+        os.environ.update({
+            'LEDGER_PATH': os.path.join(workdir, 'ledger.jsonl'),
+            # Flushes happen on the virtual clock instead
+            'METRIC_FLUSH_SECONDS': '1e9',
+        })
+
+        clock = VirtualClock()
+        fleet = FakeFleet(PROJECT_ID, clock)
+        fleet.transitions = []
+        boots = {event['instance']: event['seconds'] for event in trace if event['event'] == 'boot'}
+        fleet.boot_delay = lambda instance_name: boots.get(instance_name, default_boot)
+        faults = FaultInjector(clock, error_rate, seed)
+        replay = TraceReplay(clock, fleet, faults, trace)
+        clients = FakeClientFactory({PROJECT_ID: fleet}, operation_latency=operation_latency, clock=clock,
+                                    faults=faults)
+
+        config = EnvironmentConfig(ENV_NAME, PROJECT_ID, None, zones[0], instances, machine_type,
+                                   target_spend=target_spend, zones=zones)
+        manager = SimulatedCostManager(fleet, apply_seconds, destroy_seconds, environments=[config],
+                                       clients=clients, clock=clock)
+        controller = SimulatedController(manager, float(os.getenv('CHECK_INTERVAL_MINUTES', interval / 60.0)) * 60,
+                                         hours * 3600.0, flush_interval)
+        asyncio.run(controller.run())
+        # Teardowns, reconciles and worker replacements still under way finish on the virtual clock
+        while not all(future.done() for future in manager.reconciles + list(manager.replacements.values())):
+            clock.advance(1.0, single_step=True)
+        now = clock.time()
+
+        report = {
+            'policy': name,
+            'settings': settings,
+            'simulated_hours': clock.monotonic() / 3600.0,
+            'wall_seconds': time.perf_counter() - started,
+            'budget_reached': manager.finished,
+            'ticks': controller.ticks,
+            'cutoffs': controller.cutoffs,
+            'skipped_ticks': controller.skipped_ticks,
+            'rpcs': clients.counter.total(),
+            'rpcs_by_method': clients.counter.snapshot(),
+            'injected_errors': faults.injected,
+            'preemptions': replay.preemptions,
+            'environments': [],
+        }
+        billed = true_spend(manager, fleet, now)
+        for env in manager.environments:
+            spend, teardown_seconds = billed[env.name]
+            report['environments'].append({
+                'name': env.name,
+                'target_spend': env.target_spend,
+                'true_spend': spend,
+                'accounted_spend': env.accumulated_cost,
+                'overshoot': spend - env.target_spend,
+                'overshoot_percent': 100.0 * (spend - env.target_spend) / env.target_spend,
+                'cutoff_hours': env.retire_started / 3600.0 if env.retire_started is not None else None,
+                'teardown_seconds': teardown_seconds,
+                'still_running': sum(1 for instance in fleet.instances.values()
+                                     if instance.status == 'RUNNING' and instance.labels[ENV_LABEL] == env.name),
+            })
+
+        manager.metric_exporter.close()
+        manager.ledger.close()
+        manager.executor.shutdown()
+        return report
+    finally:
+        os.chdir(previous_dir)
+        os.environ.clear()
+        os.environ.update(previous_env)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def parse_policy(text):
+    """NAME:KEY=VALUE,KEY=VALUE into a name and controller settings"""
+    name, _, assignments = text.partition(':')
+    settings = {}
+    for assignment in filter(None, assignments.split(',')):
+        key, _, value = assignment.partition('=')
+        settings[key.strip()] = value.strip()
+    return name, settings
+
+
+def main():
+    """Replay a fleet and spend policies against the controller on a virtual clock"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--policy', action='append', default=[],
+                        help="NAME:KEY=VALUE,... controller settings to compare, e.g. "
+                             "'fast:POLL_MIN_SECONDS=2,TEARDOWN_ACTION=stop' (repeatable)")
+    parser.add_argument('--instances', type=int, default=100)
+    parser.add_argument('--machine-type', default=MACHINE_TYPE)
+    parser.add_argument('--target-spend', type=float, default=500.0)
+    parser.add_argument('--hours', type=float, default=24.0, help='Campaign length in simulated hours')
+    parser.add_argument('--interval', type=float, default=60.0, help='Base poll interval in seconds')
+    parser.add_argument('--trace', help='Replay this recorded trace instead of generating one')
+    parser.add_argument('--record-trace', help='Write the trace used to this file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--boot-seconds', type=float, default=45.0)
+    parser.add_argument('--slow-boot-fraction', type=float, default=0.05)
+    parser.add_argument('--slow-boot-seconds', type=float, default=600.0)
+    parser.add_argument('--preemptions-per-hour', type=float, default=0.0, help='Per worker')
+    parser.add_argument('--restart-seconds', type=float, help='Preempted workers start again after this long')
+    parser.add_argument('--outages-per-day', type=float, default=0.0)
+    parser.add_argument('--outage-seconds', type=float, default=300.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of API calls that fail')
+    parser.add_argument('--operation-latency', type=float, default=30.0,
+                        help='Seconds until a delete, stop or bulk insert completes')
+    parser.add_argument('--apply-seconds', type=float, default=60.0)
+    parser.add_argument('--destroy-seconds', type=float, default=90.0)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    # Per-tick logging would swamp a day of ticks
+    logging.basicConfig(level=logging.WARNING)
+    logging.disable(logging.WARNING)
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        names = [worker_name(ENV_NAME, index) for index in range(1, args.instances + 1)]
+        trace = synthetic_trace(names, args.hours, args.seed, args.boot_seconds, args.slow_boot_fraction,
+                                args.slow_boot_seconds, args.preemptions_per_hour, args.restart_seconds,
+                                args.outages_per_day, args.outage_seconds)
+    if args.record_trace:
+        write_trace(args.record_trace, trace)
+
+    policies = [parse_policy(text) for text in args.policy] or [('default', {})]
+    results = {
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('policy', 'output')},
+        'campaigns': [
+            run_campaign(name, settings, trace, args.instances, args.target_spend, args.hours, args.machine_type,
+                         interval=args.interval, error_rate=args.error_rate, seed=args.seed,
+                         operation_latency=args.operation_latency, apply_seconds=args.apply_seconds,
+                         destroy_seconds=args.destroy_seconds, default_boot=args.boot_seconds)
+            for name, settings in policies
+        ],
+    }
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
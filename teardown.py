@@ -0,0 +1,122 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from dotenv import load_dotenv
+from google.api_core import exceptions
+from google.cloud import compute_v1
+from environments import load_environments
+from instrumentation import telemetry
+from inventory import FleetInventory
+from transport import RefreshingCredentials, ClientFactory
+
+TEARDOWN_ACTIONS = ('delete', 'stop')
+
+# Instances in these states no longer accrue compute charges
+STOPPED_STATUSES = ('STOPPING', 'TERMINATED', 'SUSPENDING', 'SUSPENDED')
+
+
+class TeardownResult:
+    """Outcome of one fleet teardown"""
+
+    def __init__(self, action, requested):
+        self.action = action
+        self.requested = requested
+        self.completed = []
+        self.failed = {}
+        self.pending = []
+        self.seconds = None
+
+    @property
+    def complete(self):
+        return not self.failed and not self.pending
+
+
+class FleetTeardown:
+    """Stops or deletes workers directly through the Compute API, all at once
+
+    Every operation is issued concurrently and waited on in parallel, so the
+    time until spend stops is roughly one operation's latency regardless of
+    fleet size. Operations still running at the deadline are reported as
+    pending and left to finish on their own.
+    """
+
+    def __init__(self, compute_client, action='delete', max_workers=64, deadline=120.0, clock=time):
+        if action not in TEARDOWN_ACTIONS:
+            raise ValueError(f"Unknown teardown action {action}, expected one of {', '.join(TEARDOWN_ACTIONS)}")
+        self.compute_client = compute_client
+        self.action = action
+        self.deadline = deadline
+        self.clock = clock
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='teardown')
+
+    def _stop_instance(self, project_id, record, deadline):
+        telemetry.count('rpc', method=f'compute.instances.{self.action}')
+        try:
+            if self.action == 'delete':
+                operation = self.compute_client.delete(project=project_id, zone=record.zone, instance=record.name)
+            else:
+                operation = self.compute_client.stop(project=project_id, zone=record.zone, instance=record.name)
+            operation.result(timeout=max(1.0, deadline - self.clock.monotonic()))
+        except exceptions.NotFound:
+            # Already gone, which is what we wanted
+            pass
+
+    def teardown(self, project_id, records):
+        """Stop or delete ``records`` and wait for them until the deadline"""
+        started = self.clock.monotonic()
+        deadline = started + self.deadline
+        if self.action == 'stop':
+            records = [record for record in records if record.status not in STOPPED_STATUSES]
+        result = TeardownResult(self.action, len(records))
+
+        futures = {
+            self.executor.submit(self._stop_instance, project_id, record, deadline): record
+            for record in records
+        }
+        done, not_done = wait(futures, timeout=self.deadline)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                result.completed.append(futures[future].name)
+            else:
+                result.failed[futures[future].name] = str(error)
+        result.pending = [futures[future].name for future in not_done]
+        result.seconds = self.clock.monotonic() - started
+        return result
+
+
+def main():
+    """Stop spend for every configured environment without waiting for Terraform"""
+    load_dotenv()
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--action', choices=TEARDOWN_ACTIONS, default=os.getenv('TEARDOWN_ACTION', 'delete'))
+    parser.add_argument('--deadline', type=float, default=float(os.getenv('TEARDOWN_DEADLINE_SECONDS', '120')))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+
+    configs = load_environments(os.getenv('GCP_PROJECT_ID'), os.getenv('TARGET_SPEND', '0'),
+                                os.getenv('GCP_REGION'), os.getenv('GCP_ZONE'))
+    # Concurrent operations need a connection pool as large as the worker pool
+    compute_client = ClientFactory(RefreshingCredentials()).client(compute_v1.InstancesClient)
+    fleet_teardown = FleetTeardown(compute_client, args.action, deadline=args.deadline)
+    complete = True
+    for project_id in sorted({config.project_id for config in configs}):
+        snapshots = FleetInventory(compute_client, project_id).refresh()
+        records = []
+        for config in configs:
+            if config.project_id == project_id and config.name in snapshots:
+                records.extend(snapshots[config.name].instances)
+        result = fleet_teardown.teardown(project_id, records)
+        logging.info(f"Project {project_id}: {args.action} of {result.requested} instances, "
+                     f"{len(result.completed)} done, {len(result.failed)} failed, "
+                     f"{len(result.pending)} pending after {result.seconds:.1f}s")
+        for name, error in result.failed.items():
+            logging.error(f"Error tearing down {name}: {error}")
+        complete = complete and result.complete
+    return 0 if complete else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
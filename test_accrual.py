@@ -0,0 +1,96 @@
+import unittest
+from google.cloud import compute_v1
+from accrual import CostAccrualEngine
+from fake_gcp import FakeClientFactory, FakeFleet
+from inventory import FleetInventory
+from simulate import VirtualClock
+
+PROJECT_ID = 'test-project'
+ZONE = 'us-central1-a'
+# One cent per instance every ten seconds
+RATE = 3.6
+
+
+class CostAccrualEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = VirtualClock()
+        self.fleet = FakeFleet(PROJECT_ID, self.clock)
+        compute = FakeClientFactory({PROJECT_ID: self.fleet}, clock=self.clock).client(compute_v1.InstancesClient)
+        self.inventory = FleetInventory(compute, PROJECT_ID, clock=self.clock)
+
+    def engine(self, since=None):
+        return CostAccrualEngine(lambda records: [RATE] * len(records), since=since, clock=self.clock)
+
+    def observe(self, engine):
+        return engine.observe(self.inventory.refresh()['test'])
+
+    def test_charges_each_instance_for_the_window(self):
+        engine = self.engine()
+        self.fleet.add('test', ZONE, 2, 'n2-standard-8')
+        self.clock.advance(100)
+
+        self.assertAlmostEqual(self.observe(engine), 0.2)
+        self.assertAlmostEqual(engine.hourly_rate, 2 * RATE)
+        self.assertAlmostEqual(engine.zone_charges[ZONE], 0.2)
+
+    def test_nothing_before_since_is_charged(self):
+        # Running for an hour before the engine started watching
+        self.fleet.add('test', ZONE, 1, 'n2-standard-8', started_at=self.clock.time() - 3600)
+        engine = self.engine()
+        self.clock.advance(50)
+
+        self.assertAlmostEqual(self.observe(engine), 0.05)
+
+    def test_instance_stopped_mid_window_is_charged_until_it_stopped(self):
+        engine = self.engine()
+        self.fleet.add('test', ZONE, 2, 'n2-standard-8')
+        self.clock.advance(100)
+        self.observe(engine)
+
+        self.clock.advance(40)
+        self.fleet.stop('video-processor-test-001')
+        self.clock.advance(60)
+
+        self.assertAlmostEqual(self.observe(engine), 0.04 + 0.1)
+        self.assertAlmostEqual(engine.hourly_rate, RATE)
+
+    def test_instance_restarted_mid_window_is_charged_for_both_runs(self):
+        engine = self.engine()
+        self.fleet.add('test', ZONE, 1, 'n2-standard-8')
+        self.clock.advance(10)
+        self.observe(engine)
+
+        self.clock.advance(30)
+        self.fleet.stop('video-processor-test-001')
+        self.clock.advance(20)
+        self.fleet.start('video-processor-test-001')
+        self.clock.advance(50)
+
+        self.assertAlmostEqual(self.observe(engine), 0.03 + 0.05)
+
+    def test_deleted_instance_is_charged_up_to_the_observation(self):
+        engine = self.engine()
+        self.fleet.add('test', ZONE, 2, 'n2-standard-8')
+        self.clock.advance(10)
+        self.observe(engine)
+
+        self.fleet.remove('video-processor-test-002')
+        self.clock.advance(100)
+
+        self.assertAlmostEqual(self.observe(engine), 0.2)
+        self.assertIn('deleted-2', engine.charges)
+
+    def test_unobserved_cost_projects_the_last_rate(self):
+        engine = self.engine()
+        self.assertEqual(engine.unobserved_cost(), 0.0)
+        self.fleet.add('test', ZONE, 3, 'n2-standard-8')
+        self.clock.advance(10)
+        self.observe(engine)
+
+        self.clock.advance(20)
+
+        self.assertAlmostEqual(engine.unobserved_cost(), 0.06)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import math
+import unittest
+from checkquota import FleetPlanner, PlannerCatalog
+from pricing import PricingCatalog
+
+REGION = 'us-central1'
+ZONES = ['us-central1-a', 'us-central1-b']
+
+
+class FleetPlannerTest(unittest.TestCase):
+    def setUp(self):
+        self.pricing = PricingCatalog()
+        self.catalog = PlannerCatalog()
+        self.catalog.machine_types = {
+            'n2-standard-32': {'vcpus': 32, 'memory_gb': 128.0, 'zones': ZONES},
+            'n2-standard-8': {'vcpus': 8, 'memory_gb': 32.0, 'zones': ZONES},
+            'n2d-standard-32': {'vcpus': 32, 'memory_gb': 128.0, 'zones': ZONES},
+            # Not offered in the planned region
+            'c3-standard-88': {'vcpus': 88, 'memory_gb': 352.0, 'zones': ['us-east1-b']},
+        }
+        self.catalog.quotas = {
+            'global': {'CPUS_ALL_REGIONS': 10000},
+            REGION: {'N2_CPUS': 10000, 'N2D_CPUS': 10000, 'CPUS': 10000, 'INSTANCES': 100,
+                     'IN_USE_ADDRESSES': 100, 'DISKS_TOTAL_GB': 100000},
+        }
+
+    def plan(self, max_pools=1):
+        # $150 in 10 hours needs $15 an hour
+        return FleetPlanner(self.catalog, self.pricing, max_pools).plan([REGION], 150.0, 10.0)
+
+    def test_fewest_instances_of_the_largest_type(self):
+        plan = self.plan()
+
+        price = self.pricing.hourly_price('n2-standard-32', REGION)
+        self.assertEqual([pool['machine_type'] for pool in plan['pools']], ['n2-standard-32'])
+        self.assertEqual(plan['instance_count'], math.ceil(15.0 / price))
+        self.assertEqual(plan['pools'][0]['zones'], ZONES)
+        self.assertLessEqual(plan['hours_to_target'], 10.0)
+
+    def test_family_cpu_quota_moves_the_plan_to_another_family(self):
+        self.catalog.quotas[REGION]['N2_CPUS'] = 200
+
+        plan = self.plan()
+
+        self.assertEqual([pool['machine_type'] for pool in plan['pools']], ['n2d-standard-32'])
+        self.assertEqual(plan['instance_count'], 12)
+
+    def test_mixing_types_uses_what_each_quota_leaves(self):
+        self.catalog.quotas[REGION]['N2_CPUS'] = 200
+
+        plan = self.plan(max_pools=2)
+
+        pools = {pool['machine_type']: pool['instance_count'] for pool in plan['pools']}
+        self.assertEqual(pools, {'n2-standard-32': 6, 'n2d-standard-32': 5})
+        self.assertGreaterEqual(plan['hourly_rate'], 15.0)
+
+    def test_no_plan_when_quota_cannot_reach_the_rate(self):
+        self.catalog.quotas[REGION]['INSTANCES'] = 5
+
+        self.assertIsNone(self.plan(max_pools=2))
+
+
+if __name__ == '__main__':
+    unittest.main()
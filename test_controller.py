@@ -0,0 +1,87 @@
+import logging
+import os
+import tempfile
+import unittest
+from unittest import mock
+from environments import EnvironmentConfig
+from fake_gcp import FakeClientFactory, FakeFleet
+from provisioning import worker_name
+from simulate import ENV_NAME, MACHINE_TYPE, PROJECT_ID, SimulatedCostManager, VirtualClock, run_campaign, \
+    synthetic_trace
+
+
+class UtilizationPhaseTest(unittest.TestCase):
+    """The control loop that main() runs has to sample fleet CPU on its own"""
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def test_controller_loop_samples_cpu(self):
+        names = [worker_name(ENV_NAME, index) for index in range(1, 11)]
+        report = run_campaign('replace', {'UTILIZATION_ACTION': 'replace', 'UTILIZATION_INTERVAL_SECONDS': '60'},
+                              synthetic_trace(names, 1.0), instances=10, target_spend=1000.0, hours=1.0)
+
+        self.assertFalse(report['budget_reached'])
+        self.assertGreater(report['ticks'], 10)
+        # One batched query per interval, not one per tick or per worker
+        samples = report['rpcs_by_method'].get('monitoring.timeSeries.list', 0)
+        self.assertGreater(samples, 10)
+        self.assertLessEqual(samples, report['ticks'])
+
+
+class IdleWorkerTest(unittest.TestCase):
+    """Workers whose CPU stays near zero are reported, and replaced only when asked to"""
+
+    SETTINGS = {'UTILIZATION_INTERVAL_SECONDS': '60', 'STARTUP_GRACE_SECONDS': '300', 'IDLE_SAMPLES': '5'}
+
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        names = [worker_name(ENV_NAME, index) for index in range(1, 11)]
+        # Three workers stall from the start and never load their CPU
+        self.trace = synthetic_trace(names, 1.0) + [
+            {'t': 0.0, 'event': 'cpu', 'instance': name, 'value': 0.01} for name in names[:3]]
+
+    def run_policy(self, action):
+        return run_campaign(action, dict(self.SETTINGS, UTILIZATION_ACTION=action), self.trace,
+                            instances=10, target_spend=1000.0, hours=1.0)
+
+    def test_default_is_to_log(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            with mock.patch.dict(os.environ, {'LEDGER_PATH': os.path.join(workdir, 'ledger.jsonl')}):
+                os.environ.pop('UTILIZATION_ACTION', None)
+                clock = VirtualClock()
+                fleet = FakeFleet(PROJECT_ID, clock)
+                config = EnvironmentConfig(ENV_NAME, PROJECT_ID, None, 'us-central1-a', 10, MACHINE_TYPE,
+                                           target_spend=1000.0)
+                manager = SimulatedCostManager(fleet, environments=[config],
+                                               clients=FakeClientFactory({PROJECT_ID: fleet}, clock=clock),
+                                               clock=clock)
+                manager.metric_exporter.close()
+                manager.ledger.close()
+                manager.executor.shutdown()
+
+        self.assertEqual(manager.utilization_action, 'log')
+
+    def test_log_keeps_idle_workers(self):
+        report = self.run_policy('log')
+
+        self.assertGreater(report['rpcs_by_method'].get('monitoring.timeSeries.list', 0), 10)
+        self.assertNotIn('compute.instances.delete', report['rpcs_by_method'])
+        self.assertEqual(report['environments'][0]['still_running'], 10)
+
+    def test_replace_recreates_idle_workers(self):
+        report = self.run_policy('replace')
+
+        deletes = report['rpcs_by_method'].get('compute.instances.delete', 0)
+        self.assertGreaterEqual(deletes, 3)
+        # Only the stalled workers are replaced, each round all three together
+        self.assertEqual(deletes % 3, 0)
+        self.assertFalse(report['budget_reached'])
+        # A round of replacements may still be under way when the campaign ends
+        self.assertGreaterEqual(report['environments'][0]['still_running'], 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
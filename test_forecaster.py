@@ -0,0 +1,41 @@
+import logging
+import unittest
+from forecaster import BurnRateForecaster
+
+
+class BurnRateForecasterTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.INFO)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.forecaster = BurnRateForecaster(teardown_seconds=120.0, min_interval=5.0, max_interval=300.0)
+
+    def test_seconds_to_target(self):
+        self.assertAlmostEqual(self.forecaster.seconds_to_target(90.0, 100.0, 36.0), 1000.0)
+        self.assertEqual(self.forecaster.seconds_to_target(100.0, 100.0, 36.0), 0.0)
+        self.assertIsNone(self.forecaster.seconds_to_target(90.0, 100.0, 0.0))
+
+    def test_cutoff_leaves_the_teardown_lead_time(self):
+        self.assertAlmostEqual(self.forecaster.seconds_to_cutoff('a', 90.0, 100.0, 36.0), 880.0)
+        # Already inside the lead time
+        self.assertEqual(self.forecaster.seconds_to_cutoff('a', 99.0, 100.0, 36.0), 0.0)
+        self.assertIsNone(self.forecaster.seconds_to_cutoff('a', 90.0, 100.0, 0.0))
+
+    def test_measured_teardowns_are_smoothed_per_environment(self):
+        self.assertEqual(self.forecaster.record_teardown('a', 60.0), 60.0)
+        self.assertEqual(self.forecaster.record_teardown('a', 20.0), 40.0)
+
+        self.assertEqual(self.forecaster.lead_time('a'), 40.0)
+        self.assertEqual(self.forecaster.lead_time('b'), 120.0)
+        self.assertAlmostEqual(self.forecaster.seconds_to_cutoff('a', 90.0, 100.0, 36.0), 960.0)
+
+    def test_poll_interval_is_a_quarter_of_the_time_left_within_bounds(self):
+        self.assertEqual(self.forecaster.poll_interval(400.0, 60.0), 100.0)
+        self.assertEqual(self.forecaster.poll_interval(10.0, 60.0), 5.0)
+        self.assertEqual(self.forecaster.poll_interval(36000.0, 60.0), 300.0)
+        # Spend that isn't rising keeps the default
+        self.assertEqual(self.forecaster.poll_interval(None, 60.0), 60.0)
+        self.assertEqual(self.forecaster.poll_interval(float('inf'), 60.0), 60.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import logging
+import os
+import tempfile
+import threading
+import unittest
+from lease import FileLease, LeaderElector, MemoryLease, open_lease
+from simulate import VirtualClock
+
+
+class LeaseTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.clock = VirtualClock()
+        self.store = {}
+
+    def lease(self, holder):
+        return MemoryLease(self.store, holder, ttl=10.0, clock=self.clock)
+
+    def test_held_lease_is_exclusive_until_it_expires(self):
+        a, b = self.lease('a'), self.lease('b')
+        self.assertTrue(a.try_acquire())
+        self.assertFalse(b.try_acquire())
+        self.assertEqual(b.current_holder, 'a')
+
+        self.clock.advance(5)
+        # Renewing pushes the expiry out again
+        self.assertTrue(a.try_acquire())
+        self.clock.advance(9)
+        self.assertFalse(b.try_acquire())
+
+        self.clock.advance(2)
+        self.assertTrue(b.try_acquire())
+        self.assertEqual(b.generation, 2)
+        self.assertEqual(b.previous_holder, 'a')
+        self.assertFalse(a.try_acquire())
+        self.assertEqual(a.current_holder, 'b')
+
+    def test_released_lease_is_free_at_once(self):
+        a, b = self.lease('a'), self.lease('b')
+        a.try_acquire()
+        a.release()
+
+        self.assertTrue(b.try_acquire())
+        self.assertIsNone(b.previous_holder)
+
+    def test_file_lease_is_shared_through_the_file(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, 'spender.lease')
+            a = FileLease(path, 'a', ttl=10.0, clock=self.clock)
+            b = open_lease('file', path, holder='b', ttl=10.0)
+            b.clock = self.clock
+            self.assertTrue(a.try_acquire())
+            self.assertFalse(b.try_acquire())
+
+            self.clock.advance(11)
+            self.assertTrue(b.try_acquire())
+
+            # A lease file that can't be read counts as free
+            with open(path, 'w') as f:
+                f.write('{"holder": "b", "exp')
+            self.assertTrue(a.try_acquire())
+
+    def test_unknown_backend_is_rejected(self):
+        with self.assertRaises(ValueError):
+            open_lease('etcd', 'localhost:2379')
+
+
+class LeaderElectorTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.clock = VirtualClock()
+        self.store = {}
+
+    def elector(self, holder, **kwargs):
+        elector = LeaderElector(MemoryLease(self.store, holder, ttl=10.0, clock=self.clock), clock=self.clock,
+                                **kwargs)
+        self.addCleanup(elector.stop)
+        return elector
+
+    def test_first_replica_leads_without_taking_over(self):
+        elector = self.elector('a', renew_interval=60.0)
+        elector.wait_for_leadership()
+
+        self.assertTrue(elector.leader)
+        self.assertFalse(elector.took_over)
+
+    def test_standby_takes_over_once_the_lease_expires(self):
+        MemoryLease(self.store, 'a', ttl=10.0, clock=self.clock).try_acquire()
+        warmed = threading.Event()
+        elector = self.elector('b', renew_interval=60.0, poll_interval=1.0)
+
+        elector.wait_for_leadership(warm=warmed.set, warm_interval=3.0)
+
+        self.assertTrue(elector.took_over)
+        self.assertEqual(elector.lease.previous_holder, 'a')
+        # Polled every second, so it took over within a second of the expiry
+        self.assertGreaterEqual(self.clock.monotonic(), 10.0)
+        self.assertLessEqual(self.clock.monotonic(), 11.0)
+        self.assertTrue(warmed.wait(5.0))
+
+    def test_stop_releases_the_lease(self):
+        elector = self.elector('a', renew_interval=60.0)
+        elector.wait_for_leadership()
+        elector.stop()
+
+        self.assertFalse(elector.leader)
+        self.assertTrue(MemoryLease(self.store, 'b', clock=self.clock).try_acquire())
+
+    def test_leader_whose_lease_is_taken_is_told_at_once(self):
+        lost = threading.Event()
+        elector = self.elector('a', renew_interval=0.01, on_lost=lost.set)
+        elector.wait_for_leadership()
+
+        # Renewals stalled past the expiry and another replica took over
+        self.store['state'] = {'holder': 'b', 'expires': self.clock.time() + 10.0, 'generation': 2}
+
+        self.assertTrue(lost.wait(5.0))
+        self.assertFalse(elector.leader)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import logging
+import os
+import tempfile
+import unittest
+from ledger import CostLedger
+from simulate import VirtualClock
+
+
+class CostLedgerTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.path = os.path.join(workdir.name, 'ledger.jsonl')
+        self.clock = VirtualClock()
+
+    def ledger(self, **kwargs):
+        ledger = CostLedger(self.path, clock=self.clock, **kwargs)
+        self.addCleanup(ledger.close)
+        ledger.load()
+        return ledger
+
+    def test_resume_restores_the_latest_run(self):
+        ledger = self.ledger()
+        ledger.start_run('a', 'run-1', 100.0, started_at=1000.0)
+        ledger.checkpoint('a', 'run-1', 12.5, 1600.0, {'us-central1-a': 12.5})
+        ledger.start_run('b', 'run-2', 50.0)
+        ledger.close_run('b', 'run-2')
+        ledger.record_teardown('a', 42.0)
+        ledger.close()
+
+        resumed = self.ledger()
+        state = resumed.states['a']
+        self.assertEqual(state.run_id, 'run-1')
+        self.assertEqual(state.started_at, 1000.0)
+        self.assertEqual(state.accumulated_cost, 12.5)
+        self.assertEqual(state.zone_costs, {'us-central1-a': 12.5})
+        self.assertEqual(state.checkpoint_time, 1600.0)
+        self.assertFalse(state.closed)
+        self.assertTrue(resumed.states['b'].closed)
+        self.assertEqual(resumed.teardowns, {'a': 42.0})
+
+    def test_checkpoints_of_an_earlier_run_are_ignored(self):
+        ledger = self.ledger()
+        ledger.start_run('a', 'run-1', 100.0)
+        ledger.start_run('a', 'run-2', 100.0)
+        ledger.checkpoint('a', 'run-1', 99.0, 1600.0)
+
+        self.assertEqual(ledger.states['a'].run_id, 'run-2')
+        self.assertEqual(ledger.states['a'].accumulated_cost, 0.0)
+
+    def test_compaction_keeps_the_latest_state(self):
+        ledger = self.ledger(compact_after=10)
+        ledger.start_run('a', 'run-1', 100.0, started_at=1000.0)
+        for minute in range(1, 20):
+            ledger.checkpoint('a', 'run-1', float(minute), 1000.0 + 60 * minute)
+        ledger.record_teardown('a', 30.0)
+        ledger.close()
+
+        with open(self.path) as f:
+            self.assertLess(len(f.readlines()), 10)
+        state = self.ledger().states['a']
+        self.assertEqual(state.started_at, 1000.0)
+        self.assertEqual(state.accumulated_cost, 19.0)
+        self.assertEqual(state.checkpoint_time, 1000.0 + 60 * 19)
+
+    def test_torn_last_line_is_truncated(self):
+        ledger = self.ledger()
+        ledger.start_run('a', 'run-1', 100.0)
+        ledger.checkpoint('a', 'run-1', 5.0, 1600.0)
+        ledger.close()
+        with open(self.path, 'a') as f:
+            f.write('{"type":"checkpoint","env":"a","run_id":"run-1","co')
+
+        resumed = self.ledger()
+        self.assertEqual(resumed.states['a'].accumulated_cost, 5.0)
+        resumed.checkpoint('a', 'run-1', 6.0, 1700.0)
+        resumed.close()
+
+        # The next append starts on a fresh line, so nothing is lost on the following load
+        self.assertEqual(self.ledger().states['a'].accumulated_cost, 6.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import logging
+import unittest
+from unittest import mock
+from google.api_core import exceptions
+from fake_gcp import FakeMetricServiceClient, RpcCounter
+from metric_exporter import MAX_SERIES_PER_REQUEST, MetricExporter, gauge_series
+from simulate import VirtualClock
+
+METRIC = 'custom.googleapis.com/spender/test'
+
+
+def series(index, value=1.0):
+    return gauge_series(METRIC, value, {'worker': str(index)}, {'node_id': 'test'}, end_time=1000.0 + index)
+
+
+class RecordingMetricClient(FakeMetricServiceClient):
+    """Remembers the project and size of every write that succeeded"""
+
+    def __init__(self, faults=None):
+        super().__init__(RpcCounter(faults), clock=VirtualClock())
+        self.batches = []
+
+    def create_time_series(self, request=None, name=None, time_series=None):
+        super().create_time_series(request=request)
+        self.batches.append((request['name'], len(request['time_series'])))
+
+
+class MetricExporterTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.ERROR)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def test_series_are_packed_into_full_requests(self):
+        client = RecordingMetricClient()
+        exporter = MetricExporter(client)
+        for index in range(450):
+            exporter.submit('a', series(index))
+        exporter.submit('b', series(0))
+
+        exporter.flush()
+
+        self.assertEqual(sorted(client.batches), [('projects/a', 50), ('projects/a', MAX_SERIES_PER_REQUEST),
+                                                  ('projects/a', MAX_SERIES_PER_REQUEST), ('projects/b', 1)])
+
+    def test_only_the_latest_point_of_a_series_is_written(self):
+        client = RecordingMetricClient()
+        exporter = MetricExporter(client)
+        for value in range(5):
+            exporter.submit('a', series(0, float(value)))
+
+        exporter.flush()
+
+        self.assertEqual(client.batches, [('projects/a', 1)])
+        self.assertEqual(exporter.coalesced, 4)
+
+    def test_points_that_each_count_go_out_in_rounds(self):
+        client = RecordingMetricClient()
+        exporter = MetricExporter(client)
+        for value in range(3):
+            exporter.submit('a', series(0, float(value)), coalesce=False)
+        exporter.submit('a', series(1))
+
+        exporter.flush()
+
+        # One point per series per request
+        self.assertEqual(client.batches, [('projects/a', 2), ('projects/a', 1), ('projects/a', 1)])
+        self.assertEqual(exporter.coalesced, 0)
+
+    def test_full_queue_coalesces_before_dropping(self):
+        exporter = MetricExporter(RecordingMetricClient(), max_queue=3)
+        for value in range(5):
+            exporter.submit('a', series(0, float(value)))
+        self.assertEqual(exporter.dropped, 0)
+
+        for index in range(1, 5):
+            exporter.submit('a', series(index))
+        self.assertEqual(exporter.dropped, 2)
+
+    @mock.patch('metric_exporter.time.sleep')
+    def test_transient_errors_are_retried(self, sleep):
+        failures = iter([exceptions.ServiceUnavailable('down'), exceptions.TooManyRequests('slow down')])
+        client = RecordingMetricClient(faults=lambda method: next(failures, None))
+        exporter = MetricExporter(client)
+        exporter.submit('a', series(0))
+
+        exporter.flush()
+
+        self.assertEqual(exporter.requests_sent, 3)
+        self.assertEqual(sleep.call_count, 2)
+        self.assertEqual(client.batches, [('projects/a', 1)])
+
+    @mock.patch('metric_exporter.time.sleep')
+    def test_gives_up_after_max_retries(self, sleep):
+        client = RecordingMetricClient(faults=lambda method: exceptions.ServiceUnavailable('down'))
+        exporter = MetricExporter(client, max_retries=2)
+        exporter.submit('a', series(0))
+
+        exporter.flush()
+
+        self.assertEqual(exporter.requests_sent, 3)
+        self.assertEqual(client.batches, [])
+
+    def test_other_errors_are_not_retried(self):
+        client = RecordingMetricClient(faults=lambda method: exceptions.PermissionDenied('no'))
+        exporter = MetricExporter(client)
+        exporter.submit('a', series(0))
+
+        exporter.flush()
+
+        self.assertEqual(exporter.requests_sent, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
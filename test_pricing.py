@@ -0,0 +1,37 @@
+import logging
+import unittest
+from fake_gcp import FakeMachineTypesClient, RpcCounter
+from pricing import PricingCatalog
+
+
+class PricingCatalogTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.counter = RpcCounter()
+        self.pricing = PricingCatalog(machine_types_client=FakeMachineTypesClient(self.counter))
+
+    def test_unlisted_machine_type_is_looked_up_once(self):
+        spec = self.pricing.spec('a3-highgpu-8g', 'proj', 'us-central1-a')
+        self.pricing.spec('a3-highgpu-8g', 'proj', 'us-central1-a')
+
+        self.assertEqual(spec.name, 'a3-highgpu-8g')
+        self.assertEqual(spec.vcpus, 8)
+        self.assertEqual(spec.memory_gb, 32.0)
+        self.assertEqual(self.counter.counts['compute.machineTypes.get'], 1)
+
+    def test_unlisted_machine_type_needs_a_project_and_zone(self):
+        with self.assertRaises(ValueError):
+            self.pricing.spec('a3-highgpu-8g')
+
+    def test_price_many_prices_each_shape_once(self):
+        shape = ('n2-standard-32', 'us-central1', 'us-central1-a')
+        prices = self.pricing.price_many([shape, shape, ('n2-standard-16', 'us-central1', 'us-central1-a')])
+
+        self.assertEqual(prices[0], prices[1])
+        self.assertEqual(prices[0], self.pricing.hourly_price('n2-standard-32', 'us-central1'))
+        self.assertAlmostEqual(prices[2] * 2, prices[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
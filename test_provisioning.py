@@ -0,0 +1,80 @@
+import logging
+import unittest
+from google.cloud import compute_v1
+from fake_gcp import FakeClientFactory, FakeFleet
+from provisioning import BulkProvisioner, worker_name
+
+PROJECT_ID = 'test-project'
+ZONES = ['us-central1-a', 'us-central1-b']
+
+
+class BulkProvisionerTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.WARNING)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        self.fleet = FakeFleet(PROJECT_ID)
+        self.clients = FakeClientFactory({PROJECT_ID: self.fleet})
+        self.compute = self.clients.client(compute_v1.InstancesClient)
+        self.provisioner = BulkProvisioner(self.compute, batch_size=8, initial_batch=2,
+                                           fallback_machine_types=['n2d-standard-8'])
+        self.addCleanup(self.provisioner.executor.shutdown)
+
+    def provision(self, count, existing=()):
+        pools = [{'machine_type': 'n2-standard-8', 'instance_count': count, 'zones': ZONES}]
+        run = self.provisioner.provision(PROJECT_ID, 'test', pools, existing)
+        self.assertTrue(run.wait(10.0))
+        return run
+
+    def test_batches_ramp_up_and_alternate_zones(self):
+        batches = self.provisioner.plan_batches('test', [
+            {'machine_type': 'n2-standard-8', 'instance_count': 30, 'zones': ZONES}])
+
+        self.assertEqual([len(batch.names) for batch in batches], [2, 4, 8, 8, 8])
+        self.assertEqual([batch.zones[0] for batch in batches], ZONES * 2 + ZONES[:1])
+
+    def test_existing_workers_are_not_created_again(self):
+        batches = self.provisioner.plan_batches('test', [
+            {'machine_type': 'n2-standard-8', 'instance_count': 4, 'zones': ZONES}],
+            [worker_name('test', 1), worker_name('test', 3)])
+
+        self.assertEqual([name for batch in batches for name in batch.names],
+                         [worker_name('test', 2), worker_name('test', 4)])
+
+    def test_creates_every_missing_worker(self):
+        run = self.provision(14)
+
+        self.assertEqual(len(run.created()), 14)
+        self.assertEqual(run.failed(), {})
+        self.assertEqual(len(self.fleet.instances), 14)
+        self.assertEqual(self.clients.counter.counts['compute.instances.bulkInsert'], 3)
+
+    def test_exhausted_zone_falls_back_to_the_next(self):
+        self.compute.exhausted_zones.add(ZONES[0])
+
+        run = self.provision(14)
+
+        self.assertEqual(len(run.created()), 14)
+        self.assertEqual({batch.placed_zone for batch in run.futures.values()}, {ZONES[1]})
+        # The two batches that started in the exhausted zone were issued twice
+        self.assertEqual(self.clients.counter.counts['compute.instances.bulkInsert'], 5)
+
+    def test_exhausted_machine_type_falls_back_to_the_next(self):
+        self.compute.exhausted_machine_types.add('n2-standard-8')
+
+        run = self.provision(6)
+
+        self.assertEqual(len(run.created()), 6)
+        self.assertEqual({batch.placed_machine_type for batch in run.futures.values()}, {'n2d-standard-8'})
+
+    def test_batch_with_nowhere_to_go_fails(self):
+        self.compute.exhausted_zones.update(ZONES)
+
+        run = self.provision(2)
+
+        self.assertEqual(run.created(), [])
+        self.assertEqual(len(run.failed()), 1)
+        self.assertEqual(self.fleet.instances, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
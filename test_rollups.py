@@ -0,0 +1,62 @@
+import unittest
+from rollups import RollupTracker
+
+
+class RollupTrackerTest(unittest.TestCase):
+    def test_window_closes_at_the_boundary_with_interpolated_cost(self):
+        tracker = RollupTracker(0.0, instances=2)
+        self.assertEqual(tracker.observe(30.0, 1.0, 2), [])
+
+        points = tracker.observe(90.0, 3.0, 4)
+
+        self.assertEqual(len(points), 1)
+        point = points[0]
+        self.assertEqual((point.period, point.start_time, point.end_time), ('1m', 0.0, 60.0))
+        self.assertAlmostEqual(point.cost, 2.0)
+        self.assertAlmostEqual(point.spend, 2.0)
+        self.assertAlmostEqual(point.mean_instances, 2.0)
+        self.assertEqual(point.max_instances, 2)
+
+    def test_fleet_size_is_time_weighted(self):
+        tracker = RollupTracker(0.0, instances=0)
+        tracker.observe(15.0, 0.0, 4)
+
+        point, = tracker.observe(60.0, 1.0, 4)
+
+        # No workers for 15s, then four for 45s
+        self.assertAlmostEqual(point.mean_instances, 3.0)
+        self.assertEqual(point.max_instances, 4)
+
+    def test_tick_spanning_several_boundaries_closes_one_window(self):
+        tracker = RollupTracker(0.0, instances=1)
+
+        point, = tracker.observe(200.0, 10.0, 1)
+
+        self.assertEqual((point.start_time, point.end_time), (0.0, 180.0))
+        self.assertAlmostEqual(point.spend, 9.0)
+
+    def test_spend_of_every_window_adds_up_to_the_total(self):
+        tracker = RollupTracker(0.0)
+        points = []
+        cost = 0.0
+        for tick in range(1, 400):
+            cost += 0.01 * (tick % 7)
+            points.extend(tracker.observe(tick * 17.0, cost, tick % 5))
+        points.extend(tracker.flush())
+
+        for period in ('1m', '1h'):
+            spend = sum(point.spend for point in points if point.period == period)
+            self.assertAlmostEqual(spend, cost)
+        self.assertEqual(tracker.flush(), [])
+
+    def test_resumed_tracker_counts_from_the_restored_cost(self):
+        tracker = RollupTracker(0.0, cost=50.0, instances=1)
+
+        point, = tracker.observe(60.0, 51.0, 1)
+
+        self.assertAlmostEqual(point.cost, 51.0)
+        self.assertAlmostEqual(point.spend, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import logging
+import threading
+from datetime import datetime, timezone
+import google.auth
+import requests
+from google.auth.transport.requests import Request
+from requests.adapters import HTTPAdapter
+from instrumentation import telemetry
+
+CLOUD_PLATFORM_SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
+
+
+class RefreshingCredentials:
+    """Application default credentials held in process and refreshed ahead of expiry
+
+    A background timer refreshes the token ``refresh_margin`` seconds before it
+    expires, so API calls never wait on a token refresh. If a refresh fails it is
+    retried every ``retry_interval`` seconds; callers still refresh synchronously
+    if the token has actually expired by then.
+    """
+
+    def __init__(self, credentials=None, refresh_margin=300.0, retry_interval=30.0):
+        if credentials is None:
+            credentials, _ = google.auth.default(scopes=[CLOUD_PLATFORM_SCOPE])
+        self.credentials = credentials
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.refreshes = 0
+        # Token refreshes reuse one keep-alive connection to the token endpoint
+        self._request = Request(session=requests.Session())
+        self._lock = threading.Lock()
+        self._timer = None
+        self._closed = False
+
+    def start(self):
+        """Fetch a token now and keep it fresh in the background"""
+        self.refresh()
+        self._schedule(self._seconds_until_refresh())
+        return self
+
+    def refresh(self):
+        with self._lock:
+            self.credentials.refresh(self._request)
+            self.refreshes += 1
+        telemetry.count('credential_refreshes')
+
+    def token(self):
+        """A valid access token, refreshed here only if the background refresh fell behind"""
+        if not self.credentials.valid:
+            self.refresh()
+        return self.credentials.token
+
+    def _seconds_until_refresh(self):
+        expiry = self.credentials.expiry
+        if expiry is None:
+            return None
+        # google.auth keeps expiry as a naive UTC datetime
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        return max(0.0, (expiry - now).total_seconds() - self.refresh_margin)
+
+    def _schedule(self, delay):
+        if self._closed or delay is None:
+            return
+        self._timer = threading.Timer(delay, self._refresh_in_background)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+            delay = self._seconds_until_refresh()
+        except Exception as e:
+            logging.error(f"Error refreshing credentials: {str(e)}")
+            delay = self.retry_interval
+        self._schedule(delay)
+
+    def close(self):
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+
+
+class ClientFactory:
+    """Builds Google API clients that share credentials, one HTTP connection pool and one gRPC channel per host
+
+    Clients are cached by class, so asking for the same client twice returns the
+    same instance. REST clients (Compute) get the shared, larger connection pool
+    mounted on their session so concurrent calls reuse keep-alive connections;
+    gRPC clients (Monitoring, Resource Manager) are built on a cached channel.
+    """
+
+    def __init__(self, credentials, pool_size=64):
+        self.credentials = credentials
+        self.adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._clients = {}
+        self._channels = {}
+        self._lock = threading.Lock()
+
+    def client(self, client_class):
+        """The shared instance of ``client_class``"""
+        with self._lock:
+            client = self._clients.get(client_class)
+            if client is None:
+                client = self._build(client_class)
+                self._clients[client_class] = client
+            return client
+
+    def _build(self, client_class):
+        try:
+            grpc_transport = client_class.get_transport_class('grpc')
+        except KeyError:
+            grpc_transport = None
+
+        if grpc_transport is None:
+            client = client_class(credentials=self.credentials.credentials)
+            session = getattr(client.transport, '_session', None)
+            if session is not None:
+                session.mount('https://', self.adapter)
+            return client
+
+        host = grpc_transport.DEFAULT_HOST
+        channel = self._channels.get(host)
+        if channel is None:
+            channel = grpc_transport.create_channel(host, credentials=self.credentials.credentials)
+            self._channels[host] = channel
+        return client_class(transport=grpc_transport(channel=channel))
+
+    def close(self):
+        for channel in self._channels.values():
+            channel.close()
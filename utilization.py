@@ -0,0 +1,192 @@
+import time
+from array import array
+from google.cloud import monitoring_v3
+from instrumentation import telemetry
+from inventory import FLEET_LABEL, FLEET_LABEL_VALUE
+
+CPU_METRIC = 'compute.googleapis.com/instance/cpu/utilization'
+UTILIZATION_ACTIONS = ('off', 'log', 'replace')
+
+# Why a worker is considered unhealthy
+IDLE = 'idle'
+CRASH_LOOP = 'crash_loop'
+
+
+class UtilizationHistory:
+    """The last ``depth`` CPU utilization samples of every instance, in flat arrays
+
+    Each instance id owns a slot of ``depth`` float32 values used as a ring
+    buffer, so a fleet of thousands costs a few bytes per sample and no
+    per-sample objects. Slots of instances that are gone are reused.
+    """
+
+    def __init__(self, depth=15, capacity=64):
+        self.depth = depth
+        self.capacity = capacity
+        self.slots = {}
+        self._free = []
+        self.values = array('f', [0.0]) * (capacity * depth)
+        self.counts = array('L', [0]) * capacity
+        self.last_end = array('d', [0.0]) * capacity
+
+    def _grow(self):
+        self.values.extend(array('f', [0.0]) * (self.capacity * self.depth))
+        self.counts.extend(array('L', [0]) * self.capacity)
+        self.last_end.extend(array('d', [0.0]) * self.capacity)
+        self._free.extend(range(self.capacity * 2 - 1, self.capacity - 1, -1))
+        self.capacity *= 2
+
+    def _slot(self, instance_id):
+        slot = self.slots.get(instance_id)
+        if slot is None:
+            if not self._free and len(self.slots) >= self.capacity:
+                self._grow()
+            slot = self._free.pop() if self._free else len(self.slots)
+            self.slots[instance_id] = slot
+            self.counts[slot] = 0
+            self.last_end[slot] = 0.0
+        return slot
+
+    def record(self, instance_id, end_time, value):
+        """Add one aligned sample, ignoring samples at or before the latest one already recorded"""
+        slot = self._slot(instance_id)
+        if end_time <= self.last_end[slot]:
+            return False
+        count = self.counts[slot]
+        self.values[slot * self.depth + count % self.depth] = value
+        self.counts[slot] = count + 1
+        self.last_end[slot] = end_time
+        return True
+
+    def recent(self, instance_id, n):
+        """Up to ``n`` most recent samples, oldest first"""
+        slot = self.slots.get(instance_id)
+        if slot is None:
+            return []
+        count = self.counts[slot]
+        n = min(n, count, self.depth)
+        base = slot * self.depth
+        return [self.values[base + index % self.depth] for index in range(count - n, count)]
+
+    def forget(self, instance_id):
+        slot = self.slots.pop(instance_id, None)
+        if slot is not None:
+            self._free.append(slot)
+
+    def retain(self, instance_ids):
+        """Free the slots of every instance not in ``instance_ids``"""
+        for instance_id in [instance_id for instance_id in self.slots if instance_id not in instance_ids]:
+            self.forget(instance_id)
+
+
+class UtilizationSampler:
+    """Fetches CPU utilization of a project's whole fleet with one list_time_series call
+
+    The filter selects the fleet by its label and the aggregation aligns each
+    instance's samples to one mean per ``alignment`` seconds, so the response is
+    a handful of points per instance and fits in one page for thousands of
+    workers. Projects are sampled at most once per ``interval``; the lookback
+    covers Compute's few minutes of metric ingestion delay.
+    """
+
+    def __init__(self, monitoring_client, history, interval=60.0, alignment=60, lookback=600, clock=time):
+        self.monitoring_client = monitoring_client
+        self.history = history
+        self.interval = interval
+        self.alignment = alignment
+        self.lookback = lookback
+        self.clock = clock
+        self.requests = 0
+        self._sampled_at = {}
+
+    def due(self, project_id):
+        sampled_at = self._sampled_at.get(project_id)
+        return sampled_at is None or self.clock.monotonic() - sampled_at >= self.interval
+
+    def sample(self, project_id):
+        """Record the latest samples of every worker in a project, returning how many were new"""
+        self._sampled_at[project_id] = self.clock.monotonic()
+        now = int(self.clock.time())
+        request = monitoring_v3.ListTimeSeriesRequest(
+            name=f"projects/{project_id}",
+            filter=f'metric.type="{CPU_METRIC}" AND '
+                   f'metadata.user_labels."{FLEET_LABEL}"="{FLEET_LABEL_VALUE}"',
+            interval=monitoring_v3.TimeInterval(
+                end_time={"seconds": now},
+                start_time={"seconds": now - self.lookback}
+            ),
+            aggregation=monitoring_v3.Aggregation(
+                alignment_period={"seconds": self.alignment},
+                per_series_aligner=monitoring_v3.Aggregation.Aligner.ALIGN_MEAN
+            ),
+            view=monitoring_v3.ListTimeSeriesRequest.TimeSeriesView.FULL
+        )
+        self.requests += 1
+        telemetry.count('rpc', method='monitoring.timeSeries.list')
+        recorded = 0
+        for series in self.monitoring_client.list_time_series(request=request):
+            instance_id = int(series.resource.labels['instance_id'])
+            # Points come newest first
+            for point in reversed(series.points):
+                end_time = point.interval.end_time.timestamp()
+                if self.history.record(instance_id, end_time, point.value.double_value):
+                    recorded += 1
+        return recorded
+
+
+class FleetHealth:
+    """Flags workers that are running but not working
+
+    A worker is idle when its last ``idle_samples`` samples are all below
+    ``idle_threshold`` CPU, for example because its startup script stalled. It
+    is crash-looping when it was (re)started ``crash_restarts`` times within
+    ``crash_window`` seconds. Workers younger than ``startup_grace`` seconds are
+    never flagged idle.
+    """
+
+    def __init__(self, history, idle_threshold=0.05, idle_samples=10, startup_grace=900.0,
+                 crash_restarts=3, crash_window=1800.0):
+        self.history = history
+        self.idle_threshold = idle_threshold
+        self.idle_samples = idle_samples
+        self.startup_grace = startup_grace
+        self.crash_restarts = crash_restarts
+        self.crash_window = crash_window
+        # instance id -> (last start seen, start times within the crash window)
+        self._starts = {}
+
+    def _restarts(self, record, now):
+        if record.last_start is None:
+            return 0
+        last_start, starts = self._starts.get(record.id, (None, []))
+        if record.last_start != last_start:
+            starts = starts + [record.last_start]
+        starts = [started for started in starts if now - started <= self.crash_window]
+        self._starts[record.id] = (record.last_start, starts)
+        return len(starts)
+
+    def assess(self, records, now):
+        """Return {record: reason} for the unhealthy ones among an environment's ``records``"""
+        unhealthy = {}
+        for record in records:
+            if self._restarts(record, now) >= self.crash_restarts:
+                unhealthy[record] = CRASH_LOOP
+                continue
+            if not record.running:
+                continue
+            started = record.last_start or record.created_at
+            if started is None or now - started < self.startup_grace:
+                continue
+            samples = self.history.recent(record.id, self.idle_samples)
+            if len(samples) == self.idle_samples and max(samples) < self.idle_threshold:
+                unhealthy[record] = IDLE
+        return unhealthy
+
+    def forget(self, instance_id):
+        self._starts.pop(instance_id, None)
+        self.history.forget(instance_id)
+
+    def retain(self, instance_ids):
+        for instance_id in [instance_id for instance_id in self._starts if instance_id not in instance_ids]:
+            del self._starts[instance_id]
+        self.history.retain(instance_ids)
@@ -4,6 +4,7 @@ variable "environments" {
     project_id         = string
     region            = string
     zone              = string
+    zones             = optional(list(string))
     billing_account_id = optional(string)
     instance_count    = number
     machine_type      = string
@@ -12,19 +13,19 @@ variable "environments" {
 }
 
 variable "target_env" {
-  description = "Target environment to deploy (e360 or yh)"
+  description = "Environment to deploy; the controller applies each environment in its own workspace"
   type        = string
   default     = "e360"
 }
 
 variable "instance_count" {
-  description = "Number of worker instances to create"
+  description = "Number of worker instances for target_env (workers use environments[target_env].instance_count)"
   type        = number
   default     = 4
 }
 
 variable "machine_type" {
-  description = "Machine type for worker instances"
+  description = "Machine type for target_env (workers use environments[target_env].machine_type)"
   type        = string
   default     = "n2-standard-32"
 }